@@ -33,13 +33,45 @@
 
 # Script that uses either test app or qemu controlled by python-pexpect
 
-import sys, autotest_data, autotest_runner
+import sys, autotest_data, autotest_runner, autotest_perf
 
 
 
 def usage():
-	print"Usage: autotest.py [test app|test iso image]",
-	print "[target] [whitelist|-blacklist]"
+	print"Usage: autotest.py [--history=file] [--shard=n/total]",
+	print "[--perf-baseline=file] [--perf-tolerance=fraction]",
+	print "[test app|test iso image] [target] [whitelist|-blacklist]"
+
+# get optional arguments
+history = None
+shard = None
+perf_baseline = None
+perf_tolerance = autotest_perf.DEFAULT_TOLERANCE
+for arg in sys.argv[1:]:
+	if arg.startswith("--history="):
+		history = arg[len("--history="):]
+	elif arg.startswith("--perf-baseline="):
+		perf_baseline = arg[len("--perf-baseline="):]
+	elif arg.startswith("--perf-tolerance="):
+		try:
+			perf_tolerance = float(arg[len("--perf-tolerance="):])
+		except ValueError:
+			usage()
+			sys.exit(1)
+	elif arg.startswith("--shard="):
+		try:
+			n, total = map(int, arg[len("--shard="):].split("/"))
+		except ValueError:
+			usage()
+			sys.exit(1)
+		if total < 1 or n < 1 or n > total:
+			usage()
+			sys.exit(1)
+		# shards are numbered from 1 on the command line
+		shard = (n - 1, total)
+	else:
+		continue
+	sys.argv.remove(arg)
 
 if len(sys.argv) < 3:
 	usage()
@@ -70,7 +102,8 @@ else:
 
 print cmdline
 
-runner = autotest_runner.AutotestRunner(cmdline, target, test_blacklist, test_whitelist)
+runner = autotest_runner.AutotestRunner(cmdline, target, test_blacklist,
+	test_whitelist, history, shard, perf_baseline, perf_tolerance)
 
 for test_group in autotest_data.parallel_test_group_list:
 	runner.add_parallel_test_group(test_group)
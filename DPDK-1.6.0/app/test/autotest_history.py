@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+#   BSD LICENSE
+# 
+#   Copyright(c) 2010-2014 Intel Corporation. All rights reserved.
+#   All rights reserved.
+# 
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     * Neither the name of Intel Corporation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#   A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#   OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#   LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#   DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#   THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#   OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Historical autotest run times, used to schedule and shard test groups
+
+import json, os
+
+# number of runs kept for each test
+HISTORY_RUNS = 10
+
+# assumed run time (in seconds) for tests that were never run before
+DEFAULT_TEST_TIME = 10.0
+
+# a perf test is flagged if it takes this much longer than usual
+DEFAULT_PERF_TOLERANCE = 0.2
+
+# run times are kept in a JSON file, keyed by target and test name:
+# {
+#   "version" : 1,
+#   "targets" : {
+#     "x86_64-default-linuxapp-gcc" : {
+#       "Ring performance autotest" : [12.1, 11.9, ...],
+#       ...
+#     }
+#   }
+# }
+class TestHistory:
+	version = 1
+
+	def __init__(self, filename, target):
+		self.filename = filename
+		self.target = target
+		self.targets = {}
+
+		try:
+			f = open(filename)
+		except IOError:
+			# no history yet
+			return
+
+		with f:
+			try:
+				data = json.load(f)
+			except ValueError:
+				print "Ignoring corrupt test history in %s" % filename
+				return
+
+		if data.get("version") == self.version:
+			self.targets = data.get("targets", {})
+
+	def __runs(self, test_name):
+		return self.targets.get(self.target, {}).get(test_name, [])
+
+	# remember how long a test took
+	def record(self, test_name, test_time):
+		tests = self.targets.setdefault(self.target, {})
+		runs = tests.setdefault(test_name, [])
+		runs.append(round(test_time, 3))
+		del runs[:-HISTORY_RUNS]
+
+	# median run time of a test, or None if it was never run
+	def expected_time(self, test_name):
+		runs = sorted(self.__runs(test_name))
+		if not runs:
+			return None
+		mid = len(runs) / 2
+		if len(runs) % 2:
+			return runs[mid]
+		return (runs[mid - 1] + runs[mid]) / 2.0
+
+	# expected run time of a whole test group
+	def group_time(self, test_group):
+		total = 0.0
+		for test in test_group["Tests"]:
+			t = self.expected_time(test["Name"])
+			if t is None:
+				t = DEFAULT_TEST_TIME
+			total += t
+		return total
+
+	# check if a test took significantly longer than it used to.
+	# must be called before the new time is recorded.
+	def is_regression(self, test_name, test_time,
+			tolerance = DEFAULT_PERF_TOLERANCE):
+		expected = self.expected_time(test_name)
+		if expected is None:
+			return False
+		return test_time > expected * (1.0 + tolerance)
+
+	def save(self):
+		# write to a temporary file first so that an interrupted
+		# run doesn't leave us with a truncated history
+		tmp = "%s.tmp" % self.filename
+		with open(tmp, "w") as f:
+			json.dump({"version" : self.version, "targets" : self.targets},
+				f, indent = 1, sort_keys = True)
+		os.rename(tmp, self.filename)
+
+
+
+# is the test a performance test (e.g. ring_perf_autotest)
+def is_perf_test(test):
+	return test["Command"].endswith("_perf_autotest")
+
+# order test groups so that the longest ones get started first.
+# with a pool of workers, this keeps the total run time close
+# to the run time of the longest group.
+def sort_longest_first(test_groups, history):
+	return sorted(test_groups, key = history.group_time, reverse = True)
+
+# split test groups into n_shards sets of roughly equal run time
+# and return the ones belonging to shard number "shard" (0-based).
+# groups are handed out longest-first to the least loaded shard,
+# while the original relative order is preserved within a shard,
+# since some groups (e.g. ring_perf) must be run last.
+def shard_groups(test_groups, history, shard, n_shards):
+	loads = [0.0] * n_shards
+	assignment = {}
+
+	order = sorted(range(len(test_groups)),
+		key = lambda i: history.group_time(test_groups[i]),
+		reverse = True)
+
+	for i in order:
+		target = loads.index(min(loads))
+		loads[target] += history.group_time(test_groups[i])
+		assignment[i] = target
+
+	return [group for i, group in enumerate(test_groups)
+		if assignment[i] == shard]
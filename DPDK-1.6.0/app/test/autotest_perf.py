@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+#   BSD LICENSE
+# 
+#   Copyright(c) 2010-2014 Intel Corporation. All rights reserved.
+#   All rights reserved.
+# 
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     * Neither the name of Intel Corporation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#   A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#   OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#   LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#   DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#   THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#   OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Parsers for the output of *_perf_autotest tests, and comparison of
+# the resulting metrics against a baseline
+
+import json, re
+
+# default allowed slowdown before a metric is considered a regression
+DEFAULT_TOLERANCE = 0.1
+
+# each parser takes the test log and returns a list of metrics.
+# a metric is a dictionary with the following keys:
+#   "Name" :		unique name of the metric within a test
+#   "Value" :		measured value
+#   "Unit" :		"cycles" (per operation) or "ops/s"
+#   "Higher is better" :	True for rates, False for cycle counts
+#   "Burst" :		burst/bulk size or None
+#   "Cores" :		number of cores used or None
+def metric(name, value, unit = "cycles", burst = None, cores = None):
+	return {
+		"Name" :		name,
+		"Value" :		float(value),
+		"Unit" :		unit,
+		"Higher is better" :	unit != "cycles",
+		"Burst" :		burst,
+		"Cores" :		cores,
+	}
+
+def log_lines(log):
+	return log.replace("\r", "").split("\n")
+
+
+
+# ring_perf_autotest
+# the test prints a section header for every core placement,
+# followed by "<type> (size: <n>): <cycles>" lines
+ring_sections = [
+	("single lcore", 1),
+	("two hyperthreads", 2),
+	("two physical cores", 2),
+	("two NUMA nodes", 2),
+]
+
+def parse_ring_perf(log):
+	metrics = []
+	section = "single lcore"
+	cores = 1
+	for line in log_lines(log):
+		m = re.match(r"### Testing (.*) ###", line)
+		if m:
+			section = m.group(1)
+			for name, n in ring_sections:
+				if name in section:
+					section = name
+					cores = n
+			continue
+		m = re.match(r"(.*) \(size: ([0-9]+)\): ([0-9.]+)$", line)
+		if m:
+			burst = int(m.group(2))
+			metrics.append(metric("%s, size %u, %s" % (m.group(1), burst,
+				section), m.group(3), burst = burst, cores = cores))
+			continue
+		m = re.match(r"(.* (?:single|empty) .*): ([0-9.]+)$", line)
+		if m:
+			metrics.append(metric("%s, %s" % (m.group(1), section),
+				m.group(2), burst = 1, cores = cores))
+	return metrics
+
+# mempool_perf_autotest
+# mempool_autotest cache=<n> cores=<n> n_get_bulk=<n> n_put_bulk=<n>
+# n_keep=<n> rate_persec=<n>
+def parse_mempool_perf(log):
+	metrics = []
+	regexp = r"mempool_autotest cache=([0-9]+) cores=([0-9]+) " \
+		r"n_get_bulk=([0-9]+) n_put_bulk=([0-9]+) n_keep=([0-9]+) " \
+		r"rate_persec=([0-9]+)"
+	for line in log_lines(log):
+		m = re.search(regexp, line)
+		if not m:
+			continue
+		cache, cores, get_bulk, put_bulk, keep, rate = map(int, m.groups())
+		metrics.append(metric("cache %u, cores %u, get %u, put %u, keep %u" %
+			(cache, cores, get_bulk, put_bulk, keep), rate, unit = "ops/s",
+			burst = get_bulk, cores = cores))
+	return metrics
+
+# hash_perf_autotest
+# prints a CSV-like table for hash table operations, another one for
+# hash functions and a single line for FBK hash lookups
+def parse_hash_perf(log):
+	metrics = []
+	for line in log_lines(log):
+		fields = [f.strip() for f in line.split(",")]
+		try:
+			if len(fields) == 8:
+				func, op, key_len, entries, bucket_entries = fields[:5]
+				metrics.append(metric("%s %s, key %s, entries %s, "
+					"bucket entries %s" % (func, op, key_len, entries,
+					bucket_entries), fields[7]))
+			elif len(fields) == 4:
+				func, key_len, init_val, ticks = fields
+				metrics.append(metric("%s, key %s, initial value %s" %
+					(func, int(key_len), int(init_val)), ticks))
+		except ValueError:
+			# table headers
+			continue
+
+		m = re.match(r"Number of ticks per lookup = ([0-9.e+-]+)", line)
+		if m:
+			metrics.append(metric("FBK lookup", m.group(1)))
+	return metrics
+
+# memcpy_perf_autotest
+# each line is the copy size (prefixed with C for compile-time constant
+# sizes) followed by "rte_memcpy - memcpy" tick pairs for each
+# cache to cache, cache to mem, mem to cache and mem to mem
+memcpy_columns = ["cache to cache", "cache to mem", "mem to cache",
+	"mem to mem"]
+
+def parse_memcpy_perf(log):
+	metrics = []
+	for line in log_lines(log):
+		m = re.match(r"(C?)\s*([0-9]+)((?:\s+[0-9]+ -\s*[0-9]+){4})\s*$",
+			line)
+		if not m:
+			continue
+		const, size = m.group(1), int(m.group(2))
+		pairs = re.findall(r"([0-9]+) -\s*([0-9]+)", m.group(3))
+		for column, (rte, libc) in zip(memcpy_columns, pairs):
+			name = "size %s%u, %s" % (const, size, column)
+			metrics.append(metric("rte_memcpy " + name, rte, burst = size))
+			metrics.append(metric("memcpy " + name, libc, burst = size))
+	return metrics
+
+# timer_perf_autotest
+def parse_timer_perf(log):
+	metrics = []
+	action = None
+	iterations = None
+	for line in log_lines(log):
+		m = re.match(r"(Appending|Resetting) ([0-9]+) timers", line)
+		if m:
+			action = m.group(1).lower()
+			iterations = int(m.group(2))
+			continue
+		m = re.search(r"Time per (timer|callback): ([0-9]+)", line)
+		if m and iterations:
+			what = m.group(1)
+			if what == "timer":
+				what = action
+			metrics.append(metric("%s, %u timers" % (what, iterations),
+				m.group(2), burst = iterations, cores = 1))
+			continue
+		m = re.match(r"Time per rte_timer_manage with (.*): ([0-9]+) cycles",
+			line)
+		if m:
+			metrics.append(metric("rte_timer_manage with " + m.group(1),
+				m.group(2), cores = 1))
+	return metrics
+
+# parsers for each test command
+perf_parsers = {
+	"ring_perf_autotest" :		parse_ring_perf,
+	"mempool_perf_autotest" :	parse_mempool_perf,
+	"hash_perf_autotest" :		parse_hash_perf,
+	"memcpy_perf_autotest" :	parse_memcpy_perf,
+	"timer_perf_autotest" :		parse_timer_perf,
+}
+
+
+
+# baseline is a perf report written by a previous run (see PerfReport).
+# a baseline metric may carry its own "Tolerance", otherwise the
+# default one is used.
+def load_baseline(filename):
+	with open(filename) as f:
+		return json.load(f)["Tests"]
+
+# compare metrics of a test against the baseline, returning a list of
+# (metric name, baseline value, new value) tuples for every metric
+# that got worse by more than the tolerance
+def compare(metrics, baseline_metrics, tolerance = DEFAULT_TOLERANCE):
+	baseline = dict((m["Name"], m) for m in baseline_metrics)
+	regressions = []
+	for m in metrics:
+		base = baseline.get(m["Name"])
+		if not base or base["Value"] <= 0:
+			continue
+		tol = base.get("Tolerance", tolerance)
+		if m["Higher is better"]:
+			worse = m["Value"] < base["Value"] * (1.0 - tol)
+		else:
+			worse = m["Value"] > base["Value"] * (1.0 + tol)
+		if worse:
+			regressions.append((m["Name"], base["Value"], m["Value"]))
+	return regressions
+
+# machine-readable report of all perf metrics of a run
+class PerfReport:
+	def __init__(self, target, baseline = None, tolerance = DEFAULT_TOLERANCE):
+		self.target = target
+		self.tolerance = tolerance
+		self.tests = {}
+		self.regressions = {}
+		self.baseline = {}
+		if baseline:
+			self.baseline = load_baseline(baseline)
+
+	# parse test log, store the metrics and return the list of regressions
+	def add(self, test_name, command, log):
+		parser = perf_parsers.get(command)
+		if not parser:
+			return []
+		metrics = parser(log)
+		self.tests[test_name] = metrics
+		regressions = compare(metrics, self.baseline.get(test_name, []),
+			self.tolerance)
+		if regressions:
+			self.regressions[test_name] = [{
+				"Name" :	name,
+				"Baseline" :	base,
+				"Value" :	value,
+			} for name, base, value in regressions]
+		return regressions
+
+	def save(self, filename):
+		with open(filename, "w") as f:
+			json.dump({
+				"Target" :	self.target,
+				"Tolerance" :	self.tolerance,
+				"Tests" :	self.tests,
+				"Regressions" :	self.regressions,
+			}, f, indent = 1, sort_keys = True)
@@ -34,6 +34,7 @@
 # The main logic behind running autotests in parallel
 
 import multiprocessing, sys, pexpect, time, os, StringIO, csv
+import autotest_history, autotest_perf
 
 # wait for prompt
 def wait_prompt(child):
@@ -183,13 +184,30 @@ class AutotestRunner:
 	log_buffers = []
 	blacklist = []
 	whitelist = []
-
-
-	def __init__(self, cmdline, target, blacklist, whitelist):
+	history = None
+	shard = None
+	perf_regressions = []
+	perf_report = None
+
+
+	# history is an optional file name of the test timing database,
+	# shard is an optional (shard number, number of shards) tuple,
+	# perf_baseline is an optional perf report of an earlier run
+	# that perf test results are checked against
+	def __init__(self, cmdline, target, blacklist, whitelist,
+			history = None, shard = None, perf_baseline = None,
+			perf_tolerance = autotest_perf.DEFAULT_TOLERANCE):
 		self.cmdline = cmdline
 		self.target = target
 		self.blacklist = blacklist
 		self.whitelist = whitelist
+		self.shard = shard
+
+		if history:
+			self.history = autotest_history.TestHistory(history, target)
+
+		self.perf_report = autotest_perf.PerfReport(target, perf_baseline,
+			perf_tolerance)
 
 		# log file filename
 		logfile = "%s.log" % target
@@ -249,6 +267,19 @@ class AutotestRunner:
 			test_result, result_str, test_name, \
 				test_time, log, report = result
 
+			# parse perf test output, and fail the test if it got
+			# slower than the baseline
+			test = self.__find_test(test_name)
+			if test and test_result == 0:
+				regressions = self.perf_report.add(test_name,
+					test["Command"], log)
+				if regressions:
+					test_result = -1
+					result_str = "Fail [Perf regression]"
+					for name, base, value in regressions:
+						log += "Perf regression: %s: %.2f (baseline %.2f)\n" % \
+							(name, value, base)
+
 			# get total run time
 			cur_time = time.time()
 			total_time = int(cur_time - self.start)
@@ -267,6 +298,15 @@ class AutotestRunner:
 			# if test failed and it wasn't a "start" test
 			if test_result < 0 and not i == 0:
 				self.fails += 1
+
+			# compare run time against previous runs and remember it.
+			# only successful runs are recorded, failures tend to
+			# be either much faster or time out.
+			if self.history and i != 0 and test_result == 0:
+				if test and autotest_history.is_perf_test(test) and \
+					self.history.is_regression(test_name, test_time):
+					self.perf_regressions.append(test_name)
+				self.history.record(test_name, test_time)
 		
 			# collect logs
 			self.log_buffers.append(log)
@@ -326,7 +366,35 @@ class AutotestRunner:
 			del test_groups[i]
 		
 		return test_groups
-		
+
+	# find test description by test name, None for "start" tests
+	def __find_test(self, test_name):
+		for test_group in self.parallel_test_groups + \
+			self.non_parallel_test_groups:
+			for test in test_group["Tests"]:
+				if test["Name"] == test_name:
+					return test
+		return None
+
+	# reorder and shard test groups according to test history
+	def __schedule_groups(self):
+		history = self.history
+		if not history:
+			# without history, all groups are assumed to be equally long
+			history = autotest_history.TestHistory("", self.target)
+
+		if self.shard:
+			shard, n_shards = self.shard
+			self.parallel_test_groups = autotest_history.shard_groups(
+				self.parallel_test_groups, history, shard, n_shards)
+			self.non_parallel_test_groups = autotest_history.shard_groups(
+				self.non_parallel_test_groups, history, shard, n_shards)
+
+		# non-parallel groups are run one by one, so their order
+		# doesn't affect total run time (and ring_perf must be last)
+		self.parallel_test_groups = autotest_history.sort_longest_first(
+			self.parallel_test_groups, history)
+
 
 
 	# iterate over test groups and run tests associated with them
@@ -336,7 +404,10 @@ class AutotestRunner:
 			self.__filter_groups(self.parallel_test_groups)
 		self.non_parallel_test_groups = \
 			self.__filter_groups(self.non_parallel_test_groups)
-		
+
+		# order longest groups first and pick our shard
+		self.__schedule_groups()
+
 		# create a pool of worker threads
 		if not "baremetal" in self.target:
 			pool = multiprocessing.Pool(processes=1)
@@ -400,12 +471,25 @@ class AutotestRunner:
 			print "Total run time: %02dm %02ds" % (total_time / 60, total_time % 60)
 			if self.fails != 0:
 				print "Number of failed tests: %s" % str(self.fails)
+			if self.perf_regressions:
+				print "Slower than usual: %s" % ", ".join(self.perf_regressions)
 
 			# write summary to logfile
 			self.logfile.write("Summary\n")
 			self.logfile.write("Target: ".ljust(15) + "%s\n" % self.target)
 			self.logfile.write("Tests: ".ljust(15) + "%i\n" % self.n_tests)
 			self.logfile.write("Failed tests: ".ljust(15) + "%i\n" % self.fails)
+			if self.perf_regressions:
+				self.logfile.write("Slower tests: ".ljust(15) + "%s\n" %
+					", ".join(self.perf_regressions))
+
+			# save perf metrics so that they can be used as a baseline
+			if self.perf_report.tests:
+				self.perf_report.save("%s_perf.json" % self.target)
+
+			# keep timings for the next run
+			if self.history:
+				self.history.save()
 		except:
 			print "Exception occured"
 			print sys.exc_info()
@@ -43,6 +43,20 @@ AUTOTEST_DIR := $(RTE_OUTPUT)/autotest-$(DATE)
 
 DIR := $(shell basename $(RTE_OUTPUT))
 
+#
+# AUTOTEST_HISTORY=file keeps test timings across runs, to run the
+# longest test groups first and flag slower performance tests.
+# AUTOTEST_SHARD=n/total runs only a part of the tests, so that
+# the tests can be split between several machines.
+# AUTOTEST_PERF_BASELINE=file fails perf tests whose results are worse
+# than in the given <target>_perf.json of an earlier run by more than
+# AUTOTEST_PERF_TOLERANCE (a fraction, 0.1 by default).
+#
+AUTOTEST_ARGS := $(if $(AUTOTEST_HISTORY),--history=$(abspath $(AUTOTEST_HISTORY)))
+AUTOTEST_ARGS += $(if $(AUTOTEST_SHARD),--shard=$(AUTOTEST_SHARD))
+AUTOTEST_ARGS += $(if $(AUTOTEST_PERF_BASELINE),--perf-baseline=$(abspath $(AUTOTEST_PERF_BASELINE)))
+AUTOTEST_ARGS += $(if $(AUTOTEST_PERF_TOLERANCE),--perf-tolerance=$(AUTOTEST_PERF_TOLERANCE))
+
 #
 # test: launch auto-tests, very simple for now.
 #
@@ -57,7 +71,7 @@ test fast_test ring_test mempool_test perf_test:
 	@mkdir -p $(AUTOTEST_DIR) ; \
 	cd $(AUTOTEST_DIR) ; \
 	if [ -f $(RTE_OUTPUT)/app/test ]; then \
-		python $(RTE_SDK)/app/test/autotest.py \
+		python $(RTE_SDK)/app/test/autotest.py $(AUTOTEST_ARGS) \
 			$(RTE_OUTPUT)/app/test \
 			$(RTE_TARGET) \
 			$(BLACKLIST) $(WHITELIST); \
@@ -74,7 +88,7 @@ coverage:
 		python $(RTE_SDK)/app/cmdline_test/cmdline_test.py \
 			$(RTE_OUTPUT)/app/cmdline_test; \
 		ulimit -S -n 100 ; \
-		python $(RTE_SDK)/app/test/autotest.py \
+		python $(RTE_SDK)/app/test/autotest.py $(AUTOTEST_ARGS) \
 			$(RTE_OUTPUT)/app/test \
 			$(RTE_TARGET) \
 			$(BLACKLIST) $(WHITELIST) ; \
@@ -0,0 +1,217 @@
+#! /usr/bin/python
+#
+#   BSD LICENSE
+# 
+#   Copyright(c) 2010-2014 Intel Corporation. All rights reserved.
+#   All rights reserved.
+# 
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     * Neither the name of Intel Corporation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#   A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#   OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#   LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#   DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#   THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#   OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Propose EAL and application arguments for the OVDK datapath (ovs_dpdk)
+# so that each physical port's RX/TX queues, its hugepage memory and the
+# QoS scheduler core are kept on the NUMA node the port is attached to.
+# The plan is printed as JSON, for use by provisioning scripts.
+
+import sys, os, getopt, json
+from os.path import exists, basename
+import cpu_layout
+
+# hugepage memory (MB) reserved on the node running the master lcore
+DEFAULT_BASE_MEM = 512
+# hugepage memory (MB) reserved per physical port, on the port's node
+DEFAULT_PORT_MEM = 256
+
+def usage():
+	print """Usage: %s [options] [PCI address ...]
+
+Propose ovs_dpdk arguments for the given ports (in DPDK port order).
+Without addresses, all devices bound to igb_uio are used.
+
+Options:
+    --queues=N        RX/TX queues per port (default 1)
+    --port-mem=MB     hugepage memory per port (default %d)
+    --base-mem=MB     hugepage memory for the master lcore (default %d)
+    --clients=N       number of client ports, passed as -n (default 1)
+    --topology        also print the discovered topology
+""" % (basename(sys.argv[0]), DEFAULT_PORT_MEM, DEFAULT_BASE_MEM)
+
+# PCI addresses of devices bound to igb_uio, in PCI order which is also
+# the order in which DPDK numbers the ports
+def find_dpdk_ports(sysfs = "/sys"):
+	path = sysfs + "/bus/pci/drivers/igb_uio"
+	if not exists(path):
+		return []
+	return sorted([d for d in os.listdir(path) if ":" in d])
+
+class Planner:
+	def __init__(self, topo):
+		self.topo = topo
+		self.warnings = []
+		# node -> list of free physical cores (lists of processors)
+		self.free_cores = dict((n, topo.node_cores(n)) for n in topo.nodes())
+		self.used_cpus = []
+
+	# take the first free physical core of a node, falling back to the
+	# other nodes if there is none left. only one hyperthread of each
+	# core is used, so that polling lcores don't share a core.
+	def take_core(self, node, what):
+		nodes = [node] + [n for n in sorted(self.free_cores) if n != node]
+		for n in nodes:
+			if self.free_cores.get(n):
+				cpu = self.free_cores[n].pop(0)[0]
+				if n != node:
+					self.warnings.append("no free core on node %d for %s, "
+						"using lcore %d on node %d" % (node, what, cpu, n))
+				self.used_cpus.append(cpu)
+				return cpu
+		raise ValueError("not enough cores for %s" % what)
+
+	def plan(self, ports, queues = 1, clients = 1,
+			port_mem = DEFAULT_PORT_MEM, base_mem = DEFAULT_BASE_MEM):
+		topo = self.topo
+		port_nodes = [topo.pci_node(p) for p in ports]
+
+		# the QoS scheduler is a single core, put it on the node with
+		# most ports and use that node for the master and switching
+		# cores as well, as they all touch the same packets
+		main_node = 0
+		if ports:
+			main_node = max(sorted(set(port_nodes)), key = port_nodes.count)
+
+		# the port queues are the most sensitive to locality, so they
+		# get cores first, vswitchd is the least sensitive one
+		plan_ports = []
+		config = []
+		for port_id, (pci, node) in enumerate(zip(ports, port_nodes)):
+			if node != main_node:
+				self.warnings.append("port %d (%s) is on node %d, but the "
+					"QoS scheduler core is on node %d" %
+					(port_id, pci, node, main_node))
+			port_queues = []
+			for queue in range(queues):
+				lcore = self.take_core(node, "port %d queue %d" %
+					(port_id, queue))
+				config.append((port_id, queue, lcore))
+				port_queues.append({"queue" : queue, "lcore" : lcore})
+			plan_ports.append({"port" : port_id, "pci" : pci,
+				"node" : node, "queues" : port_queues})
+
+		qos_core = self.take_core(main_node, "QoS scheduler")
+		switching_core = self.take_core(main_node, "client switching")
+		vswitchd_core = self.take_core(main_node, "vswitchd")
+
+		# hugepage memory per node
+		nodes = topo.nodes()
+		mem = dict((n, 0) for n in nodes)
+		mem[main_node] = mem.get(main_node, 0) + base_mem
+		for node in port_nodes:
+			mem[node] = mem.get(node, 0) + port_mem
+		socket_mem = ",".join([str(mem.get(n, 0))
+			for n in range(max(mem.keys()) + 1)])
+		self.check_hugepages(mem)
+
+		coremask = 0
+		for cpu in self.used_cpus:
+			coremask |= 1 << cpu
+		portmask = (1 << len(ports)) - 1
+
+		config_str = ",".join(["(%d,%d,%d)" % c for c in config])
+		eal_args = ["-c", "0x%x" % coremask, "-n", "4",
+			"--socket-mem", socket_mem, "--proc-type=primary"]
+		app_args = ["-p", "0x%x" % portmask, "-n", str(clients),
+			"--stats=1", "--vswitchd=%d" % vswitchd_core,
+			"--client_switching_core=%d" % switching_core,
+			"--config=%s" % config_str, "--qos_core=%d" % qos_core]
+
+		return {
+			"coremask" :	"0x%x" % coremask,
+			"socket_mem" :	socket_mem,
+			"vswitchd_core" :	vswitchd_core,
+			"client_switching_core" :	switching_core,
+			"qos_core" :	qos_core,
+			"qos_node" :	main_node,
+			"ports" :	plan_ports,
+			"config" :	config_str,
+			"eal_args" :	eal_args,
+			"app_args" :	app_args,
+			"warnings" :	self.warnings,
+		}
+
+	# warn if a node doesn't have enough free hugepage memory
+	def check_hugepages(self, mem):
+		for node, mb in sorted(mem.items()):
+			pages = self.topo.node_hugepages.get(node)
+			if pages is None or mb == 0:
+				continue
+			free_mb = sum([size * free / 1024
+				for size, (total, free) in pages.items()])
+			if free_mb < mb:
+				self.warnings.append("node %d has %d MB of free hugepages, "
+					"%d MB needed" % (node, free_mb, mb))
+
+def main():
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "h",
+			["help", "queues=", "port-mem=", "base-mem=", "clients=",
+			 "topology"])
+	except getopt.GetoptError, error:
+		print str(error)
+		usage()
+		sys.exit(1)
+
+	kwargs = {}
+	show_topology = False
+	for opt, arg in opts:
+		if opt in ("-h", "--help"):
+			usage()
+			sys.exit(0)
+		elif opt == "--topology":
+			show_topology = True
+		else:
+			try:
+				kwargs[opt[2:].replace("-", "_")] = int(arg)
+			except ValueError:
+				print "Invalid value for %s: %s" % (opt, arg)
+				sys.exit(1)
+
+	ports = args or find_dpdk_ports()
+	# allow "bus:slot.func" syntax, as pci_unbind.py does
+	ports = [p if p.count(":") == 2 else "0000:" + p for p in ports]
+
+	try:
+		topo = cpu_layout.read_topology()
+		result = Planner(topo).plan(ports, **kwargs)
+	except ValueError, e:
+		print >>sys.stderr, "Error: %s" % e
+		sys.exit(1)
+
+	if show_topology:
+		result["topology"] = topo.to_dict()
+	print json.dumps(result, indent = 1, sort_keys = True)
+
+if __name__ == "__main__":
+	main()
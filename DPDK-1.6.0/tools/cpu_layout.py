@@ -32,58 +32,184 @@
 #   OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-import sys
-
-sockets = []
-cores = []
-core_map = {}
-
-fd=open("/proc/cpuinfo")
-lines = fd.readlines()
-fd.close()
-
-core_details = []
-core_lines = {}
-for line in lines:
-	if len(line.strip()) != 0:
-		name, value = line.split(":", 1)
-		core_lines[name.strip()] = value.strip()
-	else:
+# Core, socket and NUMA node layout of the system. When run as a script,
+# prints a table of the cores of each socket. When imported, read_topology()
+# returns a Topology object, used e.g. by core_planner.py
+
+import sys, os, glob
+
+# read a single line from a sysfs file, None if it does not exist
+def read_sysfs(path):
+	try:
+		f = open(path)
+	except IOError:
+		return None
+	try:
+		return f.read().strip()
+	finally:
+		f.close()
+
+# parse a cpu list such as "0-3,8-11" into a list of cpu numbers
+def parse_cpulist(cpulist):
+	cpus = []
+	for part in cpulist.split(","):
+		part = part.strip()
+		if not part:
+			continue
+		if "-" in part:
+			first, last = part.split("-")
+			cpus.extend(range(int(first), int(last) + 1))
+		else:
+			cpus.append(int(part))
+	return cpus
+
+# parse /proc/cpuinfo into a list of dictionaries, one per processor
+def read_cpuinfo(filename = "/proc/cpuinfo"):
+	fd=open(filename)
+	lines = fd.readlines()
+	fd.close()
+
+	core_details = []
+	core_lines = {}
+	for line in lines:
+		if len(line.strip()) != 0:
+			name, value = line.split(":", 1)
+			core_lines[name.strip()] = value.strip()
+		else:
+			core_details.append(core_lines)
+			core_lines = {}
+	if core_lines:
 		core_details.append(core_lines)
-		core_lines = {}
-
-for core in core_details:
-	for field in ["processor", "core id", "physical id"]:
-		if field not in core:
-			print "Error getting '%s' value from /proc/cpuinfo" % field
-			sys.exit(1)
-		core[field] = int(core[field])
-
-	if core["core id"] not in cores:
-		cores.append(core["core id"])
-	if core["physical id"] not in sockets:
-		sockets.append(core["physical id"])
-	key = (core["physical id"], core["core id"])
-	if key not in core_map:
-		core_map[key] = []
-	core_map[key].append(core["processor"])
-
-print "============================================================"
-print "Core and Socket Information (as reported by '/proc/cpuinfo')"
-print "============================================================\n"
-print "cores = ",cores
-print "sockets = ", sockets
-print ""
-
-for s in sockets:
-	print "\tSocket %s" % s,
-print ""
-for s in sockets:
-	print "\t---------",
-print ""
-
-for c in cores:
-	print "Core %s" % c,
+
+	for core in core_details:
+		for field in ["processor", "core id", "physical id"]:
+			if field not in core:
+				raise ValueError("Error getting '%s' value from %s" %
+					(field, filename))
+			core[field] = int(core[field])
+	return core_details
+
+class Topology:
+	def __init__(self):
+		# physical ids of sockets and core ids, in order of appearance
+		self.sockets = []
+		self.cores = []
+		# (socket, core id) -> list of processors (hyperthreads)
+		self.core_map = {}
+		# processor -> socket
+		self.cpu_socket = {}
+		# NUMA node -> list of processors
+		self.node_cpus = {}
+		# NUMA node -> {hugepage size in kB -> (total, free)}
+		self.node_hugepages = {}
+		# PCI address -> NUMA node, -1 if unknown
+		self.pci_nodes = {}
+
+	# NUMA node of a processor. without NUMA information, the socket
+	# is used instead
+	def cpu_node(self, cpu):
+		for node, cpus in self.node_cpus.items():
+			if cpu in cpus:
+				return node
+		return self.cpu_socket.get(cpu, 0)
+
+	# NUMA node of a PCI device, 0 if the kernel doesn't know it
+	def pci_node(self, pci_addr):
+		node = self.pci_nodes.get(pci_addr, -1)
+		if node < 0:
+			return 0
+		return node
+
+	def nodes(self):
+		if self.node_cpus:
+			return sorted(self.node_cpus.keys())
+		return sorted(self.sockets)
+
+	# physical cores of a node, each as a list of its processors
+	def node_cores(self, node):
+		result = []
+		for s in self.sockets:
+			for c in self.cores:
+				cpus = self.core_map.get((s, c))
+				if cpus and self.cpu_node(cpus[0]) == node:
+					result.append(cpus)
+		return result
+
+	def to_dict(self):
+		return {
+			"sockets" : self.sockets,
+			"cores" : self.cores,
+			"core_map" : dict(("%d,%d" % k, v)
+				for k, v in self.core_map.items()),
+			"node_cpus" : self.node_cpus,
+			"node_hugepages" : self.node_hugepages,
+			"pci_nodes" : self.pci_nodes,
+		}
+
+# read core layout from /proc/cpuinfo, and NUMA node and PCI device
+# locality from sysfs
+def read_topology(cpuinfo = "/proc/cpuinfo", sysfs = "/sys"):
+	topo = Topology()
+
+	for core in read_cpuinfo(cpuinfo):
+		if core["core id"] not in topo.cores:
+			topo.cores.append(core["core id"])
+		if core["physical id"] not in topo.sockets:
+			topo.sockets.append(core["physical id"])
+		key = (core["physical id"], core["core id"])
+		if key not in topo.core_map:
+			topo.core_map[key] = []
+		topo.core_map[key].append(core["processor"])
+		topo.cpu_socket[core["processor"]] = core["physical id"]
+
+	for path in glob.glob(sysfs + "/devices/system/node/node[0-9]*"):
+		node = int(os.path.basename(path)[4:])
+		cpulist = read_sysfs(path + "/cpulist")
+		topo.node_cpus[node] = parse_cpulist(cpulist or "")
+		hugepages = {}
+		for hp in glob.glob(path + "/hugepages/hugepages-*kB"):
+			size = int(os.path.basename(hp)[len("hugepages-"):-len("kB")])
+			total = int(read_sysfs(hp + "/nr_hugepages") or 0)
+			free = int(read_sysfs(hp + "/free_hugepages") or 0)
+			hugepages[size] = (total, free)
+		topo.node_hugepages[node] = hugepages
+
+	for path in glob.glob(sysfs + "/bus/pci/devices/*"):
+		node = read_sysfs(path + "/numa_node")
+		if node is not None:
+			topo.pci_nodes[os.path.basename(path)] = int(node)
+
+	return topo
+
+def print_layout(topo):
+	sockets = topo.sockets
+	cores = topo.cores
+	core_map = topo.core_map
+
+	print "============================================================"
+	print "Core and Socket Information (as reported by '/proc/cpuinfo')"
+	print "============================================================\n"
+	print "cores = ",cores
+	print "sockets = ", sockets
+	print ""
+
+	for s in sockets:
+		print "\tSocket %s" % s,
+	print ""
 	for s in sockets:
-		print "\t", core_map[(s,c)],
-	print "\n"
+		print "\t---------",
+	print ""
+
+	for c in cores:
+		print "Core %s" % c,
+		for s in sockets:
+			print "\t", core_map.get((s,c), []),
+		print "\n"
+
+if __name__ == "__main__":
+	try:
+		topo = read_topology()
+	except ValueError, e:
+		print e
+		sys.exit(1)
+	print_layout(topo)
@@ -200,61 +200,79 @@ def has_driver(dev_id):
     '''return true if a device is assigned to a driver. False otherwise'''
     return "Driver_str" in devices[dev_id]
 
+def read_sysfs(path):
+    '''Read a single value from a sysfs file, None if it does not exist'''
+    try:
+        f = open(path)
+    except IOError:
+        return None
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+def get_active_interfaces():
+    '''Return the list of interfaces having routes in the routing table
+    (e.g. the one used by an ssh connection), so we can mark them later.
+    Routes for the 169.254 link-local range are ignored.'''
+    active_if = []
+    try:
+        f = open("/proc/net/route")
+    except IOError:
+        return active_if
+    lines = f.readlines()[1:] # skip header
+    f.close()
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        # destination is in hex, in host (little-endian) byte order
+        if int(fields[1], 16) & 0xffff == 0xfea9:
+            continue
+        if fields[0] not in active_if:
+            active_if.append(fields[0])
+    return active_if
+
 def get_nic_details():
     '''This function populates the "devices" dictionary. The keys used are
     the pci addresses (domain:bus:slot.func). The values are themselves
-    dictionaries - one for each NIC.'''
+    dictionaries - one for each NIC. All details are read from sysfs,
+    see get_nic_names() for the human-readable device names.'''
     global devices
-    
+
     # clear any old data
-    devices = {} 
-    # first loop through and read details for all devices
-    # request machine readable format, with numeric IDs
-    dev = {};
-    dev_lines = check_output(["lspci", "-Dvmmn"]).splitlines()
-    for dev_line in dev_lines:
-        if (len(dev_line) == 0):
-            if dev["Class"] == ETHERNET_CLASS:
-                #convert device and vendor ids to numbers, then add to global
-                dev["Vendor"] = int(dev["Vendor"],16)
-                dev["Device"] = int(dev["Device"],16)
-                devices[dev["Slot"]] = dict(dev) # use dict to make copy of dev
+    devices = {}
+    sys_dir = "/sys/bus/pci/devices"
+    for slot in os.listdir(sys_dir):
+        path = "%s/%s" % (sys_dir, slot)
+        # class is e.g. 0x020000 - class, subclass and prog-if
+        dev_class = read_sysfs(path + "/class")
+        if dev_class is None or dev_class[2:6] != ETHERNET_CLASS:
+            continue
+        dev = {"Slot": slot,
+               "Class": ETHERNET_CLASS,
+               "Vendor": int(read_sysfs(path + "/vendor"), 16),
+               "Device": int(read_sysfs(path + "/device"), 16)}
+        # until names are looked up, identify the device by its ids
+        dev["Vendor_str"] = "%04x" % dev["Vendor"]
+        dev["Device_str"] = "%04x:%04x" % (dev["Vendor"], dev["Device"])
+        if exists(path + "/driver"):
+            dev["Driver_str"] = basename(os.readlink(path + "/driver"))
+        if exists(path + "/driver/module"):
+            dev["Module_str"] = basename(os.readlink(path + "/driver/module"))
+        # check for a unix interface name
+        if exists(path + "/net"):
+            dev["Interface"] = ",".join(os.listdir(path + "/net"))
         else:
-            name, value = dev_line.split("\t", 1)
-            dev[name.rstrip(":")] = value
+            dev["Interface"] = ""
+        devices[slot] = dev
 
-    # check what is the interface if any for an ssh connection if
-    # any to this host, so we can mark it later.
-    ssh_if = []
-    route = check_output(["ip", "-o", "route"])
-    # filter out all lines for 169.254 routes
-    route = "\n".join(filter(lambda ln: not ln.startswith("169.254"), 
-                             route.splitlines()))
-    rt_info = route.split()
-    for i in xrange(len(rt_info) - 1):
-        if rt_info[i] == "dev":
-            ssh_if.append(rt_info[i+1])
-
-    # based on the basic info, get extended text details            
+    # check if a port is used for ssh connection
+    active_if = get_active_interfaces()
     for d in devices.keys():
-        extra_info = check_output(["lspci", "-vmmks", d]).splitlines()
-        # parse lspci details
-        for line in extra_info:
-            if len(line) == 0:
-                continue
-            name, value = line.split("\t", 1)
-            name = name.strip(":") + "_str"
-            devices[d][name] = value
-        # check for a unix interface name
-        sys_path = "/sys/bus/pci/devices/%s/net/" % d
-        if exists(sys_path):
-            devices[d]["Interface"] = ",".join(os.listdir(sys_path))
-        else:
-            devices[d]["Interface"] = ""
-        # check if a port is used for ssh connection
         devices[d]["Ssh_if"] = False
         devices[d]["Active"] = ""
-        for _if in ssh_if: 
+        for _if in active_if:
             if _if in devices[d]["Interface"].split(","):
                 devices[d]["Ssh_if"] = True
                 devices[d]["Active"] = "*Active*"
@@ -275,7 +293,46 @@ def get_nic_details():
             if devices[d]["Driver_str"] in modules:
                 modules.remove(devices[d]["Driver_str"])
                 devices[d]["Module_str"] = ",".join(modules)
-    
+        if devices[d]["Module_str"] == "":
+            devices[d]["Module_str"] = "<none>"
+
+def get_nic_names():
+    '''Add human-readable vendor and device names, and the list of kernel
+    modules able to drive each device, to the "devices" dictionary. This
+    uses a single lspci call for all devices, and is only needed for
+    display purposes.'''
+    try:
+        dev_lines = check_output(["lspci", "-Dvmmk"]).splitlines()
+    except OSError: # no lspci, keep the numeric ids
+        return
+    dev_lines.append("")
+    dev = {}
+    for dev_line in dev_lines:
+        if len(dev_line) == 0:
+            info = dev
+            dev = {}
+            d = info.get("Slot")
+            if d not in devices:
+                continue
+            devices[d]["Vendor_str"] = info.get("Vendor", devices[d]["Vendor_str"])
+            devices[d]["Device_str"] = info.get("Device", devices[d]["Device_str"])
+            # merge in modules able to drive the device, but never list
+            # the driver currently in use
+            modules = [m for m in devices[d]["Module_str"].split(",")
+                       if m != "<none>"]
+            for m in info.get("Module", "").split(","):
+                m = m.strip()
+                if m and m not in modules and \
+                        m != devices[d].get("Driver_str"):
+                    modules.append(m)
+            if len(modules) > 0:
+                devices[d]["Module_str"] = ",".join(modules)
+            else:
+                devices[d]["Module_str"] = "<none>"
+        else:
+            name, value = dev_line.split("\t", 1)
+            dev[name.rstrip(":")] = value
+
 def dev_id_from_dev_name(dev_name):
     '''Take a device "name" - a string passed in by user to identify a NIC
     device, and determine the device id - i.e. the domain:bus:slot.func - for
@@ -297,82 +354,144 @@ def dev_id_from_dev_name(dev_name):
         "Please specify device in \"bus:slot.func\" format" % dev_name
     sys.exit(1)
 
-def unbind_one(dev_id, force):
-    '''Unbind the device identified by "dev_id" from its current driver'''
-    dev = devices[dev_id]
-    if not has_driver(dev_id):
-        print "%s %s %s is not currently managed by any driver\n" % \
-            (dev["Slot"], dev["Device_str"], dev["Interface"])
-        return
-    
-    # prevent us disconnecting ourselves
-    if dev["Ssh_if"] and not force:
-        print "Routing table indicates that interface %s is active" \
-            ". Skipping unbind" % (dev_id)
-        return
-    
-    # write to /sys to unbind
-    filename = "/sys/bus/pci/drivers/%s/unbind" % dev["Driver_str"]
-    try:
-        f = open(filename, "a")
-    except:
-        print "Error: unbind failed for %s - Cannot open %s" % (dev_id, filename)
-        sys/exit(1)
-    f.write(dev_id)
-    f.close()
-
-def bind_one(dev_id, driver, force):
-    '''Bind the device given by "dev_id" to the driver "driver". If the device
-    is already bound to a different driver, it will be unbound first'''
-    dev = devices[dev_id]
-    saved_driver = None # used to rollback any unbind in case of failure
-    
-    # prevent disconnection of our ssh session
-    if dev["Ssh_if"] and not force:
-        print "Routing table indicates that interface %s is active" \
-            ". Not modifying" % (dev_id)
-        return
-
-    # unbind any existing drivers we don't want
-    if has_driver(dev_id):
-        if dev["Driver_str"] == driver:
-            print "%s already bound to driver %s, skipping\n" % (dev_id, driver)
-            return
-        else:
-            saved_driver = dev["Driver_str"]
-            unbind_one(dev_id, force)
-            dev["Driver_str"] = "" # clear driver string
-
-    # do the bind by writing to /sys
-    filename = "/sys/bus/pci/drivers/%s/bind" % driver
+def write_sysfs_all(filename, values):
+    '''Write each of "values" to the sysfs file "filename", opening it only
+    once. Each value is written separately, as the kernel handles one
+    value per write. Returns the list of values which failed.'''
     try:
-        f = open(filename, "a")
+        f = open(filename, "a", 0) # unbuffered, one write() per value
     except:
-        print "Error: bind failed for %s - Cannot open %s" % (dev_id, filename)
-        if saved_driver is not None: # restore any previous driver
-            bind_one(dev_id, saved_driver, force)
-        return
+        return list(values)
+    failed = []
+    for value in values:
+        try:
+            f.write(value)
+        except:
+            failed.append(value)
     try:
-        f.write(dev_id)
         f.close()
     except:
-        print "Error: bind failed for %s - Cannot bind to driver %s" % (dev_id, driver)
-        if saved_driver is not None: # restore any previous driver
-            bind_one(dev_id, saved_driver, force)
-        return
+        pass
+    return failed
 
+def current_driver(dev_id):
+    '''Return the name of the driver a device is bound to, according to
+    sysfs, or None'''
+    path = "/sys/bus/pci/devices/%s/driver" % dev_id
+    if not exists(path):
+        return None
+    return basename(os.readlink(path))
+
+def unbound_devices(new_ids):
+    '''Return the list of PCI devices, of any class, that are not bound to
+    a driver and whose "vendor device" pair is one of "new_ids"'''
+    sys_dir = "/sys/bus/pci/devices"
+    result = []
+    for slot in os.listdir(sys_dir):
+        if current_driver(slot) is not None:
+            continue
+        path = "%s/%s" % (sys_dir, slot)
+        vendor = read_sysfs(path + "/vendor")
+        device = read_sysfs(path + "/device")
+        if vendor is None or device is None:
+            continue
+        if "%04x %04x" % (int(vendor, 16), int(device, 16)) in new_ids:
+            result.append(slot)
+    return result
 
 def unbind_all(dev_list, force=False):
-    """Unbind method, takes a list of device locations"""
+    """Unbind method, takes a list of device locations. Devices using the
+    same driver are unbound in one pass over the driver's unbind file."""
     dev_list = map(dev_id_from_dev_name, dev_list)
+    by_driver = {}
     for d in dev_list:
-        unbind_one(d, force)
+        dev = devices[d]
+        if not has_driver(d):
+            print "%s %s %s is not currently managed by any driver\n" % \
+                (dev["Slot"], dev["Device_str"], dev["Interface"])
+            continue
+        # prevent us disconnecting ourselves
+        if dev["Ssh_if"] and not force:
+            print "Routing table indicates that interface %s is active" \
+                ". Skipping unbind" % (d)
+            continue
+        by_driver.setdefault(dev["Driver_str"], []).append(d)
+
+    for driver, ids in by_driver.items():
+        filename = "/sys/bus/pci/drivers/%s/unbind" % driver
+        for d in write_sysfs_all(filename, ids):
+            print "Error: unbind failed for %s - Cannot write to %s" % \
+                (d, filename)
+        for d in ids:
+            if current_driver(d) is None:
+                del devices[d]["Driver_str"]
 
 def bind_all(dev_list, driver, force=False):
-    """Unbind method, takes a list of device locations"""
+    """Bind method, takes a list of device locations. All devices are first
+    unbound from their current drivers, then bound to "driver" in one pass.
+    Device ids the driver doesn't know about are added through its
+    new_id file, once per vendor:device pair. The kernel then probes every
+    unbound device with that pair, so any such device that was not in
+    "dev_list" is unbound again. If binding a device fails, it is given
+    back to its previous driver."""
     dev_list = map(dev_id_from_dev_name, dev_list)
+    to_bind = []
     for d in dev_list:
-        bind_one(d, driver, force)
+        dev = devices[d]
+        # prevent disconnection of our ssh session
+        if dev["Ssh_if"] and not force:
+            print "Routing table indicates that interface %s is active" \
+                ". Not modifying" % (d)
+            continue
+        if has_driver(d) and dev["Driver_str"] == driver:
+            print "%s already bound to driver %s, skipping\n" % (d, driver)
+            continue
+        if d not in to_bind:
+            to_bind.append(d)
+
+    # used to rollback any unbind in case of failure
+    saved_drivers = {}
+    for d in to_bind:
+        if has_driver(d):
+            saved_drivers[d] = devices[d]["Driver_str"]
+    unbind_all([d for d in to_bind if d in saved_drivers], force=True)
+
+    filename = "/sys/bus/pci/drivers/%s/bind" % driver
+    write_sysfs_all(filename, to_bind)
+    failed = [d for d in to_bind if current_driver(d) != driver]
+
+    # teach the driver about new device ids, which also makes it probe
+    # any unbound matching devices, then retry the remaining devices
+    if failed and exists("/sys/bus/pci/drivers/%s/new_id" % driver):
+        new_ids = []
+        for d in failed:
+            new_id = "%04x %04x" % (devices[d]["Vendor"], devices[d]["Device"])
+            if new_id not in new_ids:
+                new_ids.append(new_id)
+        others = [d for d in unbound_devices(new_ids) if d not in to_bind]
+        write_sysfs_all("/sys/bus/pci/drivers/%s/new_id" % driver, new_ids)
+        # give back any device the user did not ask for
+        probed = [d for d in others if current_driver(d) == driver]
+        write_sysfs_all("/sys/bus/pci/drivers/%s/unbind" % driver, probed)
+        write_sysfs_all(filename, [d for d in failed
+                                   if current_driver(d) is None])
+        failed = [d for d in failed if current_driver(d) != driver]
+
+    for d in to_bind:
+        if d not in failed:
+            devices[d]["Driver_str"] = driver
+
+    # restore any previous drivers
+    restore = {}
+    for d in failed:
+        print "Error: bind failed for %s - Cannot bind to driver %s" % (d, driver)
+        if d in saved_drivers:
+            restore.setdefault(saved_drivers[d], []).append(d)
+    for saved_driver, ids in restore.items():
+        write_sysfs_all("/sys/bus/pci/drivers/%s/bind" % saved_driver, ids)
+        for d in ids:
+            if current_driver(d) == saved_driver:
+                devices[d]["Driver_str"] = saved_driver
 
 def display_devices(title, dev_list, extra_params = None):
     '''Displays to the user the details of a list of devices given in "dev_list"
@@ -473,6 +592,7 @@ def parse_args():
     if status_flag:
         if b_flag is not None:
             get_nic_details() # refresh if we have changed anything
+        get_nic_names()
         show_status()
                         
 def main():
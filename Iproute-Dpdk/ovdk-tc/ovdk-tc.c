@@ -38,6 +38,7 @@ int show_pretty = 0;
 int resolve_hosts = 0;
 int use_iec = 0;
 int force = 0;
+static int frame = 0;
 struct rtnl_handle rth;
 
 static void *BODY = NULL;	/* cached handle dlopen(NULL) */
@@ -187,7 +188,7 @@ noexist:
 static void usage(void)
 {
 	fprintf(stderr, "Usage: tc [ OPTIONS ] OBJECT { COMMAND | help }\n"
-			"       tc [-force] -batch filename\n"
+			"       tc [-force] [-frame] -batch filename\n"
 	                "where  OBJECT := { qdisc | class | filter | action | monitor }\n"
 	                "       OPTIONS := { -s[tatistics] | -d[etails] | -r[aw] | -p[retty] | -b[atch] [filename] }\n");
 }
@@ -244,13 +245,22 @@ static int batch(const char *name)
 	while (getcmdline(&line, &len, stdin) != -1) {
 		char *largv[100];
 		int largc;
+		int err;
 
 		largc = makeargs(line, largv, 100);
 		if (largc == 0)
 			continue;	/* blank line */
 
-		if (do_cmd(largc, largv)) {
+		err = do_cmd(largc, largv);
+		if (err)
 			fprintf(stderr, "Command failed %s:%d\n", name, cmdlineno);
+		if (frame) {
+			/* Mark the end of the command's output, for tc-server */
+			fflush(stdout);
+			printf("@@ %d %d\n", cmdlineno, err ? 1 : 0);
+			fflush(stdout);
+		}
+		if (err) {
 			ret = 1;
 			if (!force)
 				break;
@@ -306,6 +316,8 @@ int main(int argc, char **argv)
 			return 0;
 		} else if (matches(argv[1], "-force") == 0) {
 			++force;
+		} else if (matches(argv[1], "-frame") == 0) {
+			++frame;
 		} else 	if (matches(argv[1], "-batch") == 0) {
 			do_batching = 1;
 			if (argc > 2)
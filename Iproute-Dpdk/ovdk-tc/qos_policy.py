@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+#
+# Compile a declarative QoS policy into ovdk-tc and ovs-ofctl commands
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+#
+# A policy is a JSON (or, with PyYAML installed, YAML) document such as
+#
+#   {"bridge": "br0",
+#    "ports": {
+#      "ovdk17": {"port": 17,
+#                 "qdisc": {"kind": "htb", "handle": "1:", "default": "12",
+#                           "classes": [
+#                             {"classid": "1:1", "rate": "100mbit",
+#                              "classes": [
+#                                {"classid": "1:11", "rate": "20mbit",
+#                                 "ceil": "100mbit"}, ...]}]}}},
+#    "flows": [
+#      {"match": "ip,nw_src=10.0.0.1", "dev": "ovdk17", "class": "1:11"},
+#      {"match": "ip,nw_dst=10.0.0.1", "actions": "output:16"}]}
+#
+# A class may carry child "classes" or a child "qdisc", and a flow either
+# enqueues to a leaf class or has plain OpenFlow "actions".  See
+# Test/*/policy.json for complete examples.
+#
+# The policy is validated, compared with the policy applied last (the state
+# file), and only the differences are emitted: one ovdk-tc batch file and,
+# for each bridge, one file for "ovs-ofctl --strict del-flows BRIDGE -" and
+# one for "ovs-ofctl add-flows BRIDGE FILE".  With --apply, these are run
+# and the state file is updated.
+
+import os
+import re
+import sys
+import json
+import optparse
+import subprocess
+
+class PolicyError(Exception):
+    pass
+
+# Parameters accepted for each kind of qdisc and class, in the order in
+# which they are passed to ovdk-tc
+QDISC_PARAMS = {
+    'htb': ['default', 'r2q'],
+    'drr': [],
+}
+CLASS_PARAMS = {
+    'htb': ['rate', 'ceil', 'burst', 'cburst', 'prio', 'quantum', 'mtu'],
+    'drr': ['quantum'],
+}
+
+RATE_UNITS = {
+    'bit': 1, 'kbit': 1e3, 'mbit': 1e6, 'gbit': 1e9, 'tbit': 1e12,
+    'kibit': 1024, 'mibit': 1024 ** 2, 'gibit': 1024 ** 3, 'tibit': 1024 ** 4,
+    'bps': 8, 'kbps': 8e3, 'mbps': 8e6, 'gbps': 8e9, 'tbps': 8e12,
+    'kibps': 8 * 1024, 'mibps': 8 * 1024 ** 2, 'gibps': 8 * 1024 ** 3,
+    'tibps': 8 * 1024 ** 4,
+}
+
+def parse_rate(s):
+    '''Return a tc rate, such as "100mbit", in bits per second'''
+    m = re.match(r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$', str(s))
+    if not m:
+        raise PolicyError('invalid rate "%s"' % s)
+    unit = m.group(2).lower() or 'bps'
+    if unit not in RATE_UNITS:
+        raise PolicyError('invalid rate "%s"' % s)
+    return float(m.group(1)) * RATE_UNITS[unit]
+
+def parse_handle(s, what):
+    '''Return a tc handle, such as "1:11" or "1:", as (major, minor)'''
+    m = re.match(r'^([0-9a-fA-F]+):?([0-9a-fA-F]*)$', str(s))
+    if not m:
+        raise PolicyError('invalid %s "%s"' % (what, s))
+    return int(m.group(1), 16), int(m.group(2) or '0', 16)
+
+def format_handle(h):
+    if h[1]:
+        return '%x:%x' % h
+    return '%x:' % h[0]
+
+def load_policy(filename):
+    '''Read a policy from a JSON or YAML file'''
+    f = open(filename)
+    try:
+        if os.path.splitext(filename)[1] in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise PolicyError('reading %s needs PyYAML' % filename)
+            return yaml.safe_load(f)
+        return json.load(f)
+    finally:
+        f.close()
+
+class Node(object):
+    '''A qdisc or class of a port'''
+
+    def __init__(self, type, handle, parent, kind, args):
+        self.type = type            # 'qdisc' or 'class'
+        self.handle = handle        # (major, minor)
+        self.parent = parent        # key of the parent node, or None
+        self.kind = kind
+        self.args = args
+        self.children = []
+
+    def key(self):
+        return (self.type, self.handle)
+
+    def add_command(self, dev, verb='add'):
+        if self.type == 'qdisc':
+            if self.parent is None:
+                where = 'root'
+            else:
+                where = 'parent %s' % format_handle(self.parent[1])
+            words = ['qdisc', verb, 'dev', dev, where,
+                     'handle', format_handle(self.handle), self.kind]
+        else:
+            words = ['class', verb, 'dev', dev,
+                     'parent', format_handle(self.parent[1]),
+                     'classid', format_handle(self.handle), self.kind]
+        return ' '.join(words + list(self.args))
+
+    def del_command(self, dev):
+        if self.type == 'class':
+            return 'class del dev %s classid %s' % (dev,
+                                                    format_handle(self.handle))
+        if self.parent is None:
+            return 'qdisc del dev %s root' % dev
+        return 'qdisc del dev %s parent %s handle %s' % \
+               (dev, format_handle(self.parent[1]), format_handle(self.handle))
+
+def params(spec, allowed, what):
+    '''Return the tc arguments for the parameters in spec'''
+    for name in spec:
+        if name not in allowed and name not in ('kind', 'handle', 'classid',
+                                                'classes', 'qdisc'):
+            raise PolicyError('%s: unknown parameter "%s"' % (what, name))
+    args = []
+    for name in allowed:
+        if name in spec:
+            args += [name, str(spec[name])]
+    return tuple(args)
+
+class Port(object):
+    '''The qdiscs and classes of one port, in the order they are created'''
+
+    def __init__(self, dev, spec):
+        self.dev = dev
+        self.port = spec.get('port')
+        if self.port is None:
+            m = re.search(r'(\d+)$', dev)
+            self.port = m and int(m.group(1))
+        self.nodes = {}
+        self.order = []
+        if spec.get('qdisc'):
+            self.add_qdisc(spec['qdisc'], None)
+
+    def what(self, node_type, handle):
+        return '%s %s %s' % (self.dev, node_type, format_handle(handle))
+
+    def add_node(self, node):
+        if node.key() in self.nodes:
+            raise PolicyError('%s is defined twice' %
+                              self.what(node.type, node.handle))
+        self.nodes[node.key()] = node
+        self.order.append(node)
+        if node.parent is not None:
+            self.nodes[node.parent].children.append(node)
+
+    def add_qdisc(self, spec, parent):
+        kind = spec.get('kind')
+        if kind not in QDISC_PARAMS:
+            raise PolicyError('%s: unsupported qdisc "%s"' % (self.dev, kind))
+        handle = parse_handle(spec.get('handle', ''), 'qdisc handle')
+        if handle[1]:
+            raise PolicyError('%s: qdisc handle %s has a minor number' %
+                              (self.dev, spec['handle']))
+        what = self.what('qdisc', handle)
+        node = Node('qdisc', handle, parent and parent.key(), kind,
+                    params(spec, QDISC_PARAMS[kind], what))
+        self.add_node(node)
+        for child in spec.get('classes', []):
+            self.add_class(child, node)
+
+    def add_class(self, spec, parent):
+        # parent is the class's qdisc or its parent class
+        qdisc = parent
+        while qdisc.type != 'qdisc':
+            qdisc = self.nodes[qdisc.parent]
+        handle = parse_handle(spec.get('classid', ''), 'classid')
+        what = self.what('class', handle)
+        if handle[0] != qdisc.handle[0] or not handle[1]:
+            raise PolicyError('%s does not belong to qdisc %s' %
+                              (what, format_handle(qdisc.handle)))
+        node = Node('class', handle, parent.key(), qdisc.kind,
+                    params(spec, CLASS_PARAMS[qdisc.kind], what))
+        if qdisc.kind == 'htb':
+            if 'rate' not in spec:
+                raise PolicyError('%s has no rate' % what)
+            node.rate = parse_rate(spec['rate'])
+            node.ceil = parse_rate(spec.get('ceil', spec['rate']))
+            if node.ceil < node.rate:
+                raise PolicyError('%s: ceil is lower than rate' % what)
+        self.add_node(node)
+
+        if spec.get('classes') and spec.get('qdisc'):
+            raise PolicyError('%s has both classes and a qdisc' % what)
+        for child in spec.get('classes', []):
+            self.add_class(child, node)
+        if spec.get('qdisc'):
+            self.add_qdisc(spec['qdisc'], node)
+
+        if qdisc.kind == 'htb' and node.children:
+            total = sum(c.rate for c in node.children if c.type == 'class')
+            if total > node.ceil:
+                raise PolicyError('%s: the rates of its children add up to '
+                                  'more than its ceil' % what)
+
+    def select(self, qdisc, queue):
+        '''Return the class of qdisc that the datapath picks for packets
+        enqueued to queue, or None'''
+        node = self.nodes.get(('class', (qdisc.handle[0], queue)))
+        if node is None and qdisc.kind == 'htb':
+            args = dict(zip(qdisc.args[::2], qdisc.args[1::2]))
+            if 'default' in args:
+                default = (qdisc.handle[0], int(args['default'], 16))
+                node = self.nodes.get(('class', default))
+        return node
+
+    def queue(self, classid):
+        '''Return the OpenFlow queue number of a leaf class'''
+        handle = parse_handle(classid, 'classid')
+        leaf = self.nodes.get(('class', handle))
+        if leaf is None:
+            raise PolicyError('%s has no class %s' % (self.dev, classid))
+        if leaf.children:
+            raise PolicyError('%s is not a leaf class' %
+                              self.what('class', handle))
+
+        # The queue number is the minor number of the class.  Each qdisc
+        # from the root down looks it up among its own classes, and HTB
+        # falls back to its default class, which has to lead to the leaf.
+        queue = handle[1]
+        target = node = leaf
+        while node.parent is not None:
+            node = self.nodes[node.parent]
+            if node.type != 'qdisc':
+                continue
+            picked = self.select(node, queue)
+            if picked is not target:
+                raise PolicyError('%s cannot be reached: qdisc %s puts '
+                                  'packets for queue 0x%x into %s' %
+                                  (self.what('class', handle),
+                                   format_handle(node.handle), queue,
+                                   picked and format_handle(picked.handle) or
+                                   'no class'))
+            if node.parent is not None:
+                target = self.nodes[node.parent]
+        return queue
+
+class Policy(object):
+    '''A validated policy: the Ports by device name, and for each bridge,
+    its flows by (priority, match)'''
+
+    def __init__(self, spec):
+        spec = spec or {}
+        self.ports = {}
+        for dev, port_spec in spec.get('ports', {}).items():
+            self.ports[dev] = Port(dev, port_spec or {})
+
+        self.flows = {}
+        default_bridge = spec.get('bridge', 'br0')
+        for flow in spec.get('flows', []):
+            bridge = flow.get('bridge', default_bridge)
+            match = flow.get('match', '')
+            if 'priority' in flow:
+                match = 'priority=%d%s' % (flow['priority'],
+                                           match and ',' + match)
+            if 'class' in flow:
+                port = self.ports.get(flow.get('dev'))
+                if port is None:
+                    raise PolicyError('flow "%s": unknown port "%s"' %
+                                      (match, flow.get('dev')))
+                if port.port is None:
+                    raise PolicyError('%s has no OpenFlow port number' %
+                                      port.dev)
+                actions = 'enqueue:%d:0x%x' % (port.port,
+                                               port.queue(flow['class']))
+            elif 'actions' in flow:
+                actions = flow['actions']
+            else:
+                raise PolicyError('flow "%s" has neither class nor actions' %
+                                  match)
+            flows = self.flows.setdefault(bridge, {})
+            if match in flows:
+                raise PolicyError('flow "%s" is defined twice' % match)
+            flows[match] = actions
+
+def diff_port(dev, old, new):
+    '''Return the ovdk-tc commands that change port dev from old to new,
+    either of which may be None'''
+    old_nodes = old and old.nodes or {}
+    new_nodes = new and new.nodes or {}
+
+    # Nodes that have to be deleted, because they went away or changed in a
+    # way that "class change" cannot express.  Deleting a node deletes
+    # everything below it.
+    removed = set()
+    commands = []
+    for node in old and old.order or []:
+        if node.parent in removed:
+            removed.add(node.key())
+            continue
+        other = new_nodes.get(node.key())
+        if (other is None or other.parent != node.parent or
+            other.kind != node.kind or
+            (node.type == 'qdisc' and other.args != node.args)):
+            removed.add(node.key())
+            commands.append(node.del_command(dev))
+
+    for node in new and new.order or []:
+        other = old_nodes.get(node.key())
+        if other is None or node.key() in removed:
+            commands.append(node.add_command(dev))
+        elif node.args != other.args:
+            commands.append(node.add_command(dev, 'change'))
+    return commands
+
+def diff_tc(old, new):
+    '''Return the ovdk-tc commands that change Policy old into new'''
+    commands = []
+    for dev in sorted(set(old.ports) | set(new.ports)):
+        commands += diff_port(dev, old.ports.get(dev), new.ports.get(dev))
+    return commands
+
+def diff_flows(old, new):
+    '''Return a dict that maps each bridge to the lists of flows to add and
+    to delete to change Policy old into new'''
+    changes = {}
+    for bridge in sorted(set(old.flows) | set(new.flows)):
+        old_flows = old.flows.get(bridge, {})
+        new_flows = new.flows.get(bridge, {})
+        add = ['%s,actions=%s' % (match, actions) if match else
+               'actions=%s' % actions
+               for match, actions in sorted(new_flows.items())
+               if old_flows.get(match) != actions]
+        delete = sorted(match for match in old_flows if match not in new_flows)
+        if add or delete:
+            changes[bridge] = add, delete
+    return changes
+
+def write_lines(filename, lines):
+    f = open(filename, 'w')
+    f.write(''.join(line + '\n' for line in lines))
+    f.close()
+
+def run(args, stdin=None):
+    p = subprocess.Popen(args, stdin=subprocess.PIPE)
+    p.communicate(stdin)
+    if p.returncode != 0:
+        raise PolicyError('%s failed with exit status %d' %
+                          (' '.join(args), p.returncode))
+
+def apply_changes(prefix, tc_commands, flow_changes, options):
+    if tc_commands:
+        if options.tc_server:
+            import tc_client
+            client = tc_client.TcClient(options.tc_server)
+            try:
+                client.check_batch(tc_commands)
+            except tc_client.TcError, e:
+                raise PolicyError(str(e))
+            finally:
+                client.close()
+        else:
+            run([options.ovdk_tc, '-batch', prefix + '.tc'])
+    for bridge, (add, delete) in sorted(flow_changes.items()):
+        if delete:
+            run([options.ovs_ofctl, '--strict', 'del-flows', bridge, '-'],
+                ''.join(match + '\n' for match in delete))
+        if add:
+            run([options.ovs_ofctl, 'add-flows', bridge,
+                 '%s.%s.add-flows' % (prefix, bridge)])
+
+def main(args):
+    parser = optparse.OptionParser(usage='%prog [options] <policy>')
+    parser.add_option('-s', '--state', metavar='FILE',
+                      help='policy applied last (default: none)')
+    parser.add_option('-o', '--output', metavar='PREFIX', default='qos',
+                      help='write PREFIX.tc, PREFIX.BRIDGE.add-flows and '
+                           'PREFIX.BRIDGE.del-flows (default: %default)')
+    parser.add_option('--check', action='store_true', default=False,
+                      help='only validate the policy')
+    parser.add_option('--apply', action='store_true', default=False,
+                      help='run the commands and update the state file')
+    parser.add_option('--tc-server', type='int', metavar='PORT',
+                      help='apply ovdk-tc commands through tc-server')
+    parser.add_option('--ovdk-tc', default='ovdk-tc', metavar='PROGRAM')
+    parser.add_option('--ovs-ofctl', default='ovs-ofctl', metavar='PROGRAM')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error('no policy given')
+
+    try:
+        spec = load_policy(args[0])
+        new = Policy(spec)
+        if options.check:
+            return 0
+        old = Policy(None)
+        if options.state and os.path.exists(options.state):
+            old = Policy(load_policy(options.state))
+
+        tc_commands = diff_tc(old, new)
+        flow_changes = diff_flows(old, new)
+        write_lines(options.output + '.tc', tc_commands)
+        for bridge, (add, delete) in flow_changes.items():
+            write_lines('%s.%s.add-flows' % (options.output, bridge), add)
+            write_lines('%s.%s.del-flows' % (options.output, bridge), delete)
+        print '%d ovdk-tc commands, %d flows to add, %d flows to delete' % \
+              (len(tc_commands),
+               sum(len(a) for a, d in flow_changes.values()),
+               sum(len(d) for a, d in flow_changes.values()))
+
+        if options.apply:
+            apply_changes(options.output, tc_commands, flow_changes, options)
+            if options.state:
+                f = open(options.state + '.tmp', 'w')
+                json.dump(spec, f, indent=2, sort_keys=True)
+                f.close()
+                os.rename(options.state + '.tmp', options.state)
+    except (PolicyError, EnvironmentError, ValueError), e:
+        sys.stderr.write('%s: %s\n' % (args[0], e))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
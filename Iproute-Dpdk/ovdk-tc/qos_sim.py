@@ -0,0 +1,1167 @@
+#!/usr/bin/env python
+#
+# Simulate the DPDK datapath's HTB and DRR schedulers offline
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+#
+# Predicts the throughput, drops and queueing delay of each class of a QoS
+# tree under a given offered load, before the tree is put on a port.  The
+# tree is read from a policy (see qos_policy.py) or from ovdk-tc commands,
+# e.g. Test/test.htb/ovdk-tc.sh.  Traffic is given per class, in the form
+# CLASSID=RATE[,SIZE], as a flow that enqueues to the class would send it.
+#
+# There are two engines:
+#
+# - simulate() is a fluid model that advances in time steps of dt.  In each
+#   step, the scheduler trees hand out the link's bytes to the backlogged
+#   classes by the same rules as sch_htb.c and sch_drr.c: HTB serves
+#   classes from their own tokens first and then lets them borrow from
+#   their ancestors, level by level and priority by priority, sharing
+#   spare bandwidth by quantum; DRR shares by quantum.  The work per step
+#   does not depend on the number of packets, and the packets' drops and
+#   delays are worked out with NumPy afterwards, so that millions of
+#   packets take seconds.  It assumes that a class that is held back by
+#   its ceil still gets its share, which needs a cburst that is large
+#   next to the quantum of the classes it shares with; with the default
+#   cburst, such a class gets rather less on a real port.
+#
+# - simulate_packets() is a packet by packet port of the dequeue logic of
+#   sch_htb.c and sch_drr.c.  It is exact, but slow, and is meant for
+#   short runs and for checking the fluid model (--packets).
+#
+# Usage: qos_sim.py [options] <policy or ovdk-tc script> CLASSID=RATE[,SIZE]...
+
+import sys
+import json
+import shlex
+import bisect
+import optparse
+import collections
+import numpy as np
+
+from qos_policy import PolicyError, Policy, diff_tc, load_policy, \
+                       parse_rate, parse_handle, format_handle
+
+NSEC_PER_SEC = 10 ** 9
+TC_HTB_MAXDEPTH = 8
+TC_HTB_NUMPRIO = 8
+QUEUE_RINGSIZE = 4096           # FIFO limit and HTB direct queue length
+DRR_QUANTUM = 5000              # QUANTUM in sch_drr.c
+HTB_MTU = 1600                  # mtu that tc adds to the default burst
+PSCHED_HZ = 10 ** 9             # clock rate in /proc/net/psched
+HTB_MBUFFER = 60 * NSEC_PER_SEC
+
+HTB_CANT_SEND, HTB_MAY_BORROW, HTB_CAN_SEND = range(3)
+
+class SimulationError(Exception):
+    pass
+
+#
+# Scheduler trees
+#
+
+class Qdisc(object):
+    '''An HTB or DRR qdisc, and its classes by minor number'''
+
+    def __init__(self, kind, handle, parent=None):
+        self.kind = kind
+        self.handle = handle            # major number
+        self.parent = parent            # Class that the qdisc is attached to
+        self.default = 0                # HTB default class
+        self.r2q = 10
+        self.classes = {}
+
+    def all_classes(self):
+        '''Yield the classes of this qdisc and of the qdiscs below it'''
+        for minor in sorted(self.classes):
+            cl = self.classes[minor]
+            yield cl
+            if cl.child:
+                for c in cl.child.all_classes():
+                    yield c
+
+class Class(object):
+    def __init__(self, qdisc, minor, parent):
+        self.qdisc = qdisc
+        self.minor = minor
+        self.parent = parent            # parent HTB class, if any
+        self.children = []
+        self.child = None               # attached qdisc, if any
+        self.limit = QUEUE_RINGSIZE     # of the leaf FIFO
+        self.prio = 0
+        self.quantum = DRR_QUANTUM
+        self.rate = self.ceil = 0       # bytes per second
+        self.buffer = self.cbuffer = 0  # nanoseconds
+        self.level = 0
+
+    def name(self):
+        return format_handle((self.qdisc.handle, self.minor))
+
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2,
+              'mb': 1024 ** 2, 'g': 1024 ** 3, 'gb': 1024 ** 3,
+              'kbit': 1024 / 8.0, 'mbit': 1024 ** 2 / 8.0,
+              'gbit': 1024 ** 3 / 8.0}
+
+def parse_size(s):
+    '''Return a tc size, such as "15k", in bytes'''
+    i = len(s.rstrip('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    unit = s[i:].lower()
+    if unit not in SIZE_UNITS:
+        raise SimulationError('invalid size "%s"' % s)
+    try:
+        return int(float(s[:i]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise SimulationError('invalid size "%s"' % s)
+
+def set_htb_class(cl, args):
+    '''Set up HTB class cl as "ovdk-tc class add ... htb args" does'''
+    opts = dict(zip(args[::2], args[1::2]))
+    if len(args) % 2 or 'rate' not in opts:
+        raise SimulationError('class %s: bad htb parameters' % cl.name())
+    for name in opts:
+        if name not in ('rate', 'ceil', 'burst', 'cburst', 'prio', 'quantum',
+                        'mtu'):
+            raise SimulationError('class %s: unsupported htb parameter "%s"' %
+                                  (cl.name(), name))
+    cl.rate = int(parse_rate(opts['rate']) / 8)
+    cl.ceil = int(parse_rate(opts.get('ceil', opts['rate'])) / 8)
+    mtu = int(opts.get('mtu', HTB_MTU))
+    burst = parse_size(opts.get('burst', '%d' % (cl.rate / PSCHED_HZ + mtu)))
+    cburst = parse_size(opts.get('cburst', '%d' % (cl.ceil / PSCHED_HZ + mtu)))
+    cl.buffer = burst * NSEC_PER_SEC // cl.rate
+    cl.cbuffer = cburst * NSEC_PER_SEC // cl.ceil
+    cl.prio = int(opts.get('prio', 0))
+    if 'quantum' in opts:
+        cl.quantum = int(opts['quantum'])
+    else:
+        cl.quantum = min(max(cl.rate // cl.qdisc.r2q, 1000), 200000)
+
+def parse_commands(lines, dev=None):
+    '''Return the root Qdisc of dev set up by ovdk-tc commands
+
+    Each line may be a shell command that runs ovdk-tc, or just the
+    arguments to ovdk-tc.  Commands other than "qdisc add" and "class add"
+    (and replace or change) are ignored.  dev may be omitted if the
+    commands set up only one device.'''
+    roots = {}
+    qdiscs = {}         # (dev, major) -> Qdisc
+    classes = {}        # (dev, major, minor) -> Class
+
+    for line in lines:
+        words = shlex.split(line, comments=True)
+        while words and words[0] not in ('qdisc', 'class'):
+            words.pop(0)
+        if len(words) < 2 or words[1] not in ('add', 'replace', 'change'):
+            continue
+        obj, words = words[0], words[2:]
+        opts = {}
+        while words and words[0] in ('dev', 'parent', 'handle', 'classid',
+                                     'root'):
+            if words[0] == 'root':
+                opts['parent'] = None
+                words = words[1:]
+            elif len(words) > 1:
+                opts[words[0]] = words[1]
+                words = words[2:]
+            else:
+                break
+        if 'dev' not in opts or not words:
+            raise SimulationError('cannot parse "%s"' % line.strip())
+        d = opts['dev']
+        if dev is not None and d != dev:
+            continue
+        kind, args = words[0], words[1:]
+
+        if obj == 'qdisc':
+            if kind not in ('htb', 'drr'):
+                raise SimulationError('unsupported qdisc "%s"' % kind)
+            major = parse_handle(opts.get('handle', '1:'), 'handle')[0]
+            parent = opts.get('parent')
+            if parent is None:
+                q = Qdisc(kind, major)
+                roots[d] = q
+            else:
+                p = parse_handle(parent, 'parent')
+                pcl = classes.get((d,) + p)
+                if pcl is None:
+                    raise SimulationError('%s: no class %s' % (d, parent))
+                q = Qdisc(kind, major, pcl)
+                pcl.child = q
+            qdiscs[d, major] = q
+            args = dict(zip(args[::2], args[1::2]))
+            if 'default' in args:
+                q.default = int(args['default'], 16)
+            if 'r2q' in args:
+                q.r2q = int(args['r2q'])
+        else:
+            major, minor = parse_handle(opts.get('classid', ''), 'classid')
+            q = qdiscs.get((d, major))
+            if q is None or q.kind != kind:
+                raise SimulationError('%s: no %s qdisc %x:' % (d, kind, major))
+            p = parse_handle(opts.get('parent', '%x:' % major), 'parent')
+            parent = p[1] and classes.get((d,) + p) or None
+            cl = classes.get((d, major, minor))
+            if cl is None:
+                cl = Class(q, minor, parent)
+                q.classes[minor] = cl
+                classes[d, major, minor] = cl
+                if parent:
+                    parent.children.append(cl)
+            if kind == 'htb':
+                set_htb_class(cl, args)
+            elif args:
+                if args[0] != 'quantum' or len(args) != 2:
+                    raise SimulationError('class %s: bad drr parameters' %
+                                          cl.name())
+                cl.quantum = parse_size(args[1])
+
+    if dev is None:
+        if len(roots) != 1:
+            raise SimulationError('the commands set up %d devices; choose '
+                                  'one' % len(roots))
+        dev = roots.keys()[0]
+    if dev not in roots:
+        raise SimulationError('no root qdisc for %s' % dev)
+
+    # Leaves have level 0, and inner classes one less than their parent,
+    # starting from TC_HTB_MAXDEPTH - 1 (see htb_change_class())
+    for q in qdiscs.values():
+        for cl in sorted(q.classes.values(), key=depth):
+            if cl.children:
+                cl.level = (cl.parent and cl.parent.level or
+                            TC_HTB_MAXDEPTH) - 1
+    return roots[dev]
+
+def depth(cl):
+    n = 0
+    while cl.parent:
+        cl = cl.parent
+        n += 1
+    return n
+
+def load_tree(filename, dev=None):
+    '''Return the root Qdisc of dev in a policy or ovdk-tc script'''
+    if filename.endswith(('.json', '.yaml', '.yml')):
+        lines = diff_tc(Policy(None), Policy(load_policy(filename)))
+    else:
+        lines = open(filename).readlines()
+    return parse_commands(lines, dev)
+
+def classify(q, queue):
+    '''Return the leaf Class that packets enqueued to queue end up in, the
+    HTB qdisc whose direct queue they end up in, or None if they are dropped
+    (see htb_classify() and drr_classify())'''
+    while True:
+        cl = q.classes.get(queue)
+        if cl is None and q.kind == 'htb':
+            cl = q.classes.get(q.default)
+            if cl is None or cl.children:
+                return q
+        if cl is None:
+            return None
+        if cl.children:
+            raise SimulationError('queue 0x%x is an inner class of qdisc %x:' %
+                                  (queue, q.handle))
+        if cl.child is None:
+            return cl
+        q = cl.child
+
+#
+# Traffic
+#
+
+class Traffic(object):
+    '''Packets sent to a class at an average rate, with a size picked at
+    random from sizes, and either evenly spaced ('cbr') or with exponential
+    gaps ('poisson')'''
+
+    def __init__(self, classid, rate, sizes=(1500,), start=0.0, stop=None,
+                 process='poisson'):
+        self.classid = classid
+        self.queue = parse_handle(classid, 'classid')[1]
+        self.rate = parse_rate(rate) / 8
+        self.sizes = np.atleast_1d(np.asarray(sizes, dtype=np.int64))
+        self.start = start
+        self.stop = stop
+        if process not in ('poisson', 'cbr'):
+            raise SimulationError('unknown arrival process "%s"' % process)
+        self.process = process
+
+    def generate(self, duration, rng):
+        '''Return the arrival times and sizes of the packets sent in
+        [start, min(stop, duration))'''
+        stop = min(self.stop or duration, duration)
+        span = stop - self.start
+        if span <= 0 or self.rate <= 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        gap = self.sizes.mean() / self.rate
+        n = int(span / gap * 1.1 + 10 * np.sqrt(span / gap) + 10)
+        if self.process == 'cbr':
+            times = self.start + gap * np.arange(n)
+        else:
+            times = self.start + np.cumsum(rng.exponential(gap, n))
+        times = times[times < stop]
+        sizes = self.sizes[rng.randint(0, len(self.sizes), len(times))]
+        return times, sizes
+
+def generate(traffic, duration, seed=0):
+    '''Return the packets of all of traffic in arrival order, as arrays of
+    arrival times (in seconds), sizes and indexes into traffic'''
+    rng = np.random.RandomState(seed)
+    times, sizes, sources = [], [], []
+    for i, t in enumerate(traffic):
+        a, s = t.generate(duration, rng)
+        times.append(a)
+        sizes.append(s)
+        sources.append(np.full(len(a), i, dtype=np.int32))
+    times = np.concatenate(times + [np.zeros(0)])
+    sizes = np.concatenate(sizes + [np.zeros(0, dtype=np.int64)])
+    sources = np.concatenate(sources + [np.zeros(0, dtype=np.int32)])
+    order = np.argsort(times, kind='mergesort')
+    return times[order], sizes[order], sources[order]
+
+class Result(object):
+    '''The fate of each packet of a simulation: departure is the time its
+    last byte left the port, or NaN if it was dropped or was still queued
+    at the end'''
+
+    def __init__(self, traffic, duration, times, sizes, sources, departure,
+                 dropped):
+        self.traffic = traffic
+        self.duration = duration
+        self.times = times
+        self.sizes = sizes
+        self.sources = sources
+        self.departure = departure
+        self.dropped = dropped
+
+    def summary(self, warmup=0.0):
+        '''Return a dict of statistics for each Traffic over the time after
+        warmup: the rates at which its packets arrived and left, and the
+        drops and delays of the packets that arrived then'''
+        span = self.duration - warmup
+        departure = np.where(np.isnan(self.departure), np.inf, self.departure)
+        left = (departure >= warmup) & (departure <= self.duration)
+        stats = []
+        for i, t in enumerate(self.traffic):
+            mine = self.sources == i
+            sel = mine & (self.times >= warmup)
+            done = sel & left
+            delay = (departure[done] - self.times[done]) * 1000
+            s = {'class': t.classid,
+                 'packets': int(sel.sum()),
+                 'offered_bps': self.sizes[sel].sum() * 8 / span,
+                 'throughput_bps': self.sizes[mine & left].sum() * 8 / span,
+                 'dropped': int(self.dropped[sel].sum())}
+            if len(delay):
+                s.update(delay_mean_ms=delay.mean(),
+                         delay_p50_ms=np.percentile(delay, 50),
+                         delay_p99_ms=np.percentile(delay, 99),
+                         delay_max_ms=delay.max())
+            stats.append(s)
+        return stats
+
+#
+# Fluid model
+#
+
+def share(budget, weight, cap, groups=None, avail=None):
+    '''Split budget between claimants in proportion to weight, giving none
+    of them more than cap, and letting the claimants in each row of the
+    boolean matrix groups take no more than avail in all'''
+    x = np.zeros(len(weight))
+    if groups is None:
+        groups = np.zeros((0, len(weight)), dtype=bool)
+        avail = np.zeros(0)
+    left = np.asarray(avail, dtype=float).copy()
+    open_ = cap > 1e-9
+    for _ in xrange(len(weight) + len(left) + 1):
+        if budget <= 1e-9:
+            break
+        open_ &= ~(groups & (left <= 1e-9)[:, None]).any(axis=0)
+        if not open_.any():
+            break
+        w = np.where(open_, weight, 0.0)
+        y = np.minimum(budget * w / w.sum(), cap - x)
+        if len(left):
+            used = groups.dot(y)
+            scale = np.where(used > left, left / np.maximum(used, 1e-300), 1.0)
+            y *= np.where(groups, scale[:, None], 1.0).min(axis=0)
+        x += y
+        budget -= y.sum()
+        left -= groups.dot(y)
+        open_ &= cap - x > 1e-9
+    return x
+
+class _FluidQdisc(object):
+    def __init__(self, q, queues):
+        self.q = q
+        self.classes = list(q.classes[m] for m in sorted(q.classes))
+        n = len(self.classes)
+        index = dict((cl, i) for i, cl in enumerate(self.classes))
+        self.leaves = [i for i, cl in enumerate(self.classes)
+                       if not cl.children]
+        self.queue = [queues.get(self.classes[i]) for i in self.leaves]
+        self.child = [self.classes[i].child and
+                      _FluidQdisc(self.classes[i].child, queues)
+                      for i in self.leaves]
+        self.direct = queues.get(q)
+        self.quantum = np.array([cl.quantum for cl in self.classes], float)
+        self.prio = np.array([cl.prio for cl in self.classes])
+        self.level = np.array([cl.level for cl in self.classes])
+        self.rate = np.array([cl.rate for cl in self.classes], float)
+        self.ceil = np.array([cl.ceil for cl in self.classes], float)
+        self.burst = self.rate * [cl.buffer for cl in self.classes] / 1e9
+        self.cburst = self.ceil * [cl.cbuffer for cl in self.classes] / 1e9
+        self.tokens = self.burst.copy()
+        self.ctokens = self.cburst.copy()
+
+        # anc[j, i]: class j is leaf i or one of its ancestors
+        self.anc = np.zeros((n, len(self.leaves)), dtype=bool)
+        for i, leaf in enumerate(self.leaves):
+            cl = self.classes[leaf]
+            while cl:
+                self.anc[index[cl], i] = True
+                cl = cl.parent
+
+    def backlog(self, backlog):
+        '''Return the backlog of each leaf, in bytes'''
+        b = np.zeros(len(self.leaves))
+        for i in xrange(len(self.leaves)):
+            if self.child[i]:
+                b[i] = self.child[i].total(backlog)
+            elif self.queue[i] is not None:
+                b[i] = backlog[self.queue[i]]
+        return b
+
+    def total(self, backlog):
+        b = self.backlog(backlog).sum()
+        if self.direct is not None:
+            b += backlog[self.direct]
+        return b
+
+    def serve(self, budget, backlog, served, dt):
+        '''Hand out up to budget bytes to the queues below this qdisc, adding
+        them to served.  Returns the number of bytes handed out.'''
+        total = 0.0
+        if self.direct is not None:
+            x = min(budget, backlog[self.direct])
+            served[self.direct] += x
+            total += x
+            budget -= x
+        demand = self.backlog(backlog)
+        if self.q.kind == 'drr':
+            x = share(budget, self.quantum[self.leaves], demand)
+        else:
+            x = self.htb_share(budget, demand, dt)
+        for i, amount in enumerate(x):
+            if amount <= 0:
+                continue
+            if self.child[i]:
+                total += self.child[i].serve(amount, backlog, served, dt)
+            else:
+                served[self.queue[i]] += amount
+                total += amount
+        return total
+
+    def charge(self, y, level):
+        '''Charge the bytes y sent by the leaves, borrowing at level, to
+        their classes and ancestors (see htb_charge_class())'''
+        self.ctokens -= self.anc.dot(y)
+        self.tokens -= (self.anc & (self.level >= level)[:, None]).dot(y)
+
+    def htb_share(self, budget, demand, dt):
+        leaves = self.leaves
+        self.tokens = np.minimum(self.tokens, self.burst) + self.rate * dt
+        self.ctokens = np.minimum(self.ctokens, self.cburst) + self.ceil * dt
+        x = np.zeros(len(leaves))
+        prios = sorted(set(self.prio[leaves]))
+
+        # Leaves that can send from their own tokens go first, by priority,
+        # and share by quantum (level 0 in htb_dequeue())
+        for prio in prios:
+            if budget <= 1e-9:
+                break
+            cap = np.minimum(demand - x, np.minimum(self.tokens[leaves],
+                                                    self.ctokens[leaves]))
+            cap = np.where(self.prio[leaves] == prio, np.maximum(cap, 0), 0)
+            y = share(budget, self.quantum[leaves], cap)
+            self.charge(y, 0)
+            x += y
+            budget -= y.sum()
+
+        # Then leaves borrow from ancestors that have tokens left, nearest
+        # ancestors first
+        for level in sorted(set(self.level[self.level > 0])):
+            lender = (self.level == level) & (self.tokens > 0) & \
+                     (self.ctokens > 0)
+            if not lender.any():
+                continue
+            # path[j, i]: class j is leaf i or an ancestor that is not above
+            # the lender
+            path = self.anc & (self.level <= level)[:, None]
+            below = path & (self.level < level)[:, None]
+            ok = path[lender].any(axis=0)
+            ok &= ~(below & ((self.ctokens <= 0) |
+                             ((self.tokens > 0) &
+                              (self.level > 0)))[:, None]).any(axis=0)
+            avail = np.where(lender, np.minimum(self.tokens, self.ctokens),
+                             self.ctokens)
+            for prio in prios:
+                if budget <= 1e-9:
+                    break
+                cap = np.where(ok & (self.prio[leaves] == prio),
+                               np.maximum(demand - x, 0), 0)
+                if not cap.any():
+                    continue
+                y = share(budget, self.quantum[leaves], cap, path, avail)
+                self.charge(y, level)
+                avail = np.where(lender,
+                                 np.minimum(self.tokens, self.ctokens),
+                                 self.ctokens)
+                x += y
+                budget -= y.sum()
+
+        self.tokens = np.minimum(self.tokens, self.burst)
+        self.ctokens = np.minimum(self.ctokens, self.cburst)
+        return x
+
+def _queues(root, traffic):
+    '''Number the FIFOs and HTB direct queues that traffic goes to, and
+    return the map from Class or Qdisc to number, and the number for each
+    Traffic (or -1 if it is dropped)'''
+    queues = {}
+    target = []
+    for t in traffic:
+        dest = classify(root, t.queue)
+        if dest is None:
+            target.append(-1)
+            continue
+        if dest not in queues:
+            queues[dest] = len(queues)
+        target.append(queues[dest])
+    return queues, np.array(target, dtype=np.int64)
+
+def simulate(root, traffic, link_rate, duration, dt=0.001, seed=0):
+    '''Simulate traffic through the scheduler tree root for duration
+    seconds with the fluid model, and return a Result'''
+    times, sizes, sources = generate(traffic, duration, seed)
+    queues, target = _queues(root, traffic)
+    nq = max(len(queues), 1)
+    nslots = int(np.ceil(duration / dt))
+    link = parse_rate(link_rate) / 8 * dt
+    tree = _FluidQdisc(root, queues)
+
+    # Per-queue byte limits, from the packet limits and the mean packet size
+    limit = np.zeros(nq)
+    for dest, qi in queues.items():
+        packets = isinstance(dest, Class) and dest.limit + 1 or QUEUE_RINGSIZE
+        mean = sizes[target[sources] == qi].mean() if len(sizes) else 1500
+        limit[qi] = packets * (mean if mean == mean else 1500)
+
+    # Sort the packets by slot and queue, so that the packets of each
+    # slot and queue are contiguous; cum[i] is the size of the packets
+    # before packet i in this order
+    queue = target[sources] if len(sources) else np.zeros(0, dtype=np.int64)
+    slot = np.minimum((times / dt).astype(np.int64), nslots - 1)
+    key = np.where(queue >= 0, slot * nq + queue, -1)
+    order = np.argsort(key, kind='mergesort')
+    skey = key[order]
+    cum = np.concatenate([[0], np.cumsum(sizes[order])]).astype(float)
+    groups = np.arange(nslots * nq)
+    start = np.searchsorted(skey, groups).reshape(nslots, nq)
+    count = (np.searchsorted(skey, groups, 'right') -
+             start.ravel()).reshape(nslots, nq)
+
+    backlog = np.zeros(nq)
+    admitted = np.zeros((nslots, nq), dtype=np.int64)
+    served = np.zeros((nslots, nq))
+    for s in xrange(nslots):
+        # Tail drop what does not fit below the limit
+        a = start[s]
+        room = limit - backlog
+        k = np.searchsorted(cum, cum[a] + room, 'right') - 1 - a
+        k = np.clip(k, 0, count[s])
+        admitted[s] = k
+        backlog += cum[a + k] - cum[a]
+        tree.serve(link, backlog, served[s], dt)
+        np.minimum(served[s], backlog, served[s])
+        backlog -= served[s]
+
+    # A packet is dropped if it is not among the first admitted[slot, queue]
+    # packets of its slot and queue
+    rank = np.arange(len(order)) - start.ravel()[np.maximum(skey, 0)]
+    dropped = np.zeros(len(times), dtype=bool)
+    dropped[order] = (skey < 0) | \
+                     (rank >= admitted.ravel()[np.maximum(skey, 0)])
+
+    # A packet leaves when the service of its queue covers all the bytes
+    # admitted to the queue up to and including it
+    departure = np.full(len(times), np.nan)
+    edges = dt * np.arange(nslots + 1)
+    for qi in xrange(nq):
+        sel = np.flatnonzero((queue == qi) & ~dropped)
+        if not len(sel):
+            continue
+        need = np.cumsum(sizes[sel])
+        have = np.concatenate([[0], np.cumsum(served[:, qi])])
+        j = np.searchsorted(have, need - 1e-6)
+        ok = j <= nslots
+        j = np.clip(j, 1, nslots)
+        step = have[j] - have[j - 1]
+        frac = np.where(step > 0,
+                        (need - have[j - 1]) / np.maximum(step, 1e-300), 1.0)
+        t = edges[j - 1] + dt * np.clip(frac, 0, 1)
+        t = np.maximum(t, times[sel] + sizes[sel] / (link / dt))
+        departure[sel[ok]] = t[ok]
+    return Result(traffic, duration, times, sizes, sources, departure, dropped)
+
+#
+# Packet by packet model
+#
+
+class _Packet(object):
+    __slots__ = ('id', 'len', 'queue')
+
+    def __init__(self, id, len, queue):
+        self.id = id
+        self.len = len
+        self.queue = queue
+
+class _Fifo(object):
+    def __init__(self, limit):
+        self.limit = limit
+        self.q = collections.deque()
+        self.qlen = 0
+
+    def enqueue(self, pkt):
+        # pfifo_enqueue() accepts packets while qlen <= limit
+        if self.qlen <= self.limit:
+            self.q.append(pkt)
+            self.qlen += 1
+            return True
+        return False
+
+    def dequeue(self, now):
+        if self.qlen:
+            self.qlen -= 1
+            return self.q.popleft()
+        return None
+
+    def peek(self, now):
+        return self.q[0] if self.qlen else None
+
+    def wakeup(self):
+        return None
+
+class _Peekable(object):
+    '''qdisc_peek_dequeued() and qdisc_dequeue_peeked()'''
+
+    stash = None
+
+    def peek(self, now):
+        if self.stash is None:
+            self.stash = self.dequeue(now)
+            if self.stash is not None:
+                self.qlen += 1
+        return self.stash
+
+    def dequeue(self, now):
+        pkt = self.stash
+        if pkt is not None:
+            self.stash = None
+            self.qlen -= 1
+            return pkt
+        return self._dequeue(now)
+
+def _runtime(q):
+    if q.kind == 'htb':
+        return _Htb(q)
+    return _Drr(q)
+
+def _leaf_qdisc(cl):
+    return cl.child and _runtime(cl.child) or _Fifo(cl.limit)
+
+class _DrrClass(object):
+    def __init__(self, cl):
+        self.quantum = cl.quantum
+        self.deficit = 0
+        self.q = _leaf_qdisc(cl)
+
+class _Drr(_Peekable):
+    '''drr_enqueue() and drr_dequeue()'''
+
+    def __init__(self, q):
+        self.classes = dict((m, _DrrClass(cl)) for m, cl in q.classes.items())
+        self.active = collections.deque()
+        self.qlen = 0
+
+    def enqueue(self, pkt):
+        cl = self.classes.get(pkt.queue)
+        if cl is None or not cl.q.enqueue(pkt):
+            return False
+        if cl.q.qlen == 1:
+            self.active.append(cl)
+            cl.deficit = cl.quantum
+        self.qlen += 1
+        return True
+
+    def _dequeue(self, now):
+        if not self.active:
+            return None
+        while True:
+            cl = self.active[0]
+            pkt = cl.q.peek(now)
+            if pkt is None:
+                return None
+            if pkt.len <= cl.deficit:
+                cl.deficit -= pkt.len
+                cl.q.dequeue(now)
+                if cl.q.qlen == 0:
+                    self.active.popleft()
+                self.qlen -= 1
+                return pkt
+            cl.deficit += cl.quantum
+            self.active.rotate(-1)
+
+    def wakeup(self):
+        times = [cl.q.wakeup() for cl in self.active]
+        times = [t for t in times if t is not None]
+        return times and min(times) or None
+
+class _HtbPrio(object):
+    '''struct htb_prio: a row or feed, kept as a list sorted by classid'''
+
+    __slots__ = ('tree', 'ptr', 'last_ptr_id')
+
+    def __init__(self):
+        self.tree = []
+        self.ptr = None
+        self.last_ptr_id = 0
+
+    def insert(self, cl):
+        i = bisect.bisect([c.classid for c in self.tree], cl.classid)
+        self.tree.insert(i, cl)
+
+    def erase(self, cl):
+        self.tree.remove(cl)
+
+    def next(self, cl):
+        '''rb_next()'''
+        if cl is None:
+            return None
+        i = self.tree.index(cl) + 1
+        return i < len(self.tree) and self.tree[i] or None
+
+    def find_next_upper(self, id):
+        '''htb_id_find_next_upper()'''
+        for cl in self.tree:
+            if cl.classid >= id:
+                return cl
+        return None
+
+class _HtbClass(object):
+    def __init__(self, cfg, parent):
+        self.classid = cfg.minor
+        self.parent = parent
+        self.level = cfg.level
+        self.prio = cfg.prio
+        self.quantum = cfg.quantum
+        self.rate = cfg.rate
+        self.ceil = cfg.ceil
+        self.buffer = cfg.buffer
+        self.cbuffer = cfg.cbuffer
+        self.mbuffer = HTB_MBUFFER
+        self.tokens = cfg.buffer
+        self.ctokens = cfg.cbuffer
+        self.t_c = 0
+        self.cmode = HTB_CAN_SEND
+        self.prio_activity = 0
+        self.pq_key = 0
+        self.deficit = [0] * TC_HTB_MAXDEPTH
+        self.clprio = [_HtbPrio() for p in xrange(TC_HTB_NUMPRIO)]
+        self.q = not cfg.children and _leaf_qdisc(cfg) or None
+
+def _bits(mask):
+    '''The set bits of mask, lowest first (ffz(~mask) in a loop)'''
+    return [b for b in xrange(TC_HTB_NUMPRIO) if mask & (1 << b)]
+
+def _l2t(rate, size):
+    '''psched_l2t_ns()'''
+    return size * NSEC_PER_SEC // rate
+
+class _Htb(_Peekable):
+    '''The enqueue and dequeue paths of sch_htb.c'''
+
+    DIRECT = object()
+
+    def __init__(self, q):
+        self.classes = {}
+        for cfg in sorted(q.classes.values(), key=depth):
+            self.classes[cfg.minor] = _HtbClass(
+                cfg, cfg.parent and self.classes[cfg.parent.minor])
+        self.defcls = q.default
+        self.direct = collections.deque()
+        self.direct_qlen = QUEUE_RINGSIZE
+        self.qlen = 0
+        self.now = 0
+        self.hprio = [[_HtbPrio() for p in xrange(TC_HTB_NUMPRIO)]
+                      for l in xrange(TC_HTB_MAXDEPTH)]
+        self.row_mask = [0] * TC_HTB_MAXDEPTH
+        self.wait_pq = [[] for l in xrange(TC_HTB_MAXDEPTH)]
+        self.near_ev_cache = [0] * TC_HTB_MAXDEPTH
+        self.next_event = None
+
+    def classify(self, pkt):
+        cl = self.classes.get(pkt.queue)
+        if cl:
+            return cl
+        cl = self.classes.get(self.defcls)
+        if not cl or cl.level:
+            return self.DIRECT
+        return cl
+
+    def add_to_wait_tree(self, cl, delay):
+        cl.pq_key = self.now + delay
+        if cl.pq_key == self.now:
+            cl.pq_key += 1
+        if self.near_ev_cache[cl.level] > cl.pq_key:
+            self.near_ev_cache[cl.level] = cl.pq_key
+        wait = self.wait_pq[cl.level]
+        i = bisect.bisect([c.pq_key for c in wait], cl.pq_key)
+        wait.insert(i, cl)
+
+    def add_class_to_row(self, cl, mask):
+        self.row_mask[cl.level] |= mask
+        for prio in _bits(mask):
+            self.hprio[cl.level][prio].insert(cl)
+
+    def remove_class_from_row(self, cl, mask):
+        m = 0
+        for prio in _bits(mask):
+            hprio = self.hprio[cl.level][prio]
+            if hprio.ptr is cl:
+                hprio.ptr = hprio.next(cl)
+            hprio.erase(cl)
+            if not hprio.tree:
+                m |= 1 << prio
+        self.row_mask[cl.level] &= ~m
+
+    def activate_prios(self, cl):
+        p = cl.parent
+        mask = cl.prio_activity
+        while cl.cmode == HTB_MAY_BORROW and p and mask:
+            for prio in _bits(mask):
+                if p.clprio[prio].tree:
+                    mask &= ~(1 << prio)
+                p.clprio[prio].insert(cl)
+            p.prio_activity |= mask
+            cl = p
+            p = cl.parent
+        if cl.cmode == HTB_CAN_SEND and mask:
+            self.add_class_to_row(cl, mask)
+
+    def deactivate_prios(self, cl):
+        p = cl.parent
+        mask = cl.prio_activity
+        while cl.cmode == HTB_MAY_BORROW and p and mask:
+            m = mask
+            mask = 0
+            for prio in _bits(m):
+                feed = p.clprio[prio]
+                if feed.ptr is cl:
+                    feed.last_ptr_id = cl.classid
+                    feed.ptr = None
+                feed.erase(cl)
+                if not feed.tree:
+                    mask |= 1 << prio
+            p.prio_activity &= ~mask
+            cl = p
+            p = cl.parent
+        if cl.cmode == HTB_CAN_SEND and mask:
+            self.remove_class_from_row(cl, mask)
+
+    def class_mode(self, cl, diff):
+        toks = cl.ctokens + diff
+        if toks < 0:
+            return HTB_CANT_SEND, -toks
+        toks = cl.tokens + diff
+        if toks >= 0:
+            return HTB_CAN_SEND, diff
+        return HTB_MAY_BORROW, -toks
+
+    def change_class_mode(self, cl, diff):
+        new_mode, diff = self.class_mode(cl, diff)
+        if new_mode == cl.cmode:
+            return diff
+        if cl.prio_activity:
+            if cl.cmode != HTB_CANT_SEND:
+                self.deactivate_prios(cl)
+            cl.cmode = new_mode
+            if new_mode != HTB_CANT_SEND:
+                self.activate_prios(cl)
+        else:
+            cl.cmode = new_mode
+        return diff
+
+    def activate(self, cl):
+        if not cl.prio_activity:
+            cl.prio_activity = 1 << cl.prio
+            self.activate_prios(cl)
+
+    def deactivate(self, cl):
+        self.deactivate_prios(cl)
+        cl.prio_activity = 0
+
+    def enqueue(self, pkt):
+        cl = self.classify(pkt)
+        if cl is self.DIRECT:
+            if len(self.direct) >= self.direct_qlen:
+                return False
+            self.direct.append(pkt)
+        elif not cl.q.enqueue(pkt):
+            return False
+        else:
+            self.activate(cl)
+        self.qlen += 1
+        return True
+
+    def charge_class(self, cl, level, size):
+        while cl:
+            diff = min(self.now - cl.t_c, cl.mbuffer)
+            if cl.level >= level:
+                toks = min(diff + cl.tokens, cl.buffer) - _l2t(cl.rate, size)
+                cl.tokens = max(toks, 1 - cl.mbuffer)
+            else:
+                cl.tokens += diff
+            toks = min(diff + cl.ctokens, cl.cbuffer) - _l2t(cl.ceil, size)
+            cl.ctokens = max(toks, 1 - cl.mbuffer)
+            cl.t_c = self.now
+
+            old_mode = cl.cmode
+            diff = self.change_class_mode(cl, 0)
+            if old_mode != cl.cmode:
+                if old_mode != HTB_CAN_SEND:
+                    self.wait_pq[cl.level].remove(cl)
+                if cl.cmode != HTB_CAN_SEND:
+                    self.add_to_wait_tree(cl, diff)
+            cl = cl.parent
+
+    def do_events(self, level):
+        wait = self.wait_pq[level]
+        while True:
+            if not wait:
+                return 0
+            cl = wait[0]
+            if cl.pq_key > self.now:
+                return cl.pq_key
+            wait.pop(0)
+            diff = min(self.now - cl.t_c, cl.mbuffer)
+            diff = self.change_class_mode(cl, diff)
+            if cl.cmode != HTB_CAN_SEND:
+                self.add_to_wait_tree(cl, diff)
+
+    def lookup_leaf(self, hprio, prio):
+        stk = [hprio]
+        for i in xrange(65535):
+            sp = stk[-1]
+            if sp.ptr is None and sp.last_ptr_id:
+                sp.ptr = sp.find_next_upper(sp.last_ptr_id)
+            sp.last_ptr_id = 0
+            if sp.ptr is None:
+                if not sp.tree:
+                    return None
+                sp.ptr = sp.tree[0]
+                if len(stk) > 1:
+                    stk.pop()
+                    sp = stk[-1]
+                    if sp.ptr is None:
+                        return None
+                    sp.ptr = sp.next(sp.ptr)
+            else:
+                cl = sp.ptr
+                if not cl.level:
+                    return cl
+                stk.append(cl.clprio[prio])
+        return None
+
+    def dequeue_tree(self, prio, level):
+        hprio = self.hprio[level][prio]
+        start = cl = self.lookup_leaf(hprio, prio)
+        while True:
+            if cl is None:
+                return None
+            if cl.q.qlen == 0:
+                self.deactivate(cl)
+                if not self.row_mask[level] & (1 << prio):
+                    return None
+                nxt = self.lookup_leaf(hprio, prio)
+                if cl is start:
+                    start = nxt
+                cl = nxt
+                continue
+            pkt = cl.q.dequeue(self.now)
+            if pkt is not None:
+                break
+            feed = level and cl.parent.clprio[prio] or self.hprio[0][prio]
+            feed.ptr = feed.next(feed.ptr)
+            cl = self.lookup_leaf(hprio, prio)
+            if cl is start:
+                return None
+
+        cl.deficit[level] -= pkt.len
+        if cl.deficit[level] < 0:
+            cl.deficit[level] += cl.quantum
+            feed = level and cl.parent.clprio[prio] or self.hprio[0][prio]
+            feed.ptr = feed.next(feed.ptr)
+        if not cl.q.qlen:
+            self.deactivate(cl)
+        self.charge_class(cl, level, pkt.len)
+        return pkt
+
+    def _dequeue(self, now):
+        self.next_event = None
+        if self.direct:
+            self.qlen -= 1
+            return self.direct.popleft()
+        if not self.qlen:
+            return None
+        self.now = now
+        next_event = now + 5 * NSEC_PER_SEC
+        for level in xrange(TC_HTB_MAXDEPTH):
+            event = self.near_ev_cache[level]
+            if now >= event:
+                event = self.do_events(level)
+                if not event:
+                    event = now + NSEC_PER_SEC
+                self.near_ev_cache[level] = event
+            if next_event > event:
+                next_event = event
+            for prio in _bits(self.row_mask[level]):
+                pkt = self.dequeue_tree(prio, level)
+                if pkt is not None:
+                    self.qlen -= 1
+                    return pkt
+        self.next_event = next_event
+        return None
+
+    def wakeup(self):
+        times = [self.next_event]
+        times += [cl.q.wakeup() for cl in self.classes.values()
+                  if cl.q and cl.q.qlen]
+        times = [t for t in times if t is not None]
+        return times and min(times) or None
+
+def simulate_packets(root, traffic, link_rate, duration, seed=0):
+    '''Simulate traffic through the scheduler tree root for duration
+    seconds packet by packet, and return a Result'''
+    times, sizes, sources = generate(traffic, duration, seed)
+    for t in traffic:
+        classify(root, t.queue)         # reject inner classes
+    queue = [t.queue for t in traffic]
+    link = int(parse_rate(link_rate))
+    sched = _runtime(root)
+    arrivals = (times * NSEC_PER_SEC).astype(np.int64).tolist()
+    lens = sizes.tolist()
+    srcs = sources.tolist()
+    departure = np.full(len(times), np.nan)
+    dropped = np.zeros(len(times), dtype=bool)
+    end = int(duration * NSEC_PER_SEC)
+
+    n = len(arrivals)
+    i = 0
+    now = 0
+    while now < end:
+        while i < n and arrivals[i] <= now:
+            if not sched.enqueue(_Packet(i, lens[i], queue[srcs[i]])):
+                dropped[i] = True
+            i += 1
+        pkt = sched.dequeue(now)
+        if pkt is not None:
+            now += pkt.len * 8 * NSEC_PER_SEC // link
+            departure[pkt.id] = now / 1e9
+            continue
+        wake = [t for t in (i < n and arrivals[i] or None, sched.wakeup())
+                if t is not None]
+        if not wake:
+            break
+        now = max(min(wake), now + 1)
+    return Result(traffic, duration, times, sizes, sources, departure, dropped)
+
+#
+# Command line
+#
+
+def format_rate(bps):
+    for unit, scale in (('Gbit', 1e9), ('Mbit', 1e6), ('Kbit', 1e3)):
+        if bps >= scale:
+            return '%.2f %s' % (bps / scale, unit)
+    return '%.0f bit' % bps
+
+def print_summary(stats):
+    print '%-8s %14s %14s %8s %10s %10s %10s' % \
+          ('class', 'offered', 'throughput', 'dropped', 'mean ms', 'p99 ms',
+           'max ms')
+    for s in stats:
+        print '%-8s %14s %14s %8d %10.3f %10.3f %10.3f' % \
+              (s['class'], format_rate(s['offered_bps']),
+               format_rate(s['throughput_bps']), s['dropped'],
+               s.get('delay_mean_ms', 0), s.get('delay_p99_ms', 0),
+               s.get('delay_max_ms', 0))
+
+def main(args):
+    parser = optparse.OptionParser(
+        usage='%prog [options] <policy or script> CLASSID=RATE[,SIZE]...')
+    parser.add_option('--dev', help='device to simulate')
+    parser.add_option('--link', default='10gbit',
+                      help='link rate (default: %default)')
+    parser.add_option('-d', '--duration', type='float', default=10.0,
+                      help='simulated seconds (default: %default)')
+    parser.add_option('--warmup', type='float', default=0.0,
+                      help='seconds left out of the statistics')
+    parser.add_option('--dt', type='float', default=0.001,
+                      help='time step of the fluid model (default: %default)')
+    parser.add_option('--cbr', action='store_true', default=False,
+                      help='evenly spaced packets instead of Poisson arrivals')
+    parser.add_option('--packets', action='store_true', default=False,
+                      help='simulate packet by packet')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print the statistics as JSON')
+    options, args = parser.parse_args(args)
+    if len(args) < 2:
+        parser.error('need a policy or script and some traffic')
+
+    try:
+        root = load_tree(args[0], options.dev)
+        traffic = []
+        for spec in args[1:]:
+            classid, _, rest = spec.partition('=')
+            rate, _, size = rest.partition(',')
+            if not rate:
+                raise SimulationError('bad traffic "%s"' % spec)
+            traffic.append(Traffic(classid, rate, int(size or 1500),
+                                   process=options.cbr and 'cbr' or
+                                           'poisson'))
+        if options.packets:
+            result = simulate_packets(root, traffic, options.link,
+                                      options.duration, options.seed)
+        else:
+            result = simulate(root, traffic, options.link, options.duration,
+                              options.dt, options.seed)
+    except (SimulationError, PolicyError, EnvironmentError), e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+
+    stats = result.summary(options.warmup)
+    if options.json:
+        print json.dumps(stats, indent=2, sort_keys=True)
+    else:
+        print_summary(stats)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
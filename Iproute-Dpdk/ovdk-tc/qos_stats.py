@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+#
+# Collect the QoS statistics of ovdk ports over time
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+#
+# Polls the statistics of every qdisc and class at a fixed interval, either
+# from "ovdk-tc -s qdisc show" and "ovdk-tc -s class show" through
+# tc-server, or from the qos/show command of ovs-vswitchd.  The last
+# samples of each qdisc, class or queue are kept in a ring buffer of fixed
+# size, together with the rates worked out from them.  Every sample can be
+# appended to a file as one line of JSON, and the latest ones can be served
+# in the Prometheus text format.  Such a file can be replayed later to look
+# at the rates and drops offline.
+#
+# Usage: qos_stats.py [options] --tc-server PORT
+#        qos_stats.py [options] --unixctl TARGET --iface IFACE...
+#        qos_stats.py [options] --replay FILE
+
+import re
+import sys
+import json
+import time
+import socket
+import optparse
+import threading
+import collections
+import BaseHTTPServer
+
+from tc_client import TcClient, TcError
+
+# Counters of "Sent ... (dropped ..., overlimits ... requeues ...)", the
+# HTB extended statistics and queue statistics, and whether each is 32 bits
+# wide in struct gnet_stats_* and struct tc_htb_xstats
+COUNTERS = {'bytes': 64, 'packets': 32, 'drops': 32, 'overlimits': 32,
+            'requeues': 32, 'lends': 32, 'borrows': 32, 'giants': 32,
+            'errors': 64}
+GAUGES = ('backlog_bytes', 'backlog_packets', 'tokens', 'ctokens', 'deficit')
+
+class StatsError(Exception):
+    pass
+
+#
+# Parsing
+#
+
+_head_re = re.compile(r'(qdisc|class) (\S+) (\S+) (?:dev (\S+) )?'
+                      r'(?:root|parent (\S+))?')
+_sent_re = re.compile(r'Sent (\d+) bytes (\d+) pkts?(?: \(dropped (\d+), '
+                      r'overlimits (\d+)(?: requeues (\d+))?\))?')
+_backlog_re = re.compile(r'backlog (?:(\d+(?:\.\d+)?[KM]?b) )?(?:(\d+)p)?')
+_htb_re = re.compile(r'lended: (\d+) borrowed: (\d+) giants: (\d+)')
+_tokens_re = re.compile(r'tokens: (-?\d+) ctokens: (-?\d+)')
+_deficit_re = re.compile(r'deficit (\d+(?:\.\d+)?[KM]?b)')
+
+def parse_size(s):
+    '''Return a size printed by ovdk-tc (see print_size() in tc_util.c),
+    such as "1514b" or "12Kb", in bytes'''
+    scale = {'K': 1024, 'M': 1024 * 1024}.get(s[-2:-1], 1)
+    return int(float(s.rstrip('KMb')) * scale)
+
+def parse_show(text, dev=None):
+    '''Return a sample for each qdisc or class in the output of
+    "ovdk-tc -s qdisc show" or "ovdk-tc -s class show"
+
+    A sample is a dict of the object ("qdisc" or "class"), its kind, id,
+    parent and device, and the statistics found for it.  dev is the device
+    if the command was for one device, whose name ovdk-tc then leaves out.'''
+    samples = []
+    for line in text.splitlines():
+        m = _head_re.match(line)
+        if m:
+            obj, kind, id, d, parent = m.groups()
+            sample = {'object': obj, 'kind': kind, 'id': id,
+                      'dev': d or dev}
+            if parent:
+                sample['parent'] = parent
+            samples.append(sample)
+            continue
+        if not samples or not line.startswith(' '):
+            continue
+        sample = samples[-1]
+        m = _sent_re.search(line)
+        if m:
+            for name, value in zip(('bytes', 'packets', 'drops', 'overlimits',
+                                    'requeues'), m.groups()):
+                if value is not None:
+                    sample[name] = int(value)
+        m = _backlog_re.search(line)
+        if m and any(m.groups()):
+            sample['backlog_bytes'] = parse_size(m.group(1) or '0b')
+            sample['backlog_packets'] = int(m.group(2) or 0)
+        m = _htb_re.search(line)
+        if m:
+            sample['lends'], sample['borrows'], sample['giants'] = \
+                map(int, m.groups())
+        m = _tokens_re.search(line)
+        if m:
+            sample['tokens'], sample['ctokens'] = map(int, m.groups())
+        m = _deficit_re.search(line)
+        if m:
+            sample['deficit'] = parse_size(m.group(1))
+    return samples
+
+_queue_re = re.compile(r'(?:Queue (\d+)|Default):$')
+_queue_stat_re = re.compile(r'\ttx_(packets|bytes|errors): (\d+)$')
+
+def parse_qos_show(text, iface):
+    '''Return a sample for each queue in the output of "qos/show iface"'''
+    samples = []
+    kind = None
+    for line in text.splitlines():
+        if line.startswith('QoS: '):
+            kind = line.split()[-1]
+            continue
+        m = _queue_re.match(line)
+        if m:
+            samples.append({'object': 'queue', 'kind': kind,
+                            'id': str(int(m.group(1) or 0)), 'dev': iface})
+            continue
+        m = _queue_stat_re.match(line)
+        if m and samples:
+            samples[-1][m.group(1)] = int(m.group(2))
+    return samples
+
+#
+# Sources
+#
+
+class TcSource(object):
+    '''The statistics of the qdiscs and classes of devs, or of every device
+    with a qdisc, from ovdk-tc through tc-server'''
+
+    def __init__(self, port, devs=None, host='127.0.0.1', timeout=30):
+        self.port = port
+        self.devs = devs
+        self.host = host
+        self.timeout = timeout
+        self.client = None
+
+    def _batch(self, commands):
+        results = self.client.check_batch(commands, stats=True)
+        return [r.output for r in results]
+
+    def poll(self):
+        try:
+            if self.client is None:
+                self.client = TcClient(self.port, self.host, self.timeout)
+            samples = []
+            devs = self.devs
+            if devs:
+                out = self._batch(['qdisc show dev %s' % d for d in devs])
+                for d, text in zip(devs, out):
+                    samples += parse_show(text, d)
+            else:
+                samples = parse_show(self._batch(['qdisc show'])[0])
+                devs = sorted(set(s['dev'] for s in samples if s['dev']))
+            out = self._batch(['class show dev %s' % d for d in devs])
+            for d, text in zip(devs, out):
+                samples += parse_show(text, d)
+            return samples
+        except (TcError, EnvironmentError), e:
+            self.close()
+            raise StatsError('tc-server port %d: %s' % (self.port, e))
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+
+class UnixctlSource(object):
+    '''The statistics of the queues of ifaces from ovs-vswitchd's qos/show
+    command; target is as for ovs-appctl -t'''
+
+    def __init__(self, target, ifaces):
+        try:
+            import ovs.unixctl
+            import ovs.unixctl.client
+        except ImportError:
+            raise StatsError('the ovs Python package is needed for --unixctl')
+        self.unixctl = ovs.unixctl
+        self.target = target
+        self.ifaces = ifaces
+        self.client = None
+
+    def poll(self):
+        if self.client is None:
+            error, path = self.unixctl.socket_name_from_target(self.target)
+            if error:
+                raise StatsError(path)
+            error, self.client = self.unixctl.client.UnixctlClient.create(path)
+            if error:
+                self.client = None
+                raise StatsError('cannot connect to %s' % path)
+        samples = []
+        for iface in self.ifaces:
+            error, err, result = self.client.transact('qos/show', [iface])
+            if error:
+                self.close()
+                raise StatsError('%s: connection failed' % self.target)
+            if err:
+                raise StatsError('%s: %s' % (iface, err.strip()))
+            samples += parse_qos_show(result, iface)
+        return samples
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+
+#
+# Time series
+#
+
+def rates(prev, cur):
+    '''Return the rate of change per second of each counter from sample
+    prev to sample cur
+
+    A counter that went down wrapped around if it is 32 bits wide and was
+    past half its range, and was otherwise reset, e.g. by the class being
+    deleted and added again; no rate is given for it then.'''
+    dt = cur['time'] - prev['time']
+    result = {}
+    if dt <= 0:
+        return result
+    for name, width in COUNTERS.items():
+        if name not in cur or name not in prev:
+            continue
+        delta = cur[name] - prev[name]
+        if delta < 0 and width == 32 and prev[name] >= 1 << 31:
+            delta += 1 << 32
+        if delta >= 0:
+            result[name] = delta / dt
+    return result
+
+def key(sample):
+    return (sample['dev'], sample['object'], sample['id'])
+
+class Series(object):
+    '''The last samples of one qdisc, class or queue, and the rates from
+    each to the next, in ring buffers of capacity entries; also totals over
+    all samples seen'''
+
+    def __init__(self, capacity):
+        self.samples = collections.deque(maxlen=capacity)
+        self.rates = collections.deque(maxlen=capacity)
+        self.count = 0
+        self.peak = {}          # highest rate of each counter
+        self.delta = {}         # total increase of each counter
+        self.max_backlog = 0
+
+    def add(self, sample):
+        if self.samples:
+            prev = self.samples[-1]
+            r = rates(prev, sample)
+            for name, value in r.items():
+                self.peak[name] = max(self.peak.get(name, 0), value)
+                dt = sample['time'] - prev['time']
+                self.delta[name] = self.delta.get(name, 0) + value * dt
+            self.rates.append((sample['time'], r))
+        self.samples.append(sample)
+        self.count += 1
+        self.max_backlog = max(self.max_backlog,
+                               sample.get('backlog_bytes', 0))
+
+    def last(self):
+        return self.samples[-1]
+
+    def rate(self):
+        '''Return the rates from the last two samples'''
+        return self.rates and self.rates[-1][1] or {}
+
+class Collector(object):
+    '''The series of every qdisc, class and queue seen, in the order first
+    seen'''
+
+    def __init__(self, capacity=360):
+        self.capacity = capacity
+        self.series = collections.OrderedDict()
+        self.current = []       # keys in the last poll
+        self.lock = threading.Lock()
+
+    def add(self, now, samples):
+        '''Add the samples of one poll taken at time now'''
+        with self.lock:
+            self.current = []
+            for sample in samples:
+                sample['time'] = now
+                k = key(sample)
+                if k not in self.series:
+                    self.series[k] = Series(self.capacity)
+                self.series[k].add(sample)
+                self.current.append(k)
+
+    def latest(self):
+        '''Return the last sample and rates of each object in the last poll'''
+        with self.lock:
+            return [(self.series[k].last(), self.series[k].rate())
+                    for k in self.current]
+
+#
+# Output
+#
+
+METRICS = [
+    ('bytes', 'counter', 'Bytes sent.'),
+    ('packets', 'counter', 'Packets sent.'),
+    ('drops', 'counter', 'Packets dropped.'),
+    ('overlimits', 'counter', 'Times a packet was held back by a limit.'),
+    ('requeues', 'counter', 'Packets requeued.'),
+    ('lends', 'counter', 'Packets an HTB class sent within its own rate.'),
+    ('borrows', 'counter', 'Packets an HTB class borrowed from ancestors.'),
+    ('giants', 'counter', 'Packets larger than the HTB class MTU.'),
+    ('errors', 'counter', 'Transmit errors.'),
+    ('backlog_bytes', 'gauge', 'Bytes queued.'),
+    ('backlog_packets', 'gauge', 'Packets queued.'),
+    ('tokens', 'gauge', 'HTB rate tokens, in scheduler ticks.'),
+    ('ctokens', 'gauge', 'HTB ceil tokens, in scheduler ticks.'),
+    ('deficit', 'gauge', 'DRR deficit, in bytes.'),
+]
+
+RATES = [
+    ('rate_bits_per_second', 'bytes', 8, 'Send rate over the last interval.'),
+    ('rate_packets_per_second', 'packets', 1,
+     'Packet rate over the last interval.'),
+    ('drops_per_second', 'drops', 1, 'Drop rate over the last interval.'),
+]
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(sample):
+    labels = ['%s="%s"' % (name, _label(str(sample[name])))
+              for name in ('dev', 'object', 'kind', 'id', 'parent')
+              if sample.get(name) is not None]
+    return '{%s}' % ','.join(labels)
+
+def format_prometheus(latest, prefix='ovdk_qos_'):
+    '''Return the samples and rates of Collector.latest() in the Prometheus
+    text format'''
+    lines = []
+    for name, type, help in METRICS:
+        metric = prefix + name + (type == 'counter' and '_total' or '')
+        values = [(s, s[name]) for s, r in latest if name in s]
+        if values:
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s %s' % (metric, type))
+            lines += ['%s%s %d' % (metric, _labels(s), v) for s, v in values]
+    for name, counter, scale, help in RATES:
+        metric = prefix + name
+        values = [(s, r[counter] * scale) for s, r in latest if counter in r]
+        if values:
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s gauge' % metric)
+            lines += ['%s%s %.6g' % (metric, _labels(s), v)
+                      for s, v in values]
+    return ''.join(line + '\n' for line in lines)
+
+def serve_metrics(collector, address):
+    '''Serve the latest statistics of collector in the Prometheus text
+    format over HTTP at address, from a background thread'''
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = format_prometheus(collector.latest())
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(address, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def format_rate(bps):
+    for unit, scale in (('Gbit', 1e9), ('Mbit', 1e6), ('Kbit', 1e3)):
+        if bps >= scale:
+            return '%.2f%s' % (bps / scale, unit)
+    return '%.0fbit' % bps
+
+def print_latest(latest, f=sys.stdout):
+    f.write('%-10s %-6s %-8s %12s %10s %10s %12s\n' %
+            ('dev', 'object', 'id', 'rate', 'pps', 'drops/s', 'backlog'))
+    for s, r in latest:
+        f.write('%-10s %-6s %-8s %12s %10.0f %10.0f %11db\n' %
+                (s['dev'], s['object'], s['id'],
+                 format_rate(r.get('bytes', 0) * 8), r.get('packets', 0),
+                 r.get('drops', 0), s.get('backlog_bytes', 0)))
+    f.flush()
+
+def print_summary(collector, f=sys.stdout):
+    f.write('%-10s %-6s %-8s %8s %12s %12s %10s %12s\n' %
+            ('dev', 'object', 'id', 'samples', 'mean rate', 'peak rate',
+             'drops', 'max backlog'))
+    for (dev, obj, id), s in collector.series.items():
+        first, last = s.samples[0], s.last()
+        span = last['time'] - first['time']
+        mean = span > 0 and s.delta.get('bytes', 0) * 8 / span or 0
+        f.write('%-10s %-6s %-8s %8d %12s %12s %10d %11db\n' %
+                (dev, obj, id, s.count, format_rate(mean),
+                 format_rate(s.peak.get('bytes', 0) * 8),
+                 s.delta.get('drops', 0), s.max_backlog))
+
+def print_csv(collector, f=sys.stdout):
+    f.write('time,dev,object,id,bps,pps,drops_per_sec,backlog_bytes,'
+            'backlog_packets\n')
+    for (dev, obj, id), s in collector.series.items():
+        backlog = dict((x['time'], x) for x in s.samples)
+        for t, r in s.rates:
+            f.write('%.3f,%s,%s,%s,%.0f,%.0f,%.0f,%d,%d\n' %
+                    (t, dev, obj, id, r.get('bytes', 0) * 8,
+                     r.get('packets', 0), r.get('drops', 0),
+                     backlog[t].get('backlog_bytes', 0),
+                     backlog[t].get('backlog_packets', 0)))
+
+#
+# Collecting and replaying
+#
+
+def collect(source, collector, interval, output=None, count=None,
+            report=None):
+    '''Poll source every interval seconds, count times or forever, adding
+    the samples to collector and writing them to output as JSON lines;
+    report is called with Collector.latest() after each poll'''
+    next_poll = time.time()
+    n = 0
+    while count is None or n < count:
+        now = time.time()
+        try:
+            samples = source.poll()
+        except StatsError, e:
+            sys.stderr.write('%s\n' % e)
+        else:
+            collector.add(round(now, 3), samples)
+            if output:
+                for sample in samples:
+                    output.write(json.dumps(sample, sort_keys=True) + '\n')
+                output.flush()
+            if report:
+                report(collector.latest())
+        n += 1
+        if count is not None and n >= count:
+            break
+        # Keep to the schedule, skipping polls that a slow one overran
+        next_poll += interval
+        now = time.time()
+        if next_poll < now:
+            next_poll = now
+        time.sleep(next_poll - now)
+
+def replay(f, collector, start=None, end=None):
+    '''Add the samples of a file written by collect() to collector, a poll
+    at a time, keeping those taken between start and end'''
+    poll = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            sample = json.loads(line)
+        except ValueError:
+            raise StatsError('bad line in replay file: %s' % line[:60])
+        t = sample.get('time')
+        if t is None or (start is not None and t < start) or \
+           (end is not None and t > end):
+            continue
+        if poll and poll[0]['time'] != t:
+            collector.add(poll[0]['time'], poll)
+            poll = []
+        poll.append(sample)
+    if poll:
+        collector.add(poll[0]['time'], poll)
+
+def parse_address(s):
+    host, _, port = s.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise StatsError('bad address "%s"' % s)
+
+def main(args):
+    parser = optparse.OptionParser(usage='''
+  %prog [options] --tc-server PORT
+  %prog [options] --unixctl TARGET --iface IFACE...
+  %prog [options] --replay FILE''')
+    parser.add_option('--tc-server', type='int', metavar='PORT',
+                      help='poll ovdk-tc through tc-server on PORT')
+    parser.add_option('--dev', action='append', default=[],
+                      help='device to poll with --tc-server (default: all)')
+    parser.add_option('--unixctl', metavar='TARGET',
+                      help='poll the qos/show command of TARGET, e.g. '
+                           'ovs-vswitchd')
+    parser.add_option('--iface', action='append', default=[],
+                      help='interface to poll with --unixctl')
+    parser.add_option('-i', '--interval', type='float', default=10.0,
+                      help='seconds between polls (default: %default)')
+    parser.add_option('-n', '--count', type='int',
+                      help='number of polls (default: no limit)')
+    parser.add_option('--capacity', type='int', default=360,
+                      help='samples kept for each class (default: %default)')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='append the samples to FILE as JSON lines')
+    parser.add_option('--listen', metavar='[ADDR:]PORT',
+                      help='serve Prometheus metrics at ADDR:PORT')
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+                      help='do not print the rates after each poll')
+    parser.add_option('--replay', metavar='FILE',
+                      help='summarize the samples in FILE')
+    parser.add_option('--from', dest='start', type='float', metavar='TIME',
+                      help='replay samples from TIME (seconds since epoch)')
+    parser.add_option('--to', dest='end', type='float', metavar='TIME',
+                      help='replay samples up to TIME')
+    parser.add_option('--csv', action='store_true', default=False,
+                      help='print the replayed rates as CSV')
+    options, args = parser.parse_args(args)
+    if args or len(filter(None, (options.tc_server, options.unixctl,
+                                 options.replay))) != 1:
+        parser.error('need one of --tc-server, --unixctl and --replay')
+    if options.unixctl and not options.iface:
+        parser.error('--unixctl needs at least one --iface')
+
+    try:
+        if options.replay:
+            collector = Collector(sys.maxint)
+            replay(open(options.replay), collector, options.start,
+                   options.end)
+            if options.csv:
+                print_csv(collector)
+            else:
+                print_summary(collector)
+            return 0
+
+        collector = Collector(options.capacity)
+        if options.tc_server:
+            source = TcSource(options.tc_server, options.dev)
+        else:
+            source = UnixctlSource(options.unixctl, options.iface)
+        output = options.output and open(options.output, 'a')
+        if options.listen:
+            serve_metrics(collector, parse_address(options.listen))
+        collect(source, collector, options.interval, output, options.count,
+                not options.quiet and print_latest or None)
+    except (StatsError, EnvironmentError), e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -6,31 +6,25 @@
  *  Date:           2013.8.5
  **********************************************************************/
 
+/*
+ * Usage: tc-client addr port [-force] [-batch [filename]]
+ *
+ * Without -batch, sends each line read from stdin to tc-server as one
+ * command.  With -batch, sends all the commands in 'filename' (or stdin)
+ * as a single request, so that they are applied by one ovdk-tc process.
+ * See tc-server.c for the protocol.
+ */
+
 #include<stdio.h>
 #include<strings.h>
 #include<string.h>
 #include<unistd.h>
 #include<sys/socket.h>
-//#include<linux/in.h>
 
 #include <stdlib.h>
-#include <syslog.h>
-#include <fcntl.h>
-#include <dlfcn.h>
-#include <sys/socket.h>
+#include <errno.h>
 #include <netinet/in.h>
 #include <arpa/inet.h>
-#include <errno.h>
-
-#include "SNAPSHOT.h"
-#include "utils.h"
-#include "tc_util.h"
-#include "tc_common.h"
-
-#define BACKLOG 1
-#define LEN     100
-#define A       20
-#define B       10
 
 int connect_to_server(char *addr, short portnum)
 {
@@ -38,119 +32,150 @@ int connect_to_server(char *addr, short portnum)
     struct sockaddr_in servadd;
 
     sockfd = socket(AF_INET, SOCK_STREAM, 0);
+    if (sockfd == -1)
+        return -1;
     bzero(&servadd, sizeof(servadd));
     servadd.sin_family = AF_INET;
     servadd.sin_port = htons(portnum);
     servadd.sin_addr.s_addr = inet_addr(addr);
-    
-    connect(sockfd, (struct sockaddr *) &servadd, sizeof(servadd));
+
+    if (connect(sockfd, (struct sockaddr *) &servadd, sizeof(servadd)) == -1) {
+        close(sockfd);
+        return -1;
+    }
     return sockfd;
 }
 
-int main(int argc, char **argv)
+static void usage(void)
 {
-    int ret;
-    int do_batching = 0;
-    char *batchfile = NULL;
+    fprintf(stderr, "Usage: tc-client addr port [-force] [-batch [filename]]\n");
+}
 
+static int is_blank(const char *line)
+{
+    line += strspn(line, " \t\r\n");
+    return *line == '\0' || *line == '#';
+}
 
-    int sockfd;
-    int num, i;
+/* Copies the reply to a request to stdout, and returns the number of
+ * failed commands, or -1 if the connection was lost */
+static int read_reply(FILE *in)
+{
+    char *line = NULL;
+    size_t len = 0;
+    int failed = 0;
+    int lineno, status;
+
+    while (getline(&line, &len, in) != -1) {
+        if (strncmp(line, "@@ ", 3) != 0) {
+            fputs(line, stdout);
+        } else if (sscanf(line, "@@ done %d", &status) == 1) {
+            free(line);
+            /* ovdk-tc may also exit before printing a command's status */
+            if (!failed && status != 0)
+                failed = 1;
+            return failed;
+        } else if (sscanf(line, "@@ %d %d", &lineno, &status) == 2) {
+            failed += status != 0;
+        }
+    }
+    free(line);
+    return -1;
+}
 
+int main(int argc, char **argv)
+{
+    int do_batching = 0;
+    int force = 0;
+    char *batchfile = NULL;
+    char *line = NULL;
+    size_t len = 0;
+    int sockfd, ret = 0;
+    FILE *sock, *reply, *in;
+
+    if (argc < 3) {
+        usage();
+        return 1;
+    }
     sockfd = connect_to_server(argv[1], atoi(argv[2]));
-    printf("what you want to say\n");
-    
-    while(1){
-
-        int i, j, k, m;
-        char send[LEN] = {'\0'};
-        char cargv[A][B];
-        char *xargv[A];
-
-        fgets(send, 100, stdin);
-        for(i = 0; send[i] != '\n'; i++);
-        send[i] = '\0';
-
-//        write(1, buf, n); 
-//        printf("\n");
-
-        for(i = 0, j = 0, k = 0, m = -1; send[i] != '\0'; i++)
-        {   
-            if(send[i] != ' ')
-            {   
-                if(i != m + 1)
-                {   
-                    cargv[k][j] = '\0';
-                    k++;
-                    j = 0;
-                }   
-                cargv[k][j] = send[i];
-                j++;
-                m = i;
-            }   
-        }   
-        cargv[k][j] = '\0';
-
-        for(i = 0; i <= k; i++)
-            xargv[i] = cargv[i];
-        xargc = k + 1;
-
-        while (xargc > 1) {
-            if (xargv[1][0] != '-')
-                break;
-            if (matches(xargv[1], "-stats") == 0 ||
-                    matches(xargv[1], "-statistics") == 0) {
-                ++show_stats;
-            } else if (matches(xargv[1], "-details") == 0) {
-                ++show_details;
-            } else if (matches(xargv[1], "-raw") == 0) {
-                ++show_raw;
-            } else if (matches(xargv[1], "-pretty") == 0) {
-                ++show_pretty;
-            } else if (matches(xargv[1], "-Version") == 0) {
-                printf("tc utility, iproute2-ss%s\n", SNAPSHOT);
-                return 0;
-            } else if (matches(xargv[1], "-iec") == 0) {
-                ++use_iec;
-            } else if (matches(xargv[1], "-help") == 0) {
-                usage();
-                return 0;
-            } else if (matches(xargv[1], "-force") == 0) {
-                ++force;
-            } else  if (matches(xargv[1], "-batch") == 0) {
-                do_batching = 1;
-                if (argc > 2)
-                    batchfile = xargv[2];
-                xargc--; xargv++;
-            } else {
-                fprintf(stderr, "Option \"%s\" is unknown, try \"tc -help\".\n", xargv[1]);
-                return -1;
-            }
-            xargc--; xargv++;
+    if (sockfd == -1) {
+        fprintf(stderr, "Cannot connect to %s:%s: %s\n", argv[1], argv[2],
+                strerror(errno));
+        return 1;
+    }
+    sock = fdopen(sockfd, "w");
+    reply = fdopen(dup(sockfd), "r");
+    argc -= 2; argv += 2;
+
+    while (argc > 1) {
+        if (strcmp(argv[1], "-force") == 0) {
+            force = 1;
+        } else if (strcmp(argv[1], "-batch") == 0) {
+            do_batching = 1;
+            if (argc > 2)
+                batchfile = argv[2];
+            argc--; argv++;
+        } else {
+            usage();
+            return 1;
         }
+        argc--; argv++;
+    }
 
-        if (do_batching)
-            return batch(batchfile);
+    in = stdin;
+    if (batchfile && strcmp(batchfile, "-") != 0) {
+        in = fopen(batchfile, "r");
+        if (in == NULL) {
+            fprintf(stderr, "Cannot open file \"%s\" for reading: %s\n",
+                    batchfile, strerror(errno));
+            return 1;
+        }
+    }
 
-        if (xargc <= 1) {
-            usage();
-            return 0;
+    if (do_batching) {
+        char **cmds = NULL;
+        int n = 0, i;
+
+        while (getline(&line, &len, in) != -1) {
+            if (is_blank(line))
+                continue;
+            cmds = realloc(cmds, (n + 1) * sizeof *cmds);
+            cmds[n++] = strdup(line);
         }
 
-        num = strlen(send);
-        write(sockfd, send, num);
-    }
-    close(sockfd);
-/*****************************************************
-    tc_core_init();
-    if (rtnl_open(&rth, 0) < 0) {
-        fprintf(stderr, "Cannot open rtnetlink\n");
-        exit(1);
+        fprintf(sock, "batch %d%s\n", n, force ? " force" : "");
+        for (i = 0; i < n; i++) {
+            fputs(cmds[i], sock);
+            if (cmds[i][strlen(cmds[i]) - 1] != '\n')
+                fputc('\n', sock);
+            free(cmds[i]);
+        }
+        free(cmds);
+        fflush(sock);
+        ret = read_reply(reply);
+    } else {
+        int n;
+
+        while (getline(&line, &len, in) != -1) {
+            if (is_blank(line))
+                continue;
+            fputs(line, sock);
+            if (line[strlen(line) - 1] != '\n')
+                fputc('\n', sock);
+            fflush(sock);
+            n = read_reply(reply);
+            if (n < 0) {
+                ret = n;
+                break;
+            }
+            ret += n;
+        }
     }
 
-    ret = do_cmd(argc-1, argv+1);
-    rtnl_close(&rth);
-
- *****************************************************/
-    return ret;
+    if (ret < 0)
+        fprintf(stderr, "Connection to tc-server lost\n");
+    free(line);
+    fclose(sock);
+    fclose(reply);
+    return ret != 0;
 }
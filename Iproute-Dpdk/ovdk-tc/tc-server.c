@@ -6,87 +6,253 @@
  *  Date:           2013.8.5
  **********************************************************************/
 
-#include<stdio.h>
-#include<unistd.h>
-#include<strings.h>
-#include<sys/types.h>
-#include<sys/socket.h>
-#include<linux/in.h>
-
-#define BACKLOG 1
-#define LEN     100
-#define A       20
-#define B       10
+/*
+ * Usage: tc-server port [ovdk-tc program]
+ *
+ * Listens on 127.0.0.1:port.  Each client gets its own connection handler,
+ * so several clients can be served at once, and may send any number of
+ * requests over its connection.  A request is either
+ *
+ *     batch N [force] [stats]
+ *
+ * followed by N command lines, or a single command line.  A command line
+ * is what would follow "ovdk-tc" on the command line, e.g.
+ * "qdisc add dev ovdk17 root handle 1: htb"; a leading "ovdk-tc" or "tc"
+ * word is ignored.  All commands of a request are applied by a single
+ * "ovdk-tc -frame -batch -" process.  Without "force", it stops at the
+ * first failed command.  With "stats", ovdk-tc is run with -s, so that "show"
+ * commands print statistics.
+ *
+ * The reply is the output of each command, each followed by the line
+ *
+ *     @@ LINE STATUS
+ *
+ * where LINE is the number of the command within the request, from 1,
+ * and STATUS is 0 if it succeeded and 1 if it failed.  The reply ends with
+ *
+ *     @@ done STATUS
+ *
+ * where STATUS is the exit status of ovdk-tc.  Commands without a status
+ * line were not run.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+#include <unistd.h>
+#include <errno.h>
+#include <signal.h>
+#include <sys/types.h>
+#include <sys/socket.h>
+#include <sys/wait.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+
+#define BACKLOG 16
+
+static const char *tc_prog = "ovdk-tc";
 
 int make_server_socket(short portnum);
 
+static int is_word(const char *p, const char *word)
+{
+    size_t n = strlen(word);
+
+    return strncmp(p, word, n) == 0 && (p[n] == ' ' || p[n] == '\t' ||
+                                        p[n] == '\0');
+}
+
+/* Strips the line end and any leading "ovdk-tc" or "tc" from 'line' */
+static char *strip_command(char *line)
+{
+    size_t n = strlen(line);
+    char *p;
+
+    while (n > 0 && (line[n - 1] == '\n' || line[n - 1] == '\r'))
+        line[--n] = '\0';
+
+    p = line + strspn(line, " \t");
+    if (is_word(p, "ovdk-tc") || is_word(p, "tc"))
+        p += strcspn(p, " \t");
+    return p + strspn(p, " \t");
+}
+
+/* Runs 'cmds' through one ovdk-tc process, with its output going to 'fd',
+ * and returns its exit status */
+static int run_batch(int fd, char **cmds, int n, int force, int stats)
+{
+    int pfd[2];
+    int i, status;
+    pid_t pid;
+    FILE *out;
+    const char *argv[7];
+
+    if (pipe(pfd) == -1)
+        return -1;
+
+    pid = fork();
+    if (pid == -1) {
+        close(pfd[0]);
+        close(pfd[1]);
+        return -1;
+    }
+    if (pid == 0) {
+        dup2(pfd[0], 0);
+        dup2(fd, 1);
+        dup2(fd, 2);
+        close(pfd[0]);
+        close(pfd[1]);
+        close(fd);
+        i = 0;
+        argv[i++] = tc_prog;
+        if (force)
+            argv[i++] = "-force";
+        if (stats)
+            argv[i++] = "-s";
+        argv[i++] = "-frame";
+        argv[i++] = "-batch";
+        argv[i++] = "-";
+        argv[i] = NULL;
+        execvp(tc_prog, (char **)argv);
+        fprintf(stderr, "Cannot run %s: %s\n", tc_prog, strerror(errno));
+        _exit(127);
+    }
+
+    close(pfd[0]);
+    out = fdopen(pfd[1], "w");
+    for (i = 0; i < n; i++)
+        fprintf(out, "%s\n", cmds[i]);
+    fclose(out);
+
+    while (waitpid(pid, &status, 0) == -1)
+        if (errno != EINTR)
+            return -1;
+    if (WIFEXITED(status))
+        return WEXITSTATUS(status);
+    return 128 + WTERMSIG(status);
+}
+
+static void serve_client(int fd)
+{
+    FILE *in = fdopen(fd, "r");
+    char *line = NULL;
+    size_t len = 0;
+
+    while (getline(&line, &len, in) != -1) {
+        char **cmds;
+        char opt[2][16] = { "", "" };
+        char reply[32];
+        int i, n, ret;
+        int force = 0, stats = 0;
+
+        if (sscanf(line, "batch %d %15s %15s", &n, opt[0], opt[1]) >= 1) {
+            if (n < 0)
+                break;
+            for (i = 0; i < 2; i++) {
+                force |= strcmp(opt[i], "force") == 0;
+                stats |= strcmp(opt[i], "stats") == 0;
+            }
+            cmds = calloc(n + 1, sizeof *cmds);
+            for (i = 0; i < n; i++) {
+                if (getline(&line, &len, in) == -1)
+                    break;
+                cmds[i] = strdup(strip_command(line));
+            }
+            if (i < n) {
+                printf("%d: connection closed in the middle of a batch\n",
+                       (int)getpid());
+                for (i--; i >= 0; i--)
+                    free(cmds[i]);
+                free(cmds);
+                break;
+            }
+        } else {
+            if (strip_command(line)[0] == '\0')
+                continue;
+            n = 1;
+            cmds = calloc(2, sizeof *cmds);
+            cmds[0] = strdup(strip_command(line));
+        }
+
+        printf("%d: %d command(s)\n", (int)getpid(), n);
+        fflush(stdout);
+        ret = run_batch(fd, cmds, n, force, stats);
+        for (i = 0; i < n; i++)
+            free(cmds[i]);
+        free(cmds);
+
+        snprintf(reply, sizeof reply, "@@ done %d\n", ret);
+        if (write(fd, reply, strlen(reply)) == -1)
+            break;
+    }
+
+    free(line);
+    fclose(in);
+}
+
 int main(int argc, char *argv[])
 {
     int sockfd, fd;
-    int n;
-    char *xargv[A];
+    pid_t pid;
+
+    if (argc < 2) {
+        fprintf(stderr, "Usage: %s port [ovdk-tc program]\n", argv[0]);
+        return 1;
+    }
+    if (argc > 2)
+        tc_prog = argv[2];
 
     sockfd = make_server_socket(atoi(argv[1]));
     if(sockfd == -1)
         return -1;
 
-    printf("waiting for connecting\n");
-    fd = accept(sockfd, NULL, NULL);
-    if(fd == -1)  return -1;
-    printf("connected\n");
+    /* Connection handlers are reaped automatically, and a client going away
+     * must not kill its handler */
+    signal(SIGCHLD, SIG_IGN);
+    signal(SIGPIPE, SIG_IGN);
 
+    printf("waiting for connecting\n");
+    fflush(stdout);
     while(1)
     {
-        char cargv[A][B];
-        char buf[LEN] = {'\0'};
-        int i, j, k, m;
-        pid_t  pid;
-
-        n = read(fd, buf, LEN);
-        write(1, buf, n);
-        printf("\n");
-    
-        for(i = 0, j = 0, k = 0, m = -1; buf[i] != '\0'; i++)
-        {
-            if(buf[i] != ' ')
-            {
-                if(i != m + 1)
-                {
-                    cargv[k][j] = '\0';
-                    k++;
-                    j = 0;
-                }
-                cargv[k][j] = buf[i];
-                j++;
-                m = i;
-            }
+        fd = accept(sockfd, NULL, NULL);
+        if(fd == -1) {
+            if (errno == EINTR)
+                continue;
+            return -1;
         }
-        cargv[k][j] = '\0';
-
-        for(i = 0; i <= k; i++)
-            xargv[i] = cargv[i];
-        xargv[i] = NULL;
 
-        if((pid = fork()) < -1)
+        if((pid = fork()) == -1)
             printf("fork failed\n");
-        else if(pid == 0)
-            execvp(xargv[0], xargv);
-        else
-            wait(NULL);
+        else if(pid == 0) {
+            close(sockfd);
+            signal(SIGCHLD, SIG_DFL);
+            printf("%d: connected\n", (int)getpid());
+            fflush(stdout);
+            serve_client(fd);
+            printf("%d: disconnected\n", (int)getpid());
+            fflush(stdout);
+            _exit(0);
+        }
+        close(fd);
     }
 
-        close(fd);
-        close(sockfd);
+    close(sockfd);
 }
 
 int make_server_socket(short portnum)
 {
     struct sockaddr_in addr;
     int sockfd;
-    
+    int on = 1;
+
     sockfd = socket(AF_INET, SOCK_STREAM, 0);
+    if(sockfd == -1)
+        return -1;
+    setsockopt(sockfd, SOL_SOCKET, SO_REUSEADDR, &on, sizeof(on));
     bzero((void *)&addr, sizeof(addr));
-    
+
     addr.sin_port = htons(portnum);
     addr.sin_family = AF_INET;
     addr.sin_addr.s_addr = inet_addr("127.0.0.1");
@@ -95,5 +261,5 @@ int make_server_socket(short portnum)
         return -1;
     if(-1 == listen(sockfd, BACKLOG))
         return -1;
-    return sockfd;    
+    return sockfd;
 }
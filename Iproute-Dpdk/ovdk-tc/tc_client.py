@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# Client library for tc-server
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+#
+# A TcClient keeps one connection to tc-server open, and sends it ovdk-tc
+# commands either one at a time or in batches.  Each batch is applied by a
+# single ovdk-tc process, and the result of each of its commands is
+# returned separately.  See tc-server.c for the protocol.
+#
+# Usage: tc_client.py [-f] port script...
+#
+# applies the ovdk-tc commands found in each shell script, e.g.
+# Test/test.htb/ovdk-tc.sh, as one batch.
+
+import sys
+import socket
+import shlex
+
+OK = 'ok'
+FAILED = 'failed'
+NOT_RUN = 'not run'
+
+class TcError(Exception):
+    pass
+
+class TcResult(object):
+    '''The result of one command: its status (OK, FAILED or NOT_RUN) and
+    the output of ovdk-tc while running it'''
+
+    def __init__(self, command, status=NOT_RUN, output=''):
+        self.command = command
+        self.status = status
+        self.output = output
+
+    def __repr__(self):
+        return 'TcResult(%r, %r, %r)' % (self.command, self.status,
+                                         self.output)
+
+def normalize(command):
+    '''Return command as one line of arguments to ovdk-tc
+
+    command may be a string or a list of arguments, and may start with
+    "sudo" and "ovdk-tc", as in a shell script.'''
+    if isinstance(command, basestring):
+        args = command.split()
+    else:
+        args = list(command)
+    for word in ('sudo', 'ovdk-tc'):
+        if args and args[0].endswith(word):
+            args.pop(0)
+    line = ' '.join(args)
+    if '\n' in line or '\r' in line:
+        raise ValueError('command contains a line break: %r' % line)
+    return line
+
+def script_commands(f):
+    '''Yield the ovdk-tc commands run by the shell script f'''
+    for line in f:
+        args = shlex.split(line, comments=True)
+        if 'ovdk-tc' in [arg.split('/')[-1] for arg in args[:2]]:
+            yield normalize(args)
+
+class TcClient(object):
+    def __init__(self, port, host='127.0.0.1', timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.reply = self.sock.makefile('rb')
+
+    def close(self):
+        self.reply.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, commands, force, stats):
+        '''Send one request, and return a TcResult for each command and the
+        number of commands that ovdk-tc reported a status for'''
+        results = [TcResult(c) for c in commands]
+        data = ['batch %d%s%s\n' % (len(commands), force and ' force' or '',
+                                    stats and ' stats' or '')]
+        data += [c + '\n' for c in commands]
+        self.sock.sendall(''.join(data))
+
+        output = []
+        reported = 0
+        failed = False
+        while True:
+            line = self.reply.readline()
+            if not line:
+                raise TcError('connection to tc-server lost')
+            if not line.startswith('@@ '):
+                output.append(line)
+                continue
+            words = line.split()
+            if words[1] == 'done':
+                break
+            result = results[int(words[1]) - 1]
+            result.status = words[2] == '0' and OK or FAILED
+            result.output = ''.join(output)
+            output = []
+            reported += 1
+            failed = failed or result.status == FAILED
+
+        # ovdk-tc exits on some errors without printing the status of the
+        # command that caused them.  Without force, a nonzero exit status
+        # after a reported failure only means that ovdk-tc stopped there.
+        if (force or not failed) and int(words[2]) != 0:
+            for result in results:
+                if result.status == NOT_RUN:
+                    result.status = FAILED
+                    result.output = ''.join(output)
+                    break
+        return results, reported
+
+    def batch(self, commands, force=False, stats=False):
+        '''Apply commands in one ovdk-tc process, and return a TcResult for
+        each
+
+        Unless force is true, commands after the first failed one are not
+        run.  If stats is true, "show" commands print statistics, as with
+        ovdk-tc -s.'''
+        commands = [normalize(c) for c in commands]
+        results = []
+        while commands:
+            done, reported = self._request(commands, force, stats)
+            n = len([r for r in done if r.status != NOT_RUN])
+            if not force or not reported or n == len(done):
+                results += done
+                break
+            # ovdk-tc exited part way through: resubmit what it did not run
+            results += done[:n]
+            commands = commands[n:]
+        return results
+
+    def run(self, command):
+        '''Apply one command, and return its TcResult'''
+        return self.batch([command])[0]
+
+    def check_batch(self, commands, force=False, stats=False):
+        '''Like batch(), but raise TcError if a command failed'''
+        results = self.batch(commands, force, stats)
+        for result in results:
+            if result.status != OK:
+                raise TcError('%s: %s%s' % (result.command, result.status,
+                              result.output and ': ' + result.output.strip()))
+        return results
+
+def main(args):
+    force = False
+    if args and args[0] == '-f':
+        force = True
+        args = args[1:]
+    if len(args) < 2:
+        sys.stderr.write('Usage: %s [-f] port script...\n' % sys.argv[0])
+        return 1
+
+    failed = 0
+    client = TcClient(int(args[0]))
+    for script in args[1:]:
+        commands = list(script_commands(open(script)))
+        for result in client.batch(commands, force):
+            sys.stdout.write(result.output)
+            if result.status != OK:
+                print '%s: %s: %s' % (script, result.status, result.command)
+                failed += 1
+    client.close()
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
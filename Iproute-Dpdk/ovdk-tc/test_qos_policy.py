@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#
+# Tests for qos_policy.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+
+import os
+import sys
+import copy
+import shlex
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import qos_policy
+import tc_client
+from qos_policy import Policy, PolicyError, diff_tc, diff_flows
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', '..', 'Test')
+
+def htb_policy(**classes):
+    '''Return a policy with an HTB qdisc on ovdk17 and a flow to each of
+    the leaf classes 1:11 and 1:12, which classes may replace'''
+    leaves = [{'classid': '1:11', 'rate': '20mbit', 'ceil': '100mbit'},
+              {'classid': '1:12', 'rate': '80mbit', 'ceil': '100mbit'}]
+    spec = {'bridge': 'br0',
+            'ports': {'ovdk17': {'port': 17, 'qdisc': {
+                'kind': 'htb', 'handle': '1:',
+                'classes': [{'classid': '1:1', 'rate': '100mbit',
+                             'classes': leaves}]}}},
+            'flows': [{'match': 'ip,nw_dst=10.0.0.1', 'dev': 'ovdk17',
+                       'class': '1:11'},
+                      {'match': 'ip,nw_dst=10.0.0.2', 'dev': 'ovdk17',
+                       'class': '1:12'}]}
+    for i, leaf in enumerate(leaves):
+        leaf.update(classes.get('c1%d' % (i + 1), {}))
+    return spec
+
+def canonical(command):
+    '''Return an ovdk-tc command in a form that does not depend on the order
+    of its "parent", "handle" and other keyword arguments'''
+    words = command.split()
+    args = set()
+    rest = words[2:]
+    while rest:
+        if rest[0] == 'root' or rest[0] in qos_policy.QDISC_PARAMS:
+            args.add(rest.pop(0))
+        else:
+            args.add((rest.pop(0), rest.pop(0)))
+    return words[0], words[1], args
+
+def script_flows(filename):
+    '''Return the flows added by the ovs-ofctl commands of a shell script'''
+    flows = []
+    for line in open(filename):
+        args = shlex.split(line, comments=True)
+        if 'add-flow' in args:
+            flows.append(args[args.index('add-flow') + 2])
+    return flows
+
+class ValidationTest(unittest.TestCase):
+    def assertInvalid(self, spec, message):
+        self.assertRaisesRegexp(PolicyError, message, Policy, spec)
+
+    def test_valid(self):
+        policy = Policy(htb_policy())
+        self.assertEqual(sorted(policy.flows['br0'].values()),
+                         ['enqueue:17:0x11', 'enqueue:17:0x12'])
+
+    def test_empty(self):
+        self.assertEqual(Policy(None).ports, {})
+        self.assertEqual(Policy({}).flows, {})
+
+    def test_qdisc(self):
+        spec = htb_policy()
+        spec['ports']['ovdk17']['qdisc']['kind'] = 'sfq'
+        self.assertInvalid(spec, 'unsupported qdisc "sfq"')
+        spec = htb_policy()
+        spec['ports']['ovdk17']['qdisc']['handle'] = '1:1'
+        self.assertInvalid(spec, 'qdisc handle 1:1 has a minor number')
+        spec = htb_policy()
+        spec['ports']['ovdk17']['qdisc']['handle'] = 'x'
+        self.assertInvalid(spec, 'invalid qdisc handle "x"')
+
+    def test_class(self):
+        self.assertInvalid(htb_policy(c11={'classid': '2:11'}),
+                           'ovdk17 class 2:11 does not belong to qdisc 1:')
+        self.assertInvalid(htb_policy(c11={'classid': '1:12'}),
+                           'ovdk17 class 1:12 is defined twice')
+        self.assertInvalid(htb_policy(c11={'size': 1}),
+                           'ovdk17 class 1:11: unknown parameter "size"')
+        self.assertInvalid(htb_policy(c11={
+                               'classes': [{'classid': '1:13',
+                                            'rate': '1mbit'}],
+                               'qdisc': {'kind': 'drr', 'handle': '2:'}}),
+                           'class 1:11 has both classes and a qdisc')
+
+    def test_rates(self):
+        spec = htb_policy()
+        del spec['ports']['ovdk17']['qdisc']['classes'][0]['rate']
+        self.assertInvalid(spec, 'ovdk17 class 1:1 has no rate')
+        self.assertInvalid(htb_policy(c11={'rate': 'fast'}),
+                           'invalid rate "fast"')
+        self.assertInvalid(htb_policy(c11={'rate': '20furlongs'}),
+                           'invalid rate "20furlongs"')
+        self.assertInvalid(htb_policy(c11={'ceil': '10mbit'}),
+                           'class 1:11: ceil is lower than rate')
+        self.assertInvalid(htb_policy(c11={'rate': '30mbit'}),
+                           'class 1:1: the rates of its children add up to '
+                           'more than its ceil')
+        self.assertEqual(qos_policy.parse_rate('1.5kbps'), 12000)
+        self.assertEqual(qos_policy.parse_rate('100'), 800)
+
+    def test_flows(self):
+        spec = htb_policy()
+        spec['flows'][0]['dev'] = 'ovdk18'
+        self.assertInvalid(spec, 'unknown port "ovdk18"')
+        spec = htb_policy()
+        spec['flows'][0]['class'] = '1:1'
+        self.assertInvalid(spec, 'ovdk17 class 1:1 is not a leaf class')
+        spec = htb_policy()
+        spec['flows'][0]['class'] = '1:13'
+        self.assertInvalid(spec, 'ovdk17 has no class 1:13')
+        spec = htb_policy()
+        del spec['flows'][0]['class']
+        self.assertInvalid(spec, 'has neither class nor actions')
+        spec = htb_policy()
+        spec['flows'][1]['match'] = spec['flows'][0]['match']
+        self.assertInvalid(spec, 'flow "ip,nw_dst=10.0.0.1" is defined twice')
+
+    def test_unreachable(self):
+        # Without "default 12", HTB has no class for the queues of the DRR
+        # classes below 1:12
+        spec = qos_policy.load_policy(os.path.join(TEST_DIR, 'test.htb+drr',
+                                                   'policy.json'))
+        del spec['ports']['ovdk17']['qdisc']['default']
+        self.assertInvalid(spec, 'ovdk17 class 2:21 cannot be reached: '
+                                 'qdisc 1: puts packets for queue 0x21 into '
+                                 'no class')
+
+class CompileTest(unittest.TestCase):
+    def test_policies_match_scripts(self):
+        for test in ('test.htb', 'test.htb+drr'):
+            path = os.path.join(TEST_DIR, test)
+            policy = Policy(qos_policy.load_policy(os.path.join(path,
+                                                                'policy.json')))
+            script = tc_client.script_commands(open(os.path.join(path,
+                                                                 'ovdk-tc.sh')))
+            self.assertEqual([canonical(c) for c in diff_tc(Policy(None),
+                                                            policy)],
+                             [canonical(c) for c in script])
+
+            add, delete = diff_flows(Policy(None), policy)['br0']
+            self.assertEqual(add, sorted(script_flows(os.path.join(
+                path, 'ovdk-ofctl.sh'))))
+            self.assertEqual(delete, [])
+
+class DiffTest(unittest.TestCase):
+    def diff(self, old, new):
+        return diff_tc(Policy(old), Policy(new)), \
+               diff_flows(Policy(old), Policy(new))
+
+    def test_unchanged(self):
+        self.assertEqual(self.diff(htb_policy(), htb_policy()), ([], {}))
+
+    def test_add(self):
+        tc, flows = self.diff(None, htb_policy())
+        self.assertEqual(tc, [
+            'qdisc add dev ovdk17 root handle 1: htb',
+            'class add dev ovdk17 parent 1: classid 1:1 htb rate 100mbit',
+            'class add dev ovdk17 parent 1:1 classid 1:11 htb rate 20mbit '
+            'ceil 100mbit',
+            'class add dev ovdk17 parent 1:1 classid 1:12 htb rate 80mbit '
+            'ceil 100mbit'])
+        self.assertEqual(flows, {'br0': (
+            ['ip,nw_dst=10.0.0.1,actions=enqueue:17:0x11',
+             'ip,nw_dst=10.0.0.2,actions=enqueue:17:0x12'], [])})
+
+    def test_change(self):
+        tc, flows = self.diff(htb_policy(),
+                              htb_policy(c11={'rate': '10mbit',
+                                              'prio': 1}))
+        self.assertEqual(tc, ['class change dev ovdk17 parent 1:1 '
+                              'classid 1:11 htb rate 10mbit ceil 100mbit '
+                              'prio 1'])
+        self.assertEqual(flows, {})
+
+    def test_change_qdisc(self):
+        # "qdisc change" cannot change an HTB qdisc's default class, so the
+        # whole tree is deleted and created again
+        new = htb_policy()
+        new['ports']['ovdk17']['qdisc']['default'] = '12'
+        tc, flows = self.diff(htb_policy(), new)
+        self.assertEqual(tc, [
+            'qdisc del dev ovdk17 root',
+            'qdisc add dev ovdk17 root handle 1: htb default 12',
+            'class add dev ovdk17 parent 1: classid 1:1 htb rate 100mbit',
+            'class add dev ovdk17 parent 1:1 classid 1:11 htb rate 20mbit '
+            'ceil 100mbit',
+            'class add dev ovdk17 parent 1:1 classid 1:12 htb rate 80mbit '
+            'ceil 100mbit'])
+
+    def test_delete(self):
+        new = htb_policy()
+        leaves = new['ports']['ovdk17']['qdisc']['classes'][0]['classes']
+        del leaves[1]
+        new['flows'][1] = {'match': 'ip,nw_dst=10.0.0.2',
+                           'actions': 'output:16'}
+        tc, flows = self.diff(htb_policy(), new)
+        self.assertEqual(tc, ['class del dev ovdk17 classid 1:12'])
+        self.assertEqual(flows, {'br0': (
+            ['ip,nw_dst=10.0.0.2,actions=output:16'], [])})
+
+        tc, flows = self.diff(htb_policy(), {'bridge': 'br0'})
+        self.assertEqual(tc, ['qdisc del dev ovdk17 root'])
+        self.assertEqual(flows, {'br0': (
+            [], ['ip,nw_dst=10.0.0.1', 'ip,nw_dst=10.0.0.2'])})
+
+    def test_move(self):
+        # A class that moves to another parent is deleted and added again
+        old = htb_policy()
+        new = copy.deepcopy(old)
+        top = new['ports']['ovdk17']['qdisc']['classes'][0]
+        top['classes'][0]['classes'] = [top['classes'].pop(1)]
+        new['flows'][0] = {'match': 'ip,nw_dst=10.0.0.1',
+                           'actions': 'output:16'}
+        tc, flows = self.diff(old, new)
+        self.assertEqual(tc, [
+            'class del dev ovdk17 classid 1:12',
+            'class add dev ovdk17 parent 1:11 classid 1:12 htb rate 80mbit '
+            'ceil 100mbit'])
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_output_files(self):
+        policy = os.path.join(TEST_DIR, 'test.htb', 'policy.json')
+        self.assertEqual(qos_policy.main(['--output', self.path('qos'),
+                                          policy]), 0)
+        self.assertEqual(open(self.path('qos.tc')).read().count('\n'), 5)
+        self.assertEqual(open(self.path('qos.br0.add-flows')).read().count(
+            '\n'), 6)
+        self.assertEqual(open(self.path('qos.br0.del-flows')).read(), '')
+        self.assertEqual(sys.stdout.getvalue(), '5 ovdk-tc commands, '
+                         '6 flows to add, 0 flows to delete\n')
+
+        # Nothing changes against the same policy as the state
+        self.assertEqual(qos_policy.main(['--output', self.path('qos'),
+                                          '--state', policy, policy]), 0)
+        self.assertEqual(open(self.path('qos.tc')).read(), '')
+
+    def test_invalid(self):
+        f = open(self.path('policy.json'), 'w')
+        f.write('{"ports": {"ovdk17": {"qdisc": {"kind": "sfq"}}}}')
+        f.close()
+        self.assertEqual(qos_policy.main(['--check',
+                                          self.path('policy.json')]), 1)
+        self.assertEqual(sys.stderr.getvalue(), '%s: ovdk17: unsupported '
+                         'qdisc "sfq"\n' % self.path('policy.json'))
+        self.assertFalse(os.path.exists(self.path('qos.tc')))
+
+if __name__ == '__main__':
+    unittest.main()
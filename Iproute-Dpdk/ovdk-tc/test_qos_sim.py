@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# Tests for qos_sim.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+#
+# The expected numbers follow from the code of sch_htb.c and sch_drr.c in
+# OVS/openvswitch/datapath/dpdk/qos/sched.  The packet engine is checked
+# against them exactly or nearly so, and the fluid engine against the
+# packet engine.
+
+import os
+import unittest
+import numpy as np
+
+import qos_sim
+from qos_sim import Traffic, parse_commands, simulate, simulate_packets
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', '..', 'Test')
+
+def tree(*commands):
+    return parse_commands(['qdisc add dev e ' + commands[0]] +
+                          ['class add dev e ' + c for c in commands[1:]])
+
+def mbit(result, warmup=0.2):
+    return [s['throughput_bps'] / 1e6 for s in result.summary(warmup)]
+
+BORROW = tree('root handle 1: htb',
+              'parent 1: classid 1:1 htb rate 100mbit',
+              'parent 1:1 classid 1:10 htb rate 10mbit ceil 100mbit '
+              'quantum 10000',
+              'parent 1:1 classid 1:20 htb rate 10mbit ceil 100mbit '
+              'quantum 30000')
+
+PRIO = tree('root handle 1: htb',
+            'parent 1: classid 1:1 htb rate 100mbit',
+            'parent 1:1 classid 1:10 htb rate 10mbit ceil 100mbit prio 0',
+            'parent 1:1 classid 1:20 htb rate 10mbit ceil 100mbit prio 1')
+
+class TreeTest(unittest.TestCase):
+    def test_script_and_policy_agree(self):
+        for test in ('test.htb', 'test.htb+drr'):
+            script = qos_sim.load_tree(os.path.join(TEST_DIR, test,
+                                                    'ovdk-tc.sh'))
+            policy = qos_sim.load_tree(os.path.join(TEST_DIR, test,
+                                                    'policy.json'))
+            describe = lambda root: [(cl.name(), cl.level, cl.rate, cl.ceil,
+                                      cl.buffer, cl.quantum)
+                                     for cl in root.all_classes()]
+            self.assertEqual(describe(script), describe(policy))
+
+    def test_htb_defaults(self):
+        root = tree('root handle 1: htb r2q 5',
+                    'parent 1: classid 1:1 htb rate 8mbit',
+                    'parent 1:1 classid 1:10 htb rate 80kbit ceil 8mbit')
+        top, leaf = root.classes[1], root.classes[0x10]
+        self.assertEqual((top.level, leaf.level), (7, 0))
+        self.assertEqual(top.quantum, 200000)
+        self.assertEqual(leaf.quantum, 2000)
+        self.assertEqual(top.ceil, 1000000)
+        # 1600 bytes of burst at the rate
+        self.assertEqual(top.buffer, 1600000)
+        self.assertEqual(leaf.buffer, 160000000)
+
+    def test_classify(self):
+        root = qos_sim.load_tree(os.path.join(TEST_DIR, 'test.htb+drr',
+                                              'policy.json'))
+        self.assertEqual(qos_sim.classify(root, 0x11).name(), '1:11')
+        self.assertEqual(qos_sim.classify(root, 0x21).name(), '2:21')
+        # The default class holds a DRR qdisc, which drops unknown queues
+        self.assertEqual(qos_sim.classify(root, 0x99), None)
+        self.assertRaises(qos_sim.SimulationError, qos_sim.classify, root, 1)
+        root = tree('root handle 1: htb',
+                    'parent 1: classid 1:1 htb rate 1mbit')
+        self.assertTrue(qos_sim.classify(root, 2) is root)
+
+class PacketTest(unittest.TestCase):
+    def test_drr_order(self):
+        drr = qos_sim._runtime(tree('root handle 1: drr',
+                                    'parent 1: classid 1:1 drr quantum 3000',
+                                    'parent 1: classid 1:2 drr quantum 5000'))
+        for i in range(20):
+            drr.enqueue(qos_sim._Packet(i, 1000, i < 10 and 1 or 2))
+        self.assertEqual([drr.dequeue(0).queue for i in range(16)],
+                         [1] * 3 + [2] * 5 + [1] * 3 + [2] * 5)
+
+    def test_htb_burst_then_rate(self):
+        root = tree('root handle 1: htb',
+                    'parent 1: classid 1:1 htb rate 8mbit')
+        result = simulate_packets(root, [Traffic('1:1', '10gbit', 1000,
+                                                 process='cbr')],
+                                  '1gbit', 0.02)
+        gaps = np.diff(result.departure[:12])
+        # 1600 bytes of burst let two packets through at link speed, and
+        # the rest are sent every 1000 bytes / 1 MB/s
+        self.assertAlmostEqual(gaps[0], 8e-6, 9)
+        self.assertTrue(np.allclose(gaps[2:], 1e-3, atol=1e-8))
+
+    def test_htb_shares(self):
+        root = qos_sim.load_tree(os.path.join(TEST_DIR, 'test.htb',
+                                              'policy.json'))
+        traffic = [Traffic(c, '100mbit') for c in ('1:11', '1:12', '1:13')]
+        got = mbit(simulate_packets(root, traffic, '1gbit', 0.5))
+        self.assertTrue(np.allclose(got, [20, 20, 60], rtol=0.01), got)
+
+    def test_htb_borrow_by_quantum(self):
+        traffic = [Traffic('1:10', '100mbit'), Traffic('1:20', '100mbit')]
+        got = mbit(simulate_packets(BORROW, traffic, '1gbit', 0.5))
+        self.assertTrue(np.allclose(got, [30, 70], rtol=0.02), got)
+
+    def test_htb_prio(self):
+        traffic = [Traffic('1:10', '100mbit'), Traffic('1:20', '100mbit')]
+        got = mbit(simulate_packets(PRIO, traffic, '1gbit', 0.5))
+        self.assertTrue(np.allclose(got, [90, 10], rtol=0.01), got)
+
+    def test_htb_ceil_needs_cburst(self):
+        def run(cburst):
+            root = tree('root handle 1: htb',
+                        'parent 1: classid 1:1 htb rate 100mbit',
+                        'parent 1:1 classid 1:10 htb rate 10mbit ceil 100mbit',
+                        'parent 1:1 classid 1:20 htb rate 10mbit ceil 30mbit' +
+                        cburst)
+            traffic = [Traffic('1:10', '100mbit'), Traffic('1:20', '100mbit')]
+            return mbit(simulate_packets(root, traffic, '1gbit', 0.5))
+        # 1:10 keeps its turn for a whole quantum of 125000 bytes, while 1:20
+        # can only send its cburst in its own turns
+        self.assertTrue(run('')[1] < 15)
+        self.assertTrue(np.allclose(run(' cburst 200k'), [70, 30], rtol=0.01))
+
+    def test_htb_direct(self):
+        root = tree('root handle 1: htb',
+                    'parent 1: classid 1:1 htb rate 10mbit')
+        traffic = [Traffic('1:1', '100mbit', process='cbr'),
+                   Traffic('1:2', '100mbit', process='cbr')]
+        got = mbit(simulate_packets(root, traffic, '1gbit', 0.5))
+        self.assertTrue(np.allclose(got, [10, 100], rtol=0.01), got)
+
+class FluidTest(unittest.TestCase):
+    def compare(self, root, traffic, link, duration=0.5):
+        fluid = simulate(root, traffic, link, duration)
+        exact = simulate_packets(root, traffic, link, duration)
+        for f, e in zip(fluid.summary(0.1), exact.summary(0.1)):
+            self.assertTrue(abs(f['throughput_bps'] - e['throughput_bps']) <
+                            0.02 * e['offered_bps'], (f, e))
+            self.assertTrue(abs(f['dropped'] - e['dropped']) <=
+                            0.02 * f['packets'], (f, e))
+            # The fluid model knows delays to within about a time step
+            if 'delay_mean_ms' in e:
+                self.assertTrue(abs(f['delay_mean_ms'] - e['delay_mean_ms']) <
+                                0.05 * e['delay_mean_ms'] + 0.5, (f, e))
+
+    def test_htb_drr(self):
+        root = qos_sim.load_tree(os.path.join(TEST_DIR, 'test.htb+drr',
+                                              'policy.json'))
+        self.compare(root, [Traffic('1:11', '80mbit'),
+                            Traffic('2:21', '80mbit'),
+                            Traffic('2:22', '80mbit')], '1gbit')
+
+    def test_borrow_and_prio(self):
+        traffic = [Traffic('1:10', '100mbit'), Traffic('1:20', '100mbit')]
+        self.compare(BORROW, traffic, '1gbit')
+        self.compare(PRIO, traffic, '1gbit')
+
+    def test_underload(self):
+        root = qos_sim.load_tree(os.path.join(TEST_DIR, 'test.htb',
+                                              'policy.json'))
+        self.compare(root, [Traffic('1:11', '15mbit'),
+                            Traffic('1:13', '40mbit', (64, 1500))], '100mbit')
+
+    def test_link_bound(self):
+        root = tree('root handle 1: drr',
+                    'parent 1: classid 1:1 drr quantum 1500',
+                    'parent 1: classid 1:2 drr quantum 4500')
+        self.compare(root, [Traffic('1:1', '80mbit'),
+                            Traffic('1:2', '80mbit')], '100mbit')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Tests for qos_stats.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+
+import json
+import unittest
+import StringIO
+
+import qos_stats
+from qos_stats import parse_show, parse_qos_show, rates, Collector
+
+# As printed by print_class(), print_tcstats2_attr() and htb_print_xstats()
+CLASS_SHOW = '''\
+class htb 1:1 root rate 100000Kbit ceil 100000Kbit burst 1600b cburst 1600b
+ Sent 7200000 bytes 4800 pkt (dropped 0, overlimits 0 requeues 0)
+ rate 0bit 0pps backlog 0b 0p requeues 0
+ lended: 4000 borrowed: 0 giants: 0
+ tokens: 1600 ctokens: -320
+
+class htb 1:12 parent 1:1 leaf 2: prio 0 rate 80000Kbit ceil 200000Kbit burst 1600b cburst 1600b
+ Sent 3000 bytes 2 pkt (dropped 5, overlimits 0 requeues 0)
+ rate 0bit 0pps backlog 12Kb 8p requeues 0
+ lended: 2 borrowed: 0 giants: 0
+ tokens: 20 ctokens: 8
+
+class drr 2:21 parent 2: quantum 3000b
+ Sent 0 bytes 0 pkt (dropped 0, overlimits 0 requeues 0)
+ backlog 0b 0p requeues 0
+ deficit 1500b
+'''
+
+# As printed by print_qdisc() for all devices, in the TCA_STATS format
+QDISC_SHOW = '''\
+qdisc htb 1: dev ovdk17 root refcnt 2 r2q 10 default 12 direct_packets_stat 0
+ Sent 9000 bytes 6 pkts (dropped 1, overlimits 3)
+ backlog 1514b 1p
+'''
+
+QOS_SHOW = '''\
+QoS: eth0 linux-htb
+max-rate: 1000000000
+
+Default:
+\tmin-rate: 12000
+\ttx_packets: 10
+\ttx_bytes: 1500
+\ttx_errors: 0
+
+Queue 3:
+\ttx_packets: 2
+\ttx_bytes: 120
+\ttx_errors: 1
+'''
+
+class ParseTest(unittest.TestCase):
+    def test_class_show(self):
+        top, leaf, drr = parse_show(CLASS_SHOW, 'ovdk17')
+        self.assertEqual(top, {
+            'object': 'class', 'kind': 'htb', 'id': '1:1', 'dev': 'ovdk17',
+            'bytes': 7200000, 'packets': 4800, 'drops': 0, 'overlimits': 0,
+            'requeues': 0, 'backlog_bytes': 0, 'backlog_packets': 0,
+            'lends': 4000, 'borrows': 0, 'giants': 0, 'tokens': 1600,
+            'ctokens': -320})
+        self.assertEqual(leaf['parent'], '1:1')
+        self.assertEqual((leaf['drops'], leaf['backlog_bytes'],
+                          leaf['backlog_packets']), (5, 12288, 8))
+        self.assertEqual((drr['kind'], drr['parent'], drr['deficit']),
+                         ('drr', '2:', 1500))
+
+    def test_qdisc_show(self):
+        qdisc, = parse_show(QDISC_SHOW)
+        self.assertEqual(qdisc['dev'], 'ovdk17')
+        self.assertEqual((qdisc['id'], qdisc['packets'], qdisc['drops'],
+                          qdisc['overlimits'], qdisc['backlog_bytes']),
+                         ('1:', 6, 1, 3, 1514))
+        self.assertFalse('requeues' in qdisc)
+
+    def test_qos_show(self):
+        default, queue = parse_qos_show(QOS_SHOW, 'eth0')
+        self.assertEqual(default, {'object': 'queue', 'kind': 'linux-htb',
+                                   'id': '0', 'dev': 'eth0', 'packets': 10,
+                                   'bytes': 1500, 'errors': 0})
+        self.assertEqual((queue['id'], queue['errors']), ('3', 1))
+
+class SeriesTest(unittest.TestCase):
+    def test_rates(self):
+        prev = {'time': 10.0, 'bytes': 1000, 'packets': (1 << 32) - 10,
+                'drops': 50}
+        cur = {'time': 12.0, 'bytes': 3000, 'packets': 10, 'drops': 2}
+        # packets wrapped around; drops were reset
+        self.assertEqual(rates(prev, cur), {'bytes': 1000, 'packets': 10})
+
+    def test_ring(self):
+        collector = Collector(capacity=3)
+        for t in range(10):
+            collector.add(float(t), parse_show(CLASS_SHOW.replace(
+                'Sent 0 bytes', 'Sent %d bytes' % (t * 100)), 'ovdk17'))
+        series = collector.series['ovdk17', 'class', '2:21']
+        self.assertEqual([s['time'] for s in series.samples], [7, 8, 9])
+        self.assertEqual(len(series.rates), 3)
+        self.assertEqual(series.count, 10)
+        self.assertEqual(series.rate()['bytes'], 100)
+        self.assertEqual(series.delta['bytes'], 900)
+
+    def test_prometheus(self):
+        collector = Collector()
+        collector.add(1.0, parse_show(CLASS_SHOW, 'ovdk"17'))
+        collector.add(2.0, parse_show(CLASS_SHOW.replace('7200000', '7300000'),
+                                      'ovdk"17'))
+        text = qos_stats.format_prometheus(collector.latest())
+        self.assertTrue('# TYPE ovdk_qos_bytes_total counter\n' in text)
+        self.assertTrue('ovdk_qos_bytes_total{dev="ovdk\\"17",object="class",'
+                        'kind="htb",id="1:1"} 7300000\n' in text)
+        self.assertTrue('ovdk_qos_rate_bits_per_second{dev="ovdk\\"17",'
+                        'object="class",kind="htb",id="1:1"} 800000\n' in text)
+        self.assertTrue('ovdk_qos_deficit{dev="ovdk\\"17",object="class",'
+                        'kind="drr",id="2:21",parent="2:"} 1500\n' in text)
+
+    def test_replay(self):
+        log = StringIO.StringIO()
+        live = Collector()
+        for t in range(5):
+            samples = parse_show(QDISC_SHOW.replace('9000', str(t * 1000)))
+            live.add(100.0 + t, samples)
+            for sample in samples:
+                log.write(json.dumps(sample) + '\n')
+        log.seek(0)
+        replayed = Collector()
+        qos_stats.replay(log, replayed, start=101, end=103)
+        series = replayed.series['ovdk17', 'qdisc', '1:']
+        self.assertEqual([s['time'] for s in series.samples], [101, 102, 103])
+        self.assertEqual(series.delta['bytes'], 2000)
+        self.assertEqual(live.latest()[0][0]['bytes'], 4000)
+
+if __name__ == '__main__':
+    unittest.main()
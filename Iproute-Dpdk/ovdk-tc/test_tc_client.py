@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# Tests for tc_client.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 2 of the License, or (at your option) any later version.
+
+import unittest
+import StringIO
+
+import tc_client
+from tc_client import TcClient, TcError, OK, FAILED, NOT_RUN
+
+class FakeServer(object):
+    '''Stands in for the connection to tc-server: each request sent gets the
+    next of replies, in the format of tc-server.c'''
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.buf = ''
+
+    def sendall(self, data):
+        self.requests.append(data)
+        self.buf += self.replies.pop(0)
+
+    def makefile(self, mode):
+        return self
+
+    def readline(self):
+        line, nl, self.buf = self.buf.partition('\n')
+        return line + nl
+
+    def close(self):
+        pass
+
+def connect(*replies):
+    server = FakeServer(replies)
+    client = TcClient.__new__(TcClient)
+    client.sock = server
+    client.reply = server.makefile('rb')
+    return client, server
+
+def statuses(results):
+    return [r.status for r in results]
+
+QDISC = 'qdisc add dev ovdk17 root handle 1: htb'
+CLASS = 'class add dev ovdk17 parent 1: classid 1:1 htb rate 1mbit'
+FILTER = 'filter add dev ovdk17 parent 1: u32 match ip dport 80 0xffff'
+COMMANDS = [QDISC, CLASS, FILTER]
+
+class CommandTest(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(tc_client.normalize('sudo ./ovdk-tc ' + QDISC), QDISC)
+        self.assertEqual(tc_client.normalize(['ovdk-tc'] + QDISC.split()),
+                         QDISC)
+        self.assertRaises(ValueError, tc_client.normalize, ['a\nb'])
+
+    def test_script_commands(self):
+        script = StringIO.StringIO('#!/bin/sh\n'
+                                   'set -e\n'
+                                   'sudo ovdk-tc %s  # root\n'
+                                   './ovdk-tc %s\n' % (QDISC, CLASS))
+        self.assertEqual(list(tc_client.script_commands(script)),
+                         [QDISC, CLASS])
+
+class BatchTest(unittest.TestCase):
+    def test_all_ok(self):
+        client, server = connect('@@ 1 0\n@@ 2 0\n@@ 3 0\n@@ done 0\n')
+        results = client.batch(COMMANDS)
+        self.assertEqual(server.requests,
+                         ['batch 3\n' + ''.join(c + '\n' for c in COMMANDS)])
+        self.assertEqual(statuses(results), [OK, OK, OK])
+        self.assertEqual([r.command for r in results], COMMANDS)
+
+    def test_output(self):
+        client, server = connect('@@ 1 0\nclass htb 1:1 root\n@@ 2 0\n'
+                                 '@@ done 0\n')
+        results = client.batch(['qdisc show', 'class show'], stats=True)
+        self.assertTrue(server.requests[0].startswith('batch 2 stats\n'))
+        self.assertEqual([r.output for r in results],
+                         ['', 'class htb 1:1 root\n'])
+
+    def test_stop_at_failure(self):
+        # Without force, ovdk-tc stops after the failed command and exits
+        # with status 1: the command after it was not run
+        client, server = connect('@@ 1 0\nRTNETLINK answers: File exists\n'
+                                 '@@ 2 1\n@@ done 1\n')
+        results = client.batch(COMMANDS)
+        self.assertEqual(statuses(results), [OK, FAILED, NOT_RUN])
+        self.assertEqual(results[1].output, 'RTNETLINK answers: File exists\n')
+        self.assertEqual(results[2].output, '')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_exit_without_status(self):
+        # ovdk-tc exited while running the second command, without printing
+        # its status
+        client, server = connect('@@ 1 0\nUnknown qdisc "htc"\n@@ done 1\n')
+        results = client.batch(COMMANDS)
+        self.assertEqual(statuses(results), [OK, FAILED, NOT_RUN])
+        self.assertEqual(results[1].output, 'Unknown qdisc "htc"\n')
+
+    def test_force_continues(self):
+        client, server = connect('@@ 1 0\nRTNETLINK answers: File exists\n'
+                                 '@@ 2 1\n@@ 3 0\n@@ done 1\n')
+        results = client.batch(COMMANDS, force=True)
+        self.assertTrue(server.requests[0].startswith('batch 3 force\n'))
+        self.assertEqual(statuses(results), [OK, FAILED, OK])
+
+    def test_force_resubmits(self):
+        # ovdk-tc exited on the second command, so the third one is sent
+        # again in a new batch
+        client, server = connect('@@ 1 1\nUnknown qdisc "htc"\n@@ done 1\n',
+                                 '@@ 1 0\n@@ done 0\n')
+        results = client.batch(COMMANDS, force=True)
+        self.assertEqual(statuses(results), [FAILED, FAILED, OK])
+        self.assertEqual(server.requests[1], 'batch 1 force\n%s\n' % FILTER)
+        self.assertEqual([r.command for r in results], COMMANDS)
+
+    def test_force_gives_up(self):
+        # ovdk-tc exited on the first command: as it made no progress, the
+        # batch is not sent again
+        client, server = connect('Segfault\n@@ done 139\n')
+        results = client.batch(COMMANDS, force=True)
+        self.assertEqual(statuses(results), [FAILED, NOT_RUN, NOT_RUN])
+        self.assertEqual(results[0].output, 'Segfault\n')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_connection_lost(self):
+        client, server = connect('@@ 1 0\n')
+        self.assertRaises(TcError, client.batch, COMMANDS)
+
+    def test_check_batch(self):
+        client, server = connect('Error: bad rate\n@@ 1 1\n@@ done 1\n')
+        try:
+            client.check_batch([CLASS])
+        except TcError, e:
+            self.assertEqual(str(e), '%s: failed: Error: bad rate' % CLASS)
+        else:
+            self.fail('check_batch() did not raise TcError')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -79,6 +79,7 @@ class OVECommonWindow:
     def xon_hostComboBox_currentIndexChanged(self, index):
         if (index >= 0):
             itemData = self.ui.hostComboBox.itemData(index)
+            self.unsubscribe()
             self.hostUuid = str(itemData.toString())
             self.deleteCurrentTable()
             self.updateTable()
@@ -118,6 +119,17 @@ class OVECommonWindow:
  
     def handleFetchFailEvent(self, ref, message):
         OVELog('Unhandled FetchFailEvent')
+
+    def handleStreamUpdate(self, values, changed):
+        OVELog('Unhandled StreamEvent')
+
+    def handleStreamFailure(self, message):
+        OVELog('Unhandled StreamEvent failure')
+
+    def unsubscribe(self):
+        # Stop the updates pushed to this window by the current host
+        if self.hostUuid in OVEFetch.instances:
+            OVEFetch.Inst(self.hostUuid).unsubscribe(self)
  
     def setFetchSkip(self):
         # Call before sending a request via OVEFetch
@@ -177,6 +189,20 @@ class OVECommonWindow:
             else:
                 if OVEConfig.Inst().logTraffic:
                     OVELog('FetchFailEvent ref mismatch '+str(ref)+' != '+str(self.currentRef))
+
+        elif event.type() == OVEStreamEvent.TYPE:
+            # Updates from a previously selected host are no longer pending there, so are ignored here
+            update = OVEFetch.Inst(self.hostUuid).takeUpdate(self)
+            if update is not None:
+                values, changed, message = update
+                try:
+                    if message is not None:
+                        OVELog(message)
+                        self.handleStreamFailure(message)
+                    else:
+                        self.handleStreamUpdate(values, changed)
+                except Exception, e:
+                    OVELog("Error during data handling: "+str(e))
  
     def deleteCurrentTable(self):
         pass
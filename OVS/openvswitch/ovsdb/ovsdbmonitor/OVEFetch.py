@@ -53,6 +53,7 @@ class OVEFetchConnection(connection.SSHConnection, QtCore.QObject):
         self.fetch = fetch
         self._channel = None
         self._oldChannels = []
+        self._streams = []
         
     def serviceStarted(self):
         self.emit(QtCore.SIGNAL('connectionService(QObject)'), self)
@@ -70,9 +71,18 @@ class OVEFetchConnection(connection.SSHConnection, QtCore.QObject):
         self._channel = OVECommandChannel(self.fetch, requester, ref, command, commandType, 2**16, 2**15, self)
         self.openChannel(self._channel)
 
+    def openStream(self, stream):
+        self._streams = [s for s in self._streams if not s._finished]
+        self._streams.append(stream)
+        stream.conn = self
+        self.openChannel(stream)
+
     def connectionLost(self, reason):
         if self._channel is not None:
             self._channel.connectionLost(reason)
+        for stream in self._streams:
+            stream.connectionLost(reason)
+        self._streams = []
 
 class OVEFetchTransport(transport.SSHClientTransport, QtCore.QObject):
     def __init__(self, fetch, *params):
@@ -208,6 +218,212 @@ class OVECommandChannel(channel.SSHChannel, QtCore.QObject):
         else:
             QtCore.QObject.timerEvent(self, event)
 
+class OVEStreamChannel(channel.SSHChannel, QtCore.QObject):
+    # A long-lived remote command whose output is delivered to subscribers as it arrives, rather than
+    # running a new command (and opening a new channel) on every refresh
+    name = 'session'
+    MSEC_TIMEOUT=10000
+    # The remote shell kills the command when our end of the channel closes its stdin, because
+    # ovsdb-client ignores SIGPIPE and would otherwise keep running after the channel has gone
+    WATCHDOG='exec 3<&0; (cat <&3 >/dev/null; kill $$) >/dev/null 2>&1 & exec 3<&-; '
+
+    def __init__(self, fetch, key, command, *params):
+        channel.SSHChannel.__init__(self, *params)
+        QtCore.QObject.__init__(self)
+        self.fetch = fetch
+        self.key = key
+        self.command = command
+        self.ready = False # True once a complete snapshot has been received
+        self.changed = set() # Keys of the rows changed since the last streamUpdate, or None for all rows
+        self._data = ''
+        self._extData = ''
+        self._timerId = None
+        self._status = None
+        self._finished = False
+        self.connect(self, QtCore.SIGNAL('streamUpdate(QObject)'), self.fetch.xon_streamUpdate)
+        self.connect(self, QtCore.SIGNAL('streamClosed(QObject, QString)'), self.fetch.xon_streamClosed)
+
+    def openFailed(self, reason):
+        self.finish('Open failed:'+str(reason))
+
+    def channelOpen(self, ignoredData):
+        try:
+            nsCommand = common.NS(self.WATCHDOG + str(self.command))
+            self._timerId = self.startTimer(self.MSEC_TIMEOUT)
+            deferred = self.conn.sendRequest(self, 'exec', nsCommand, wantReply=1)
+            deferred.addCallbacks(self.execStarted, self.execFailed)
+        except Exception, e:
+            self.finish('Open failed:'+str(e))
+
+    def execStarted(self, ignoredData):
+        if self._timerId is not None:
+            self.killTimer(self._timerId)
+            self._timerId = None
+
+    def execFailed(self, reason):
+        self.finish('Remote command could not be started: '+str(reason))
+
+    def dataReceived(self, data):
+        self._data += data
+        if OVEConfig.Inst().logTraffic:
+            OVELog('Stream data received: '+str(data))
+        try:
+            self.handleData()
+        except Exception, e:
+            self.finish('+++ Failed to decode stream: '+str(e))
+
+    def extDataReceived(self, extData):
+        self._extData += extData
+        if OVEConfig.Inst().logTraffic:
+            OVELog('+++ Stream extData (stderr) received: '+str(extData))
+
+    def request_exit_status(self, data):
+        self._status = struct.unpack('>L', data)[0]
+
+    def handleData(self):
+        pass
+
+    def update(self, changed):
+        # changed is a set of row keys, or None if every row may have changed
+        if changed is None or self.changed is None:
+            self.changed = None
+        else:
+            self.changed |= changed
+        self.ready = True
+        self.emit(QtCore.SIGNAL('streamUpdate(QObject)'), self)
+
+    def takeChanged(self):
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+    def snapshot(self):
+        return None
+
+    def finish(self, message):
+        if self._finished:
+            return
+        self._finished = True
+        if self._timerId is not None:
+            self.killTimer(self._timerId)
+            self._timerId = None
+        if len(self._extData) > 0:
+            message += '\n+++ Command output (stderr): '+self._extData
+        self.emit(QtCore.SIGNAL('streamClosed(QObject, QString)'), self, message)
+        self.close()
+
+    def close(self):
+        self._finished = True
+        try:
+            self.loseConnection()
+        except Exception, e:
+            OVELog('OVEStreamChannel.close loseConnection error: '+str(e))
+
+    def closed(self):
+        self.finish('Remote command exited (rc='+str(self._status)+')')
+
+    def connectionLost(self, reason):
+        self.finish('+++ Connection lost')
+
+    def timerEvent(self, event):
+        if event.timerId() == self._timerId:
+            self.finish('+++ Timeout')
+        else:
+            QtCore.QObject.timerEvent(self, event)
+
+class OVEMonitorChannel(OVEStreamChannel):
+    # Runs "ovsdb-client monitor" on one table.  Each update arrives as one line of JSON holding
+    # a table whose first two columns are the row UUID and the action, and is applied to self.rows,
+    # which maps row UUIDs to rows in the same form as the result of a "select" operation
+    MSEC_EMPTY=2000
+
+    def __init__(self, fetch, key, command, *params):
+        OVEStreamChannel.__init__(self, fetch, key, command, *params)
+        self.rows = {}
+        self._emptyTimerId = None
+
+    def execStarted(self, ignoredData):
+        OVEStreamChannel.execStarted(self, ignoredData)
+        # ovsdb-client prints nothing for the initial contents of an empty table
+        self._emptyTimerId = self.startTimer(self.MSEC_EMPTY)
+
+    def handleData(self):
+        while '\n' in self._data:
+            line, self._data = self._data.split('\n', 1)
+            if line.strip() != '':
+                self.applyUpdate(ovs.json.from_string(line))
+
+    def applyUpdate(self, update):
+        if not isinstance(update, dict):
+            raise ValueError(str(update))
+        columns = update['headings'][2:]
+        changed = set()
+        oldUuid = None
+        for values in update['data']:
+            uuid, action = values[0], values[1]
+            row = {}
+            for column, value in zip(columns, values[2:]):
+                if value is not None:
+                    row[column] = value
+            if action == 'delete':
+                self.rows.pop(uuid, None)
+            elif action == 'old':
+                # The new contents of a modified row follow on the next line, without a UUID
+                oldUuid = uuid
+                continue
+            else:
+                if action == 'new':
+                    uuid = oldUuid
+                row['_uuid'] = ['uuid', uuid]
+                self.rows[uuid] = row
+            changed.add(uuid)
+            oldUuid = None
+        self.update(changed)
+
+    def snapshot(self):
+        return self.rows
+
+    def timerEvent(self, event):
+        if event.timerId() == self._emptyTimerId:
+            self.killTimer(self._emptyTimerId)
+            self._emptyTimerId = None
+            if not self.ready:
+                self.update(None)
+        else:
+            OVEStreamChannel.timerEvent(self, event)
+
+    def finish(self, message):
+        if self._emptyTimerId is not None:
+            self.killTimer(self._emptyTimerId)
+            self._emptyTimerId = None
+        OVEStreamChannel.finish(self, message)
+
+class OVERepeatChannel(OVEStreamChannel):
+    # Runs a command in a loop on the remote host over a single channel.  The output of each run is
+    # followed by END_MARKER, or by FAIL_MARKER if the command failed, and replaces self.text
+    END_MARKER_RE=re.compile(r'^END-MARKER$', re.MULTILINE)
+    FAIL_MARKER_RE=re.compile(r'^FAIL-MARKER$', re.MULTILINE)
+
+    def __init__(self, fetch, key, command, *params):
+        OVEStreamChannel.__init__(self, fetch, key, command, *params)
+        self.text = ''
+
+    def handleData(self):
+        while True:
+            endMatch = self.END_MARKER_RE.search(self._data)
+            failMatch = self.FAIL_MARKER_RE.search(self._data)
+            if failMatch and (not endMatch or failMatch.start() < endMatch.start()):
+                self.finish('Remote command failed\n+++ Failed command output: '+self._data[:failMatch.start()])
+                return
+            if not endMatch:
+                return
+            self.text = self._data[:endMatch.start()]
+            self._data = self._data[endMatch.end():].lstrip('\n')
+            self.update(None)
+
+    def snapshot(self):
+        return self.text
+
 class OVEFetchEvent(QtCore.QEvent):
     TYPE = QtCore.QEvent.Type(QtCore.QEvent.registerEventType())
     def __init__(self, ref, data):
@@ -222,6 +438,13 @@ class OVEFetchFailEvent(QtCore.QEvent):
         self.ref = ref
         self.message = str(message)
 
+class OVEStreamEvent(QtCore.QEvent):
+    # Carries no data, so that it survives the PySide issue.  The receiver collects the update with
+    # OVEFetch.takeUpdate
+    TYPE = QtCore.QEvent.Type(QtCore.QEvent.registerEventType())
+    def __init__(self):
+        QtCore.QEvent.__init__(self, self.TYPE)
+
 class OVEFetch(QtCore.QObject):
     instances = {}
     SEC_TIMEOUT = 10.0
@@ -233,6 +456,10 @@ class OVEFetch(QtCore.QObject):
         self._transport = None
         self._connection = None
         self._commandQueue = []
+        self._streamQueue = []
+        self._streams = {} # Remote command -> stream channel
+        self._subscriptions = {} # Requester -> remote command of the stream it receives
+        self._updates = {} # Requester -> [changed rows, failure message] not yet taken by the requester
         self._timerRef = 0
         self.refs = {}
         self.messages = {}
@@ -261,6 +488,9 @@ class OVEFetch(QtCore.QObject):
                 # OVELog('Unqueueing '+str(command))
                 self.execCommand2(*command)
             self._commandQueue = []
+            for stream in self._streamQueue:
+                self._connection.openStream(stream)
+            self._streamQueue = []
 
     def xon_channelData(self, requester, ref, data):
         if OVEConfig.Inst().logTraffic:
@@ -331,6 +561,7 @@ class OVEFetch(QtCore.QObject):
     def resetTransport(self):
         if OVEConfig.Inst().logTraffic:
             OVELog('Transport reset for '+self.config()['address'])
+        self.failStreams('Connection to '+(self.config() or {}).get('address', '<Address not set>')+' reset')
         del self._connection
         del self._transport
         self._connection = None
@@ -338,20 +569,24 @@ class OVEFetch(QtCore.QObject):
         
     def transportErrback(self, failure, requester, ref, address):
         self._timerRef += 1 # Prevent timeout handling
-        self.resetTransport()
         message = 'Failure connecting to '+address+': '+failure.getErrorMessage()
-        self.refs[requester] = ref # For PySide workaround
-        self.messages[requester] = message # For PySide workaround
-        event = OVEFetchFailEvent(ref, message)
-        QtCore.QCoreApplication.postEvent(requester, event)        
-        
-    def transportTimeout(self, timerRef, requester, ref, address):
-        if self._timerRef == timerRef and self._transport is not None and self._connection is None:
-            message = 'Connection attempt to ' +address+' timed out'
+        self.failStreams(message)
+        self.resetTransport()
+        if requester is not None:
             self.refs[requester] = ref # For PySide workaround
             self.messages[requester] = message # For PySide workaround
             event = OVEFetchFailEvent(ref, message)
             QtCore.QCoreApplication.postEvent(requester, event)        
+        
+    def transportTimeout(self, timerRef, requester, ref, address):
+        if self._timerRef == timerRef and self._transport is not None and self._connection is None:
+            message = 'Connection attempt to ' +address+' timed out'
+            self.failStreams(message)
+            if requester is not None:
+                self.refs[requester] = ref # For PySide workaround
+                self.messages[requester] = message # For PySide workaround
+                event = OVEFetchFailEvent(ref, message)
+                QtCore.QCoreApplication.postEvent(requester, event)        
             self.resetTransport()
 
     def execCommand(self, requester, ref, command, commandType):
@@ -359,20 +594,23 @@ class OVEFetch(QtCore.QObject):
             hostName = (self.config() or {}).get('address', '<Address not set>')
             OVELog(str(QtCore.QTime.currentTime().toString())+' '+hostName+': Executing '+command)
         if self._transport is None:
-            self._connection = None
             self._commandQueue.append((requester, ref, command, commandType))
-            config = self.config()
-            creator = protocol.ClientCreator(reactor, OVEFetchTransport, self)
-            self._transport = creator.connectTCP(config['address'], config.get('port', 22), timeout = self.SEC_TIMEOUT)
-            self._transport.addErrback(self.transportErrback, requester, ref, config['address'])
-            self._timerRef += 1
-            # Set this timer slightly longer than the twisted.conch timeout, as transportErrback can cancel
-            # the timeout and prevent double handling
-            # lambda timerRef = self._timerRef: takes a copy of self._timerRef
-            QtCore.QTimer.singleShot(int((1+self.SEC_TIMEOUT) * 1000), lambda timerRef = self._timerRef: self.transportTimeout(timerRef, requester, ref, config['address']))
+            self.connectTransport(requester, ref)
         else:
             self.execCommand2(requester, ref, command, commandType)
 
+    def connectTransport(self, requester, ref):
+        self._connection = None
+        config = self.config()
+        creator = protocol.ClientCreator(reactor, OVEFetchTransport, self)
+        self._transport = creator.connectTCP(config['address'], config.get('port', 22), timeout = self.SEC_TIMEOUT)
+        self._transport.addErrback(self.transportErrback, requester, ref, config['address'])
+        self._timerRef += 1
+        # Set this timer slightly longer than the twisted.conch timeout, as transportErrback can cancel
+        # the timeout and prevent double handling
+        # lambda timerRef = self._timerRef: takes a copy of self._timerRef
+        QtCore.QTimer.singleShot(int((1+self.SEC_TIMEOUT) * 1000), lambda timerRef = self._timerRef: self.transportTimeout(timerRef, requester, ref, config['address']))
+
     def execCommand2(self, requester, ref, command, commandType):
         if self._connection is None:
             self._commandQueue.append((requester, ref, command, commandType))
@@ -386,3 +624,99 @@ class OVEFetch(QtCore.QObject):
         
     def execCommandFramed(self, requester, ref, command):
         self.execCommand(requester, ref, command + ' && echo ' + OVECommandChannel.END_MARKER, 'framed')
+
+    def monitorTable(self, requester, tableName):
+        # Subscribe requester to a table.  Updates are pushed by a single "ovsdb-client monitor" per
+        # table and host, shared by all windows showing that table.  Returns False if requester is
+        # already receiving this table
+        command = '/usr/bin/ovsdb-client monitor --format=json '+self.config()['connectTarget']+' Open_vSwitch '+tableName
+        return self.subscribe(requester, command, OVEMonitorChannel)
+
+    def repeatCommandFramed(self, requester, command, intervalSeconds):
+        # Subscribe requester to the output of command, run every intervalSeconds on the remote host
+        # over one long-lived channel.  Returns False if requester is already receiving this command
+        loop = 'while : ; do { '+command+' ; } && echo '+OVECommandChannel.END_MARKER+' || echo FAIL-MARKER ; sleep '+str(intervalSeconds)+' ; done'
+        return self.subscribe(requester, loop, OVERepeatChannel)
+
+    def subscribe(self, requester, command, channelClass):
+        if self._subscriptions.get(requester, None) == command and command in self._streams:
+            return False
+        self.unsubscribe(requester)
+        self._subscriptions[requester] = command
+        stream = self._streams.get(command, None)
+        if stream is None:
+            if OVEConfig.Inst().logTraffic:
+                OVELog(str(QtCore.QTime.currentTime().toString())+' '+self.config()['address']+': Streaming '+command)
+            stream = channelClass(self, command, command, 2**16, 2**15, self._connection)
+            self._streams[command] = stream
+            if self._transport is None:
+                self._streamQueue.append(stream)
+                self.connectTransport(None, None)
+            elif self._connection is None:
+                self._streamQueue.append(stream)
+            else:
+                self._connection.openStream(stream)
+        elif stream.ready:
+            self.postUpdate(requester, None)
+        return True
+
+    def unsubscribe(self, requester):
+        command = self._subscriptions.pop(requester, None)
+        self._updates.pop(requester, None)
+        if command is not None and command not in self._subscriptions.values():
+            stream = self._streams.pop(command, None)
+            if stream is not None:
+                if stream in self._streamQueue:
+                    self._streamQueue.remove(stream)
+                stream.close()
+
+    def isSubscribed(self, requester):
+        return requester in self._subscriptions
+
+    def postUpdate(self, requester, changed, message = None):
+        # Updates are merged until the requester takes them, so a burst of changes costs one redraw
+        pending = self._updates.get(requester, None)
+        if pending is None:
+            self._updates[requester] = [changed, message]
+            QtCore.QCoreApplication.postEvent(requester, OVEStreamEvent())
+        else:
+            if changed is None or pending[0] is None:
+                pending[0] = None
+            else:
+                pending[0] = pending[0] | changed
+            if message is not None:
+                pending[1] = message
+
+    def takeUpdate(self, requester):
+        # Returns (snapshot, changed, message) for the updates posted to requester, or None.  changed
+        # is a set of row UUIDs, or None if all rows must be redrawn.  A message means the stream failed
+        pending = self._updates.pop(requester, None)
+        if pending is None:
+            return None
+        changed, message = pending
+        stream = self._streams.get(self._subscriptions.get(requester, None), None)
+        if message is not None or stream is None:
+            return (None, None, message)
+        return (stream.snapshot(), changed, None)
+
+    def xon_streamUpdate(self, stream):
+        if self._streams.get(stream.key, None) is not stream:
+            return
+        changed = stream.takeChanged()
+        for requester, command in self._subscriptions.items():
+            if command == stream.key:
+                self.postUpdate(requester, changed and set(changed))
+
+    def xon_streamClosed(self, stream, message):
+        if self._streams.get(stream.key, None) is not stream:
+            return
+        del self._streams[stream.key]
+        for requester, command in self._subscriptions.items():
+            if command == stream.key:
+                del self._subscriptions[requester]
+                self.postUpdate(requester, None, str(message))
+
+    def failStreams(self, message):
+        for stream in self._streams.values():
+            stream.finish(message)
+        self._streamQueue = []
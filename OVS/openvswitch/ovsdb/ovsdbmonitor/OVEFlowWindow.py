@@ -25,6 +25,176 @@ from Ui_FlowWindow import *
 
 import re
 
+class OVEFlowModel(QtCore.QAbstractTableModel):
+    # Holds the flows of one datapath, keyed by everything but their counters, so that a refresh only
+    # inserts new flows, removes expired ones and signals dataChanged for flows whose counters moved.
+    # The view asks for cell colours as it paints, so only visible cells are ever coloured
+    IP_RE = re.compile(r'[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+')
+    MAC_RE = re.compile(r'[0-9a-fA-F]{1,2}(:[0-9a-fA-F]{1,2}){5}(/|$)')
+    # The proxy sorts on this role, so that the rate column can show flows without a rate yet as blank
+    # but still sort them as numbers
+    SORT_ROLE = Qt.UserRole
+
+    def __init__(self, parent = None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.headings = OVEUtil.flowDecodeHeadings() + ['Bit rate']
+        self.rateColumn = len(self.headings) - 1
+        self.actionsColumn = OVEUtil.getFlowColumn('actions')
+        self.usedColumn = OVEUtil.getFlowColumn('used')
+        self.srcMacColumn = OVEUtil.getFlowColumn('source mac')
+        self.destMacColumn = OVEUtil.getFlowColumn('destination mac')
+        self.inportColumn = OVEUtil.getFlowColumn('inport')
+        self.vlanColumn = OVEUtil.getFlowColumn('vlan')
+        self.packetsColumn = OVEUtil.getFlowColumn('packet count')
+        self.bytesColumn = OVEUtil.getFlowColumn('bytes')
+        self.counterColumns = (self.packetsColumn, self.bytesColumn, self.usedColumn)
+        self.keys = [] # Flow key for each row
+        self.flows = {} # Flow key -> flow tuple from OVEUtil.decodeFlows
+        self.rates = {} # Flow key -> bit rate since the previous update, or None for new flows
+        self.lastTime = None
+
+    def flowKey(self, flow):
+        return tuple(v for i, v in enumerate(flow) if i not in self.counterColumns)
+
+    def updateFlows(self, flows, now):
+        newFlows = {}
+        newKeys = []
+        for flow in flows:
+            key = self.flowKey(flow)
+            if key in newFlows:
+                # Flows on fields that decodeFlows doesn't report can look identical, so keep them apart
+                n = 1
+                while key + (n,) in newFlows:
+                    n += 1
+                key = key + (n,)
+            newFlows[key] = flow
+            newKeys.append(key)
+
+        timeDiff = self.lastTime is not None and now - self.lastTime or 0
+        self.lastTime = now
+
+        # Remove expired flows, in runs of adjacent rows from the bottom up
+        row = len(self.keys) - 1
+        while row >= 0:
+            if self.keys[row] in newFlows:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and self.keys[row] not in newFlows:
+                row -= 1
+            self.beginRemoveRows(QtCore.QModelIndex(), row + 1, last)
+            del self.keys[row + 1:last + 1]
+            self.endRemoveRows()
+
+        # Update flows that are still present, signalling runs of adjacent changed rows
+        rates = {}
+        firstChanged = None
+        for row, key in enumerate(self.keys):
+            flow = newFlows[key]
+            oldFlow = self.flows[key]
+            if timeDiff > 0:
+                rates[key] = long(8 * (int(flow[self.bytesColumn]) - int(oldFlow[self.bytesColumn])) / timeDiff)
+            else:
+                rates[key] = self.rates.get(key, None)
+            if flow != oldFlow or rates[key] != self.rates.get(key, None):
+                if firstChanged is None:
+                    firstChanged = row
+            elif firstChanged is not None:
+                self.emitDataChanged(firstChanged, row - 1)
+                firstChanged = None
+        self.flows = newFlows
+        self.rates = rates
+        if firstChanged is not None:
+            self.emitDataChanged(firstChanged, len(self.keys) - 1)
+
+        # Append new flows
+        present = set(self.keys)
+        added = [key for key in newKeys if key not in present]
+        if len(added) > 0:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.keys), len(self.keys) + len(added) - 1)
+            self.keys.extend(added)
+            for key in added:
+                self.rates[key] = None
+            self.endInsertRows()
+
+    def emitDataChanged(self, firstRow, lastRow):
+        self.emit(QtCore.SIGNAL('dataChanged(QModelIndex,QModelIndex)'),
+            self.index(firstRow, 0), self.index(lastRow, len(self.headings) - 1))
+
+    def totalRate(self):
+        # Sum of the per-flow rates, so that flows expiring between updates don't show as negative traffic
+        rates = [rate for rate in self.rates.values() if rate is not None]
+        if len(rates) == 0:
+            return None
+        return sum(rates)
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.keys)
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headings)
+
+    def headerData(self, section, orientation, role = Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return QVariant(self.headings[section])
+        return QVariant()
+
+    def data(self, index, role = Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        key = self.keys[index.row()]
+        colNum = index.column()
+        flow = self.flows[key]
+        if colNum == self.rateColumn:
+            data = self.rates.get(key, None)
+            if data is None:
+                data = ''
+        else:
+            data = flow[colNum]
+
+        if role == self.SORT_ROLE:
+            if colNum == self.rateColumn:
+                return QVariant(float(data or 0))
+            role = Qt.DisplayRole
+
+        if role == Qt.DisplayRole:
+            # PySide 0.2.3 fails to convert long ints to QVariants and logs 'long int too large to convert to int' errors
+            try:
+                return QVariant(data)
+            except Exception, e:
+                return QVariant('Error: See tooltip')
+        elif role == Qt.ToolTipRole:
+            return QVariant(str(data))
+        elif role == Qt.BackgroundRole:
+            if colNum == self.vlanColumn:
+                return QVariant(QtGui.QColor(255-(10*data % 192), 255-((17*data) % 192), 255-((37*data) % 192)))
+            elif (colNum == self.srcMacColumn or colNum == self.destMacColumn) and self.MAC_RE.match(data):
+                # Colour masked MACs by their value; flows without an Ethernet match get the row colour below
+                cols = [int(x, 16) for x in data.split('/', 1)[0].split(':')]
+                return QVariant(QtGui.QColor(255-cols[2]*cols[3] % 192, 255-cols[3]*cols[4] % 192, 255-cols[4]*cols[5] % 192))
+            elif self.IP_RE.match(str(data)):
+                cols = [int(x) for x in data.split('/', 1)[0].split('.')]
+                return QVariant(QtGui.QColor(255-cols[1]*cols[2] % 192, 255-cols[2]*cols[3] % 192, 255-cols[3]*cols[0] % 192))
+            else:
+                inport = flow[self.inportColumn]
+                if flow[self.actionsColumn] == 'drop':
+                    baseLum=172
+                else:
+                    baseLum=239
+                return QVariant(QtGui.QColor(baseLum+16*(inport % 2), baseLum+8*(inport % 3), baseLum+4*(inport % 5)))
+        elif role == Qt.ForegroundRole:
+            if colNum in (self.vlanColumn, self.srcMacColumn, self.destMacColumn) or self.IP_RE.match(str(data)):
+                return QVariant()
+            elif flow[self.usedColumn] == 'never':
+                return QVariant(QtGui.QColor(112,112,112))
+            else:
+                return QVariant(QtGui.QColor(Qt.black))
+        return QVariant()
+
 class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
     LOAD_KEY = 'FlowWindow/window'
     COMMAND_OVS_DPCTL='/usr/bin/ovs-dpctl'
@@ -35,12 +205,12 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
         self.ui = Ui_FlowWindow()
         self.dpNames = []
         self.dpTables = []
+        self.dpModels = []
         self.currentOpIndex = None
+        self.streamIndex = None
         self.resizeCount = []
         self.ssgChecked = False
         self.ssgText = ''
-        self.lastTime = None
-        self.lastByteCount = 0
         OVECommonWindow.__init__(self, app, loadIndex)
 
         self.updateSsgList()
@@ -107,6 +277,11 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
     def xon_ssgCheckBox_stateChanged(self, state):
         self.ssgChecked = (state == Qt.Checked)
         self.updateTable()
+
+    def xon_intervalCheckBox_stateChanged(self, state):
+        OVECommonWindow.xon_intervalCheckBox_stateChanged(self, state)
+        if not self.intervalChecked:
+            self.unsubscribe()
     
     def xon_configUpdated(self):
         OVECommonWindow.xon_configUpdated(self)
@@ -131,30 +306,34 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
     def rebuildTables(self):
         self.ui.tabWidget.clear() # Let the garbage collector delete the pages
         self.dpTables = []
+        self.dpModels = []
         self.dpFlows = []
         self.resizeCount = []
-        headings = OVEUtil.flowDecodeHeadings()
         
         for dpName in self.dpNames:
             pageWidget = QtGui.QWidget()
             pageWidget.setObjectName(dpName+'_page')
             gridLayout = QtGui.QGridLayout(pageWidget)
             gridLayout.setObjectName(dpName+"_gridLayout")
-            table = QtGui.QTableWidget(pageWidget)
+            model = OVEFlowModel(pageWidget)
+            # The proxy keeps rows sorted as the model changes, without resorting the whole table
+            proxy = QtGui.QSortFilterProxyModel(pageWidget)
+            proxy.setSourceModel(model)
+            proxy.setDynamicSortFilter(True)
+            proxy.setSortRole(OVEFlowModel.SORT_ROLE)
+            table = QtGui.QTableView(pageWidget)
             table.setObjectName(dpName+"_table")
-            table.setColumnCount(len(headings))
-            table.setRowCount(0)
+            table.setModel(proxy)
             gridLayout.addWidget(table, 0, 0, 1, 1)
             self.dpTables.append(table)
+            self.dpModels.append(model)
             self.ui.tabWidget.addTab(pageWidget, dpName)
             self.dpFlows.append([])
             self.resizeCount.append(0)
-            for i, heading in enumerate(headings):
-                table.setHorizontalHeaderItem(i, QtGui.QTableWidgetItem(heading))
 
             table.setSortingEnabled(True)
             
-            table.sortItems(OVEUtil.getFlowColumn('source mac'))
+            table.sortByColumn(OVEUtil.getFlowColumn('source mac'), Qt.AscendingOrder)
             table.setSelectionMode(QtGui.QAbstractItemView.NoSelection)
     
     def updateSsgState(self):
@@ -187,12 +366,19 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
             config = OVEConfig.Inst().hostFromUuid(self.hostUuid)
             self.setWindowTitle('OVS Flows - '+config.get('address', ''))
             try:
-                self.setFetchSkip()
-                self.statusBar().showMessage('Fetching data...') 
-                self.currentRef += 1
-                self.currentOp = 'dump-flows'
                 self.currentOpIndex = self.ui.tabWidget.currentIndex()
-                OVEFetch.Inst(self.hostUuid).execCommandFramed(self, self.currentRef, self.updateCommand())
+                if self.intervalChecked:
+                    # Flows are dumped on the remote host at each interval and pushed to us over one
+                    # channel.  Does nothing if that is already happening for this command
+                    if OVEFetch.Inst(self.hostUuid).repeatCommandFramed(self, self.updateCommand(), self.intervalSeconds):
+                        self.statusBar().showMessage('Fetching data...')
+                        self.streamIndex = self.currentOpIndex
+                else:
+                    self.setFetchSkip()
+                    self.statusBar().showMessage('Fetching data...') 
+                    self.currentRef += 1
+                    self.currentOp = 'dump-flows'
+                    OVEFetch.Inst(self.hostUuid).execCommandFramed(self, self.currentRef, self.updateCommand())
             except Exception, e:
                 message = 'Update failed: '+str(e)
                 OVELog(message)
@@ -200,87 +386,19 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
     
     def writeCurrentTable(self):
         index = self.ui.tabWidget.currentIndex()
-        actionsColumn = OVEUtil.getFlowColumn('actions')
-        usedColumn = OVEUtil.getFlowColumn('used')
-        srcMacColumn = OVEUtil.getFlowColumn('source mac')
-        destMacColumn = OVEUtil.getFlowColumn('destination mac')
-        srcIPColumn = OVEUtil.getFlowColumn('source ip')
-        destIPColumn = OVEUtil.getFlowColumn('destination ip')
-        inportColumn = OVEUtil.getFlowColumn('inport')
-        vlanColumn = OVEUtil.getFlowColumn('vlan')
-        bytesColumn = OVEUtil.getFlowColumn('bytes')
-        
-        byteCount = 0
         try:
             table = self.dpTables[index]
-            table.setUpdatesEnabled(False)
-            table.setSortingEnabled(False)
-            try:
-                flows = self.dpFlows[index]
-                table.setRowCount(len(flows))
-                if len(flows) > 0:
-                    table.setColumnCount(len(flows[0]))
-                for rowNum, flow in enumerate(flows):
-                    
-                    inport = flow[inportColumn]
-                    if flow[actionsColumn] == 'drop':
-                        baseLum=172
-                    else:
-                        baseLum=239
-                    background = QtGui.QColor(baseLum+16*(inport % 2), baseLum+8*(inport % 3), baseLum+4*(inport % 5))
-                    if flow[usedColumn] == 'never':
-                        colour = QtGui.QColor(112,112,112)
-                    else:
-                        colour = Qt.black
-                        
-                    for colNum, data in enumerate(flow):
-                        item = None
-                        try:
-                            item = table.takeItem(rowNum, colNum)
-                        except:
-                            pass
-                        if item is None:
-                            item = QtGui.QTableWidgetItem('')
-
-                        if colNum == vlanColumn:
-                            item.setBackground(QtGui.QColor(255-(10*data % 192), 255-((17*data) % 192), 255-((37*data) % 192)))
-                        elif colNum == srcMacColumn or colNum == destMacColumn:
-                            cols = [int(x, 16) for x in data.split(':')]
-                            item.setBackground(QtGui.QColor(255-cols[2]*cols[3] % 192, 255-cols[3]*cols[4] % 192, 255-cols[4]*cols[5] % 192))
-                        elif re.match(r'[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+', str(data)):
-                            cols = [int(x) for x in data.split('.')]
-                            item.setBackground(QtGui.QColor(255-cols[1]*cols[2] % 192, 255-cols[2]*cols[3] % 192, 255-cols[3]*cols[0] % 192))
-                        else:
-                            item.setBackground(background)
-                            item.setForeground(colour)
-                            
-                        if colNum == bytesColumn:
-                            byteCount += int(data)
-                            
-                        # PySide 0.2.3 fails to convert long ints to QVariants and logs 'long int too large to convert to int' errors
-                        try:
-                            item.setData(Qt.DisplayRole, QVariant(data))
-                            item.setToolTip(str(data))
-                        except Exception, e:
-                            item.setText('Error: See tooltip')
-                            item.setToolTip(str(e))
-                        table.setItem(rowNum, colNum, item)
-                
-                if self.resizeCount[index] < 2:
-                    self.resizeCount[index] += 1
-                    for i in range(0, table.columnCount()):
-                        table.resizeColumnToContents(i)
+            model = self.dpModels[index]
+            model.updateFlows(self.dpFlows[index], time.time())
 
-            finally:
-                table.setUpdatesEnabled(True)
-                table.setSortingEnabled(True)
+            if self.resizeCount[index] < 2:
+                self.resizeCount[index] += 1
+                table.resizeColumnsToContents()
 
             message = 'Updated at '+str(QtCore.QTime.currentTime().toString())
             
-            if self.lastTime is not None:
-                timeDiff = time.time() - self.lastTime
-                byteDiff = byteCount - self.lastByteCount
-                bitRate = long(8 * byteDiff / timeDiff)
+            bitRate = model.totalRate()
+            if bitRate is not None:
                 if abs(bitRate) < 10*2**20:
                     message += ' ('+str(bitRate/2**10)+' kbit/s)'
                 elif abs(bitRate) < 10*2**30:
@@ -288,9 +406,7 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
                 else:
                     message += ' ('+str(bitRate/2**30)+' Gbit/s)'
                 
-            self.lastByteCount = byteCount
-            self.lastTime = time.time()
-            if table.rowCount() == 0:
+            if model.rowCount() == 0:
                 message += ' - Table is empty'
             self.statusBar().showMessage(message)
 
@@ -312,6 +428,19 @@ class OVEFlowWindow(QtGui.QMainWindow, OVECommonWindow):
         self.statusBar().showMessage(message)
         OVELog('Fetch ('+self.currentOp+') failed')
 
+    def handleStreamUpdate(self, values, changed):
+        if self.streamIndex == self.ui.tabWidget.currentIndex():
+            self.dpFlows[self.streamIndex] = OVEUtil.decodeFlows(values)
+            self.writeCurrentTable()
+
+    def handleStreamFailure(self, message):
+        self.statusBar().showMessage(message)
+        OVELog('Fetch (dump-flows) failed')
+
+    def closeEvent(self, event):
+        self.unsubscribe()
+        QtGui.QMainWindow.closeEvent(self, event)
+
     def customEvent(self, event):
         OVECommonWindow.customEvent(self, event)
         
@@ -29,6 +29,8 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
     def __init__(self, app, loadIndex = None):
         QtGui.QMainWindow.__init__(self)
         self.ui = Ui_MainWindow()
+        self.rowNums = {} # Row UUID -> row number in the current table
+        self.columnNames = []
         OVECommonWindow.__init__(self, app, loadIndex)
     
     def xon_tabWidget_currentChanged(self, value):
@@ -43,12 +45,11 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
         else:
             config = OVEConfig.Inst().hostFromUuid(self.hostUuid)
             self.setWindowTitle('OVS Database - '+config.get('address', ''))
-            self.invalidateCurrentTable('Fetching data...')
             tabName = self.ui.tabWidget.currentWidget().objectName()
             try:
-                self.setFetchSkip()
-                self.currentRef += 1
-                OVEFetch.Inst(self.hostUuid).getTable(self, tabName, self.currentRef)
+                # Does nothing if the table is already being monitored, as updates are pushed to us
+                if OVEFetch.Inst(self.hostUuid).monitorTable(self, str(tabName)):
+                    self.invalidateCurrentTable('Fetching data...')
             except Exception, e:
                 OVELog("Error fetching data: "+str(e))
                 self.invalidateCurrentTable(str(e))
@@ -66,6 +67,35 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
     def handleFetchFailEvent(self, ref, message):
         self.invalidateCurrentTable(str(message))
 
+    def handleStreamUpdate(self, rows, changed):
+        tabName = self.ui.tabWidget.currentWidget().objectName()
+        self.monitorToTable(getattr(self.ui, str(tabName)+'Table'), rows, changed)
+
+    def handleStreamFailure(self, message):
+        self.invalidateCurrentTable(str(message))
+
+    def monitorToTable(self, table, rows, changed):
+        # Only rows that changed are redrawn, unless rows were added or removed
+        rebuild = changed is None
+        if not rebuild:
+            for uuid in changed:
+                if (uuid in rows) != (uuid in self.rowNums) or (uuid in rows and sorted(rows[uuid].keys()) != self.columnNames):
+                    rebuild = True
+                    break
+
+        if rebuild:
+            uuids = sorted(rows.keys())
+            self.rowNums = dict((uuid, rowNum) for rowNum, uuid in enumerate(uuids))
+            self.columnNames = len(uuids) > 0 and sorted(rows[uuids[0]].keys()) or []
+            self.structToTable(table, [{'rows': [rows[uuid] for uuid in uuids]}])
+        else:
+            table.setUpdatesEnabled(False)
+            for uuid in changed:
+                self.rowToTable(table, self.rowNums[uuid], rows[uuid])
+                table.resizeRowToContents(self.rowNums[uuid])
+            table.setUpdatesEnabled(True)
+            self.statusBar().showMessage('Updated at '+str(QtCore.QTime.currentTime().toString()))
+
     def structToTable(self, table, values):
         
         table.setUpdatesEnabled(False)
@@ -76,19 +106,7 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
             table.setRowCount(len(result['rows']))
             for row in result['rows']:
                 table.setColumnCount(len(row))
-                colNum=0
-                for k in sorted(row.keys()):
-                    v = row[k]
-                    headerItem = QtGui.QTableWidgetItem(k)
-                    table.setHorizontalHeaderItem(colNum, headerItem)
-                    text = OVEUtil.paramToString(v)
-                    item = QtGui.QTableWidgetItem(text)
-                    longText = OVEUtil.paramToLongString(v)
-                    item.setToolTip(longText)
-
-                    table.setItem(rowNum, colNum, item)
-                    colNum+=1
-
+                self.rowToTable(table, rowNum, row)
                 rowNum+=1
                 
         for i in range(0, table.columnCount()):
@@ -104,6 +122,20 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
             message += ' - Table is empty'
         self.statusBar().showMessage(message)
 
+    def rowToTable(self, table, rowNum, row):
+        colNum=0
+        for k in sorted(row.keys()):
+            v = row[k]
+            headerItem = QtGui.QTableWidgetItem(k)
+            table.setHorizontalHeaderItem(colNum, headerItem)
+            text = OVEUtil.paramToString(v)
+            item = QtGui.QTableWidgetItem(text)
+            longText = OVEUtil.paramToLongString(v)
+            item.setToolTip(longText)
+
+            table.setItem(rowNum, colNum, item)
+            colNum+=1
+
     def invalidateCurrentTable(self, message):
         tabName = self.ui.tabWidget.currentWidget().objectName()
         self.invalidateTable(getattr(self.ui, str(tabName)+'Table'), message)
@@ -130,6 +162,12 @@ class OVEMainWindow(QtGui.QMainWindow, OVECommonWindow):
         table.clear()
         table.setRowCount(0)
         table.setColumnCount(0)
+        self.rowNums = {}
+        self.columnNames = []
+
+    def closeEvent(self, event):
+        self.unsubscribe()
+        QtGui.QMainWindow.closeEvent(self, event)
         
     def saveSettings(self, index):
         settings = OVECommonWindow.saveSettings(self, index)
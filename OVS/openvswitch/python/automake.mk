@@ -11,6 +11,7 @@ ovstest_pyfiles = \
 ovs_pyfiles = \
 	python/ovs/__init__.py \
 	python/ovs/daemon.py \
+	python/ovs/dpflows.py \
 	python/ovs/db/__init__.py \
 	python/ovs/db/data.py \
 	python/ovs/db/error.py \
@@ -15,7 +15,9 @@
 import errno
 import fcntl
 import os
+import random
 import resource
+import select
 import signal
 import sys
 import time
@@ -54,6 +56,33 @@ _monitor = False
 # File descriptor used by daemonize_start() and daemonize_complete().
 _daemonize_fd = None
 
+# With --monitor, the monitor waits _restart_backoff_min ms before restarting
+# a daemon that fails again shortly after a restart, doubling the wait for each
+# further failure up to _restart_backoff_max ms, plus up to _restart_jitter of
+# the wait at random so that daemons that fail together do not come back
+# together.  A daemon that stays up for _restart_backoff_max ms is considered
+# healthy again.
+_restart_backoff_min = 10000
+_restart_backoff_max = 300000
+_restart_jitter = 0.25
+
+# With --monitor, the number of consecutive failed restarts after which the
+# monitor gives up (None for no limit).
+_restart_limit = None
+
+# With --monitor, the number of ms the monitor waits for a heartbeat() from the
+# daemon before killing and restarting it (None to disable heartbeats).
+_heartbeat_timeout = None
+
+# In a monitored daemon, the write end of the heartbeat pipe, and the time of
+# the last heartbeat written to it.
+_heartbeat_fd = None
+_last_heartbeat = None
+
+# In the monitor, statistics about restarts.  A daemon process inherits a copy
+# as of its own restart: see get_restart_stats().
+_restart_stats = {}
+
 RESTART_EXIT_CODE = 5
 
 
@@ -122,6 +151,89 @@ def set_monitor():
     _monitor = True
 
 
+def set_monitor_backoff(min_msec, max_msec):
+    """Sets up the monitor configured with set_monitor() to wait 'min_msec'
+    milliseconds before restarting a daemon that dies again soon after being
+    restarted, doubling the wait for each further such death up to 'max_msec'
+    milliseconds."""
+    global _restart_backoff_min
+    global _restart_backoff_max
+    _restart_backoff_min = min_msec
+    _restart_backoff_max = max(min_msec, max_msec)
+
+
+def set_monitor_restart_limit(limit):
+    """Sets up the monitor configured with set_monitor() to give up and exit
+    once it has restarted the daemon 'limit' times in a row without the daemon
+    staying up for the maximum backoff interval.  If 'limit' is None, the
+    monitor keeps restarting the daemon indefinitely, which is the default."""
+    global _restart_limit
+    _restart_limit = limit
+
+
+def set_monitor_heartbeat(msec):
+    """Sets up the monitor configured with set_monitor() to kill and restart
+    the daemon if, once it has completed startup, it goes 'msec' milliseconds
+    without calling heartbeat().  A daemon that enables this must call
+    heartbeat() from its main loop, and heartbeat_wait() before blocking."""
+    global _heartbeat_timeout
+    _heartbeat_timeout = msec
+
+
+def heartbeat():
+    """Lets the monitor know that this daemon is still making progress, if the
+    monitor was configured with set_monitor_heartbeat().  Cheap enough to call
+    on every iteration of the main loop."""
+    global _last_heartbeat
+
+    if _heartbeat_fd is None:
+        return
+
+    now = ovs.timeval.msec()
+    if (_last_heartbeat is not None
+        and now < _last_heartbeat + _heartbeat_timeout / 4):
+        return
+
+    try:
+        os.write(_heartbeat_fd, "0")
+    except OSError, e:
+        # EAGAIN means that the monitor has plenty of heartbeats to read
+        # already.  Anything else means that the monitor is gone.
+        if e.errno != errno.EAGAIN:
+            vlog.warn("heartbeat failed (%s)" % os.strerror(e.errno))
+            _close_heartbeat()
+            return
+    _last_heartbeat = now
+
+
+def heartbeat_wait(poller):
+    """Causes 'poller' to wake up when heartbeat() should next be called."""
+    if _heartbeat_fd is not None and _last_heartbeat is not None:
+        poller.timer_wait_until(_last_heartbeat + _heartbeat_timeout / 4)
+
+
+def _close_heartbeat():
+    global _heartbeat_fd
+    if _heartbeat_fd is not None:
+        os.close(_heartbeat_fd)
+        _heartbeat_fd = None
+
+
+def get_restart_stats():
+    """Returns a dictionary that describes how the monitor last restarted this
+    daemon, or an empty dictionary if it has not been restarted.  The
+    dictionary contains:
+
+        "restarts": the number of times the monitor has restarted the daemon.
+        "status": how the previous daemon process died.
+        "backoff": ms the monitor waited before restarting the daemon.
+        "latency": ms from the previous daemon process's death until this one
+                   completed startup, once daemonize_complete() is called.
+
+    A daemon might, for example, report these over unixctl."""
+    return _restart_stats.copy()
+
+
 def _fatal(msg):
     vlog.err(msg)
     sys.stderr.write("%s\n" % msg)
@@ -212,9 +324,8 @@ def _waitpid(pid, options):
         try:
             return os.waitpid(pid, options)
         except OSError, e:
-            if e.errno == errno.EINTR:
-                pass
-            return -e.errno, 0
+            if e.errno != errno.EINTR:
+                return -e.errno, 0
 
 
 def _fork_and_wait_for_startup():
@@ -295,20 +406,120 @@ def _should_restart(status):
     return False
 
 
-def _monitor_daemon(daemon_pid):
+def _fork_daemon():
+    """Forks a daemon process from the monitor and waits for it to complete
+    startup.  Returns (pid, fd) in the monitor, where 'fd' is the read end of
+    the daemon's heartbeat pipe or None if heartbeats are disabled, and (0,
+    None) in the daemon."""
+    rfd = wfd = None
+    if _heartbeat_timeout is not None:
+        try:
+            rfd, wfd = os.pipe()
+        except OSError, e:
+            sys.stderr.write("pipe failed: %s\n" % os.strerror(e.errno))
+            sys.exit(1)
+        for fd in rfd, wfd:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    pid = _fork_and_wait_for_startup()
+    if rfd is None:
+        return pid, None
+    elif pid > 0:
+        os.close(wfd)
+        return pid, rfd
+    else:
+        os.close(rfd)
+        flags = fcntl.fcntl(wfd, fcntl.F_GETFL)
+        fcntl.fcntl(wfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        global _heartbeat_fd
+        global _last_heartbeat
+        _heartbeat_fd = wfd
+        _last_heartbeat = None
+        return 0, None
+
+
+def _wait_for_daemon(daemon_pid, fd):
+    """Waits for 'daemon_pid' to die and returns (retval, status, hung) as
+    _waitpid() would, plus whether the monitor killed the daemon for missing
+    its heartbeats.  'fd' is the read end of the daemon's heartbeat pipe, or
+    None if heartbeats are disabled."""
+    if fd is not None:
+        deadline = ovs.timeval.msec() + _heartbeat_timeout
+    while fd is not None:
+        timeout = max(0, deadline - ovs.timeval.msec()) / 1000.0
+        try:
+            ready = select.select([fd], [], [], timeout)[0]
+        except select.error, e:
+            if e[0] == errno.EINTR:
+                continue
+            raise
+
+        if ready:
+            try:
+                data = os.read(fd, 4096)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                data = ""
+            if data:
+                deadline = ovs.timeval.msec() + _heartbeat_timeout
+                continue
+
+            # End of file: the daemon has died.
+            break
+
+        retval, status = _waitpid(daemon_pid, os.WNOHANG)
+        if retval != 0:
+            os.close(fd)
+            return retval, status, False
+
+        vlog.err("pid %d sent no heartbeat for %.1f seconds, killing it"
+                 % (daemon_pid, _heartbeat_timeout / 1000.0))
+        os.kill(daemon_pid, signal.SIGKILL)
+        os.close(fd)
+        retval, status = _waitpid(daemon_pid, 0)
+        return retval, status, True
+
+    if fd is not None:
+        os.close(fd)
+    retval, status = _waitpid(daemon_pid, 0)
+    return retval, status, False
+
+
+def _restart_backoff(failures):
+    """Returns the number of ms to wait between restarts of a daemon that has
+    died 'failures' times in a row soon after a restart."""
+    if not failures:
+        return 0
+    backoff = min(_restart_backoff_max,
+                  _restart_backoff_min * 2 ** min(failures - 1, 30))
+    return backoff * (1 + random.random() * _restart_jitter)
+
+
+def _monitor_daemon(daemon_pid, heartbeat_fd):
     # XXX should log daemon's stderr output at startup time
     # XXX should use setproctitle module if available
     last_restart = None
+    started = ovs.timeval.msec()
+    failures = 0
+    total_latency = 0
     while True:
-        retval, status = _waitpid(daemon_pid, 0)
+        retval, status, hung = _wait_for_daemon(daemon_pid, heartbeat_fd)
+        died = ovs.timeval.msec()
         if retval < 0:
             sys.stderr.write("waitpid failed\n")
             sys.exit(1)
         elif retval == daemon_pid:
-            status_msg = ("pid %d died, %s"
-                          % (daemon_pid, ovs.process.status_msg(status)))
+            if hung:
+                status_msg = ("pid %d hung, %s"
+                              % (daemon_pid, ovs.process.status_msg(status)))
+            else:
+                status_msg = ("pid %d died, %s"
+                              % (daemon_pid, ovs.process.status_msg(status)))
 
-            if _should_restart(status):
+            if hung or _should_restart(status):
                 if os.WCOREDUMP(status):
                     # Disable further core dumps to save disk space.
                     try:
@@ -316,24 +527,51 @@ def _monitor_daemon(daemon_pid):
                     except resource.error:
                         vlog.warn("failed to disable core dumps")
 
-                # Throttle restarts to no more than once every 10 seconds.
-                if (last_restart is not None and
-                    ovs.timeval.msec() < last_restart + 10000):
-                    vlog.warn("%s, waiting until 10 seconds since last "
-                              "restart" % status_msg)
+                # Back off exponentially from a daemon that keeps dying soon
+                # after being restarted, and give up on it after
+                # _restart_limit restarts in a row, if set.
+                if died - started >= _restart_backoff_max:
+                    failures = 0
+                elif last_restart is not None:
+                    failures += 1
+                if _restart_limit is not None and failures >= _restart_limit:
+                    vlog.err("%s, giving up after %d restarts in a row"
+                             % (status_msg, failures))
+                    sys.exit(1)
+
+                backoff = _restart_backoff(failures)
+                if last_restart is not None and died < last_restart + backoff:
+                    vlog.warn("%s, waiting until %.1f seconds since last "
+                              "restart" % (status_msg, backoff / 1000.0))
                     while True:
                         now = ovs.timeval.msec()
-                        wakeup = last_restart + 10000
-                        if now > wakeup:
+                        wakeup = last_restart + backoff
+                        if now >= wakeup:
                             break
-                        print "sleep %f" % ((wakeup - now) / 1000.0)
                         time.sleep((wakeup - now) / 1000.0)
                 last_restart = ovs.timeval.msec()
 
                 vlog.err("%s, restarting" % status_msg)
-                daemon_pid = _fork_and_wait_for_startup()
+                _restart_stats["restarts"] = (
+                    _restart_stats.get("restarts", 0) + 1)
+                _restart_stats["status"] = status_msg
+                _restart_stats["died"] = died
+                _restart_stats["backoff"] = last_restart - died
+                daemon_pid, heartbeat_fd = _fork_daemon()
                 if not daemon_pid:
                     break
+
+                started = ovs.timeval.msec()
+                latency = started - died
+                total_latency += latency
+                vlog.info("pid %d started %.3f seconds after the previous "
+                          "daemon died (%.3f seconds of backoff), %d "
+                          "restarts, mean restart time %.3f seconds"
+                          % (daemon_pid, latency / 1000.0,
+                             _restart_stats["backoff"] / 1000.0,
+                             _restart_stats["restarts"],
+                             total_latency / 1000.0
+                             / _restart_stats["restarts"]))
             else:
                 vlog.info("%s, exiting" % status_msg)
                 sys.exit(0)
@@ -368,12 +606,12 @@ def daemonize_start():
 
     if _monitor:
         saved_daemonize_fd = _daemonize_fd
-        daemon_pid = _fork_and_wait_for_startup()
+        daemon_pid, heartbeat_fd = _fork_daemon()
         if daemon_pid > 0:
             # Running in monitor process.
             _fork_notify_startup(saved_daemonize_fd)
             _close_standard_fds()
-            _monitor_daemon(daemon_pid)
+            _monitor_daemon(daemon_pid, heartbeat_fd)
         # Running in daemon process
 
     if _pidfile:
@@ -382,8 +620,18 @@ def daemonize_start():
 
 def daemonize_complete():
     """If daemonization is configured, then this function notifies the parent
-    process that the child process has completed startup successfully."""
+    process that the child process has completed startup successfully.  With
+    --monitor, this is also when the monitor starts expecting heartbeats, so a
+    daemon should call it as soon as it is ready to serve.  Calling it again
+    has no effect."""
+    global _daemonize_fd
+
     _fork_notify_startup(_daemonize_fd)
+    _daemonize_fd = None
+
+    died = _restart_stats.pop("died", None)
+    if died is not None:
+        _restart_stats["latency"] = ovs.timeval.msec() - died
 
     if _detach:
         if _chdir:
@@ -514,6 +762,17 @@ def add_args(parser):
             help="Create pidfile (default %s)." % pidfile)
     group.add_argument("--overwrite-pidfile", action="store_true",
             help="With --pidfile, start even if already running.")
+    group.add_argument("--monitor-backoff", metavar="MSEC", type=int,
+            help="With --monitor, wait at least MSEC ms between restarts of "
+            "a daemon that keeps dying (default %d)." % _restart_backoff_min)
+    group.add_argument("--monitor-backoff-max", metavar="MSEC", type=int,
+            help="With --monitor, wait at most MSEC ms between restarts "
+            "(default %d)." % _restart_backoff_max)
+    group.add_argument("--monitor-restart-limit", metavar="N", type=int,
+            help="With --monitor, give up after N restarts in a row.")
+    group.add_argument("--monitor-heartbeat", metavar="MSEC", type=int,
+            help="With --monitor, restart %s if it sends no heartbeat for "
+            "MSEC ms." % ovs.util.PROGRAM_NAME)
 
 
 def handle_args(args):
@@ -536,3 +795,13 @@ def handle_args(args):
 
     if args.monitor:
         set_monitor()
+
+    if args.monitor_backoff or args.monitor_backoff_max:
+        set_monitor_backoff(args.monitor_backoff or _restart_backoff_min,
+                            args.monitor_backoff_max or _restart_backoff_max)
+
+    if args.monitor_restart_limit:
+        set_monitor_restart_limit(args.monitor_restart_limit)
+
+    if args.monitor_heartbeat:
+        set_monitor_heartbeat(args.monitor_heartbeat)
@@ -0,0 +1,206 @@
+# Copyright (c) 2013 Nicira, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parsing of "ovs-dpctl dump-flows" output.
+
+Each line of the output has the form
+
+    <match>, packets:N, bytes:N, used:T[, flags:F], actions:<actions>
+
+where <match> is a comma-separated list of keys such as "in_port(1)" or
+"ipv4(src=10.0.0.1,dst=10.0.0.2,...)".  decode_flows() turns each line into
+a Flow tuple, and to_array() turns a list of Flows into a NumPy record array
+for analysing large flow tables."""
+
+import collections
+import re
+
+Flow = collections.namedtuple('Flow', [
+    'eth_type', 'ip_proto', 'in_port', 'vlan_vid', 'eth_src', 'eth_dst',
+    'ip_src', 'ip_dst', 'tp_src', 'tp_dst', 'packets', 'bytes', 'used',
+    'ip_tos', 'vlan_pcp', 'tun_id', 'actions'])
+
+# Keys nested in "encap(...)" or "tunnel(...)" are found as if they were not
+# nested: a key's value stops at the first parenthesis.
+_key_re = re.compile(r'([a-z0-9_]+)\(([^()]*)')
+_setting_re = re.compile(r'([a-z0-9_]+)=([^,]*)')
+_stats_re = re.compile(r', packets:(\d+), bytes:(\d+), used:([^,]*)'
+                       r'(?:, flags:[^,]*)?, actions:(.*)$')
+
+
+def _parse_match(s):
+    fields = {}
+    inner = False
+    for name, value in _key_re.findall(s):
+        if name == 'encap':
+            # Keys inside an encapsulation (e.g. the IP header of a VLAN
+            # tagged packet) fill in what the outer keys did not give.
+            inner = True
+        elif '=' in value:
+            value = dict(_setting_re.findall(value))
+            if inner:
+                fields.setdefault(name, value)
+            else:
+                fields[name] = value
+        elif inner:
+            fields.setdefault(name, value)
+        else:
+            fields[name] = value
+    return fields
+
+
+# Matches a whole flow in the key order and formats that odp_flow_format()
+# uses, with or without masks, picking out only the fields that make up a
+# Flow.  Flows that it does not match are parsed by parse_flow().
+_flow_re = re.compile(
+    r'(?:skb_priority\([^)]*\),?)?'
+    r'(?:tunnel\(tun_id=(?P<tunnel_id>[^,]*)[^()]*\([^()]*\)\),?)?'
+    r'(?:tun_id\((?P<tun_id>[^)]*)\),?)?'
+    r'(?:skb_mark\([^)]*\),?)?'
+    r'(?:in_port\((?P<in_port>[^)]*)\),?)?'
+    r'(?:eth\(src=(?P<eth_src>[^,]*),dst=(?P<eth_dst>[^)]*)\),?)?'
+    r'(?:eth_type\((?P<vlan_type>[^)]*)\),'
+    r'vlan\(vid=(?P<vid>[^,]*),pcp=(?P<pcp>[^,)]*)[^)]*\),encap\()?'
+    r'(?:eth_type\((?P<eth_type>[^)]*)\),?)?'
+    r'(?:ipv4\(src=(?P<ip4_src>[^,]*),dst=(?P<ip4_dst>[^,]*),'
+    r'proto=(?P<ip4_proto>[^,]*),tos=(?P<ip4_tos>[^,]*)[^)]*\),?'
+    r'|ipv6\(src=(?P<ip6_src>[^,]*),dst=(?P<ip6_dst>[^,]*),label=[^,]*,'
+    r'proto=(?P<ip6_proto>[^,]*),tclass=(?P<ip6_tos>[^,]*)[^)]*\),?'
+    r'|arp\(sip=(?P<arp_sip>[^,]*),tip=(?P<arp_tip>[^,]*)[^)]*\),?)?'
+    r'(?:(?:tcp|udp)\(src=(?P<tp_src>[^,]*),dst=(?P<tp_dst>[^)]*)\),?'
+    r'|icmp(?:v6)?\(type=(?P<icmp_type>[^,]*),code=(?P<icmp_code>[^)]*)\),?)?'
+    r'(?:nd\([^)]*\))?'
+    r'\)?'
+    r', packets:(?P<packets>\d+), bytes:(?P<bytes>\d+), used:(?P<used>[^,]*)'
+    r'(?:, flags:[^,]*)?, actions:(?P<actions>.*)$')
+
+_empty = {}
+
+
+def _int(s, default=0):
+    # Masked values have the form "value/mask".
+    if not s:
+        return default
+    return int(s.split('/', 1)[0], 0)
+
+
+def parse_flow(line):
+    """Parses one line of "ovs-dpctl dump-flows" output.  Returns a tuple
+    (fields, packets, bytes, used, actions), or None if 'line' is not a flow.
+    'fields' maps each match key to its value, e.g. fields['in_port'] is
+    "1", or to a dict of its settings, e.g. fields['ipv4']['src'] is
+    "10.0.0.1"."""
+    i = line.find(', packets:')
+    if i < 0:
+        return None
+    m = _stats_re.match(line, i)
+    if not m:
+        return None
+    fields = _parse_match(line[:i])
+    packets, bytes, used, actions = m.groups()
+    return fields, int(packets), int(bytes), used, actions
+
+
+def decode_flow(line):
+    """Returns a Flow for one line of "ovs-dpctl dump-flows" output, or None
+    if 'line' is not a flow."""
+    m = _flow_re.match(line)
+    if m:
+        (tunnel_id, tun_id, in_port, eth_src, eth_dst, vlan_type, vid, pcp,
+         eth_type, ip4_src, ip4_dst, ip4_proto, ip4_tos, ip6_src, ip6_dst,
+         ip6_proto, ip6_tos, arp_sip, arp_tip, tp_src, tp_dst, icmp_type,
+         icmp_code, packets, bytes, used, actions) = m.groups('')
+        return Flow(vlan_type or eth_type, ip4_proto or ip6_proto,
+                    _int(in_port), _int(vid), eth_src, eth_dst,
+                    ip4_src or ip6_src, ip4_dst or ip6_dst,
+                    tp_src or arp_sip or icmp_type,
+                    tp_dst or arp_tip or icmp_code,
+                    int(packets), int(bytes), used, ip4_tos or ip6_tos,
+                    _int(pcp), tun_id or tunnel_id, actions)
+
+    flow = parse_flow(line)
+    if flow is None:
+        return None
+    fields, packets, bytes, used, actions = flow
+    get = fields.get
+
+    eth = get('eth', _empty)
+    vlan = get('vlan', _empty)
+    ip = get('ipv4') or get('ipv6', _empty)
+    tp = (get('tcp') or get('udp') or get('icmp') or get('icmpv6') or
+          get('arp', _empty))
+    if 'arp' in fields and tp is fields['arp']:
+        tp_src, tp_dst = tp.get('sip', ''), tp.get('tip', '')
+    elif 'src' in tp:
+        tp_src, tp_dst = tp['src'], tp.get('dst', '')
+    else:
+        tp_src, tp_dst = tp.get('type', ''), tp.get('code', '')
+    tun_id = get('tun_id') or get('tunnel', _empty).get('tun_id', '')
+    return Flow(get('eth_type', ''), ip.get('proto', ''),
+                _int(get('in_port')), _int(vlan.get('vid')),
+                eth.get('src', ''), eth.get('dst', ''),
+                ip.get('src', ''), ip.get('dst', ''), tp_src, tp_dst,
+                packets, bytes, used,
+                ip.get('tos') or ip.get('tclass', ''),
+                _int(vlan.get('pcp')), tun_id, actions)
+
+
+def decode_flows(s):
+    """Returns a list of Flows, one for each flow in 's', the output of
+    "ovs-dpctl dump-flows"."""
+    flows = []
+    for line in s.split('\n'):
+        flow = decode_flow(line)
+        if flow is not None:
+            flows.append(flow)
+    return flows
+
+
+def _mac_to_int(s):
+    s = s.split('/', 1)[0]
+    if not s:
+        return 0
+    return int(s.replace(':', ''), 16)
+
+
+def _used_to_seconds(s):
+    # "never" becomes -1.
+    if s.endswith('s'):
+        return float(s[:-1])
+    return -1.0
+
+
+def to_array(flows):
+    """Returns a NumPy record array with one record for each Flow in 'flows'.
+    Ports, VLANs and counters are integers, MAC addresses are 48-bit
+    integers and "used" is in seconds, with -1 for flows never used.  The
+    remaining columns are strings.  Requires NumPy."""
+    import numpy
+
+    string_columns = ['eth_type', 'ip_proto', 'ip_src', 'ip_dst', 'tp_src',
+                      'tp_dst', 'ip_tos', 'tun_id', 'actions']
+    dtype = [('in_port', numpy.int32), ('vlan_vid', numpy.int16),
+             ('vlan_pcp', numpy.int8), ('eth_src', numpy.uint64),
+             ('eth_dst', numpy.uint64), ('packets', numpy.int64),
+             ('bytes', numpy.int64), ('used', numpy.float64)]
+    for name in string_columns:
+        width = max([len(getattr(flow, name)) for flow in flows] + [1])
+        dtype.append((name, 'S%d' % width))
+
+    return numpy.array([(flow.in_port, flow.vlan_vid, flow.vlan_pcp,
+                         _mac_to_int(flow.eth_src), _mac_to_int(flow.eth_dst),
+                         flow.packets, flow.bytes, _used_to_seconds(flow.used))
+                        + tuple(getattr(flow, name)
+                                for name in string_columns)
+                        for flow in flows], dtype=dtype)
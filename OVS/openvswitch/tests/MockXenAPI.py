@@ -33,6 +33,11 @@ class XenAPI(object):
         self.pool = Pool()
         self.VIF = VIF()
         self.VM = VM()
+        self.host = RefTable([])
+        self.PIF = RefTable([])
+        self.VLAN = RefTable([])
+        self.Bond = RefTable([])
+        self.tunnel = RefTable([])
 
     def login_with_password(self, unused_username, unused_password):
         pass
@@ -73,15 +78,45 @@ class Table(object):
     def get_record(self, record_ref):
         return record_ref.attrs
 
+    def get_all_records(self):
+        return dict((ref(rec), rec) for rec in self.records)
+
+
+def ref(rec):
+    return "OpaqueRef:%s" % rec["uuid"]
+
+
+class RefTable(Table):
+    """A table whose records are referred to by "OpaqueRef:<uuid>" strings,
+    as in the real XenAPI, so that records can refer to each other.  Tests
+    fill in 'records' themselves."""
+
+    def get_all(self):
+        return [ref(rec) for rec in self.records]
+
+    def get_by_uuid(self, uuid):
+        recs = [rec for rec in self.records if rec["uuid"] == uuid]
+        if len(recs) != 1:
+            raise Failure("No record with UUID %s" % uuid)
+        return ref(recs[0])
+
+    def get_record(self, record_ref):
+        for rec in self.records:
+            if ref(rec) == record_ref:
+                return rec
+        raise Failure("No record with reference %s" % record_ref)
+
 
 class Network(Table):
     __records = ({"uuid": "9b66c68b-a74e-4d34-89a5-20a8ab352d1e",
                   "bridge": "xenbr0",
+                  "PIFs": [],
                   "other_config":
                       {"vswitch-controller-fail-mode": "secure",
                        "nicira-bridge-id": "custom bridge ID"}},
                  {"uuid": "e1c9019d-375b-45ac-a441-0255dd2247de",
                   "bridge": "xenbr1",
+                  "PIFs": [],
                   "other_config":
                       {"vswitch-disable-in-band": "true"}})
 
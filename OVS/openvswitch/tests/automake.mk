@@ -14,6 +14,7 @@ TESTSUITE_AT = \
 	tests/check-structs.at \
 	tests/daemon.at \
 	tests/daemon-py.at \
+	tests/dpflows-py.at \
 	tests/ofp-actions.at \
 	tests/ofp-print.at \
 	tests/ofp-util.at \
@@ -337,6 +338,7 @@ tests_test_byte_order_LDADD = lib/libopenvswitch.a
 CHECK_PYFILES = \
 	tests/appctl.py \
 	tests/test-daemon.py \
+	tests/test-dpflows.py \
 	tests/test-json.py \
 	tests/test-jsonrpc.py \
 	tests/test-ovsdb.py \
@@ -344,7 +346,9 @@ CHECK_PYFILES = \
 	tests/MockXenAPI.py \
 	tests/test-unix-socket.py \
 	tests/test-unixctl.py \
-	tests/test-vlog.py
+	tests/test-vlog.py \
+	tests/test-vswitch-transact.py \
+	tests/test-xapi-cache.py
 EXTRA_DIST += $(CHECK_PYFILES)
 PYCOV_CLEAN_FILES += $(CHECK_PYFILES:.py=.py,cover) .coverage
 
@@ -20,23 +20,35 @@ import time
 
 import ovs.daemon
 import ovs.util
+import ovs.vlog
+
+
+hung = False
 
 
 def handler(signum, _):
     raise Exception("Signal handler called with %d" % signum)
 
 
+def hang_handler(signum, _):
+    global hung
+    hung = True
+
+
 def main():
 
     signal.signal(signal.SIGHUP, handler)
+    signal.signal(signal.SIGUSR1, hang_handler)
 
     parser = argparse.ArgumentParser(
             description="Open vSwitch daemonization test program for Python.")
     parser.add_argument("-b", "--bail", action="store_true",
             help="Exit with an error after daemonize_start().")
 
+    ovs.vlog.add_args(parser)
     ovs.daemon.add_args(parser)
     args = parser.parse_args()
+    ovs.vlog.handle_args(args)
     ovs.daemon.handle_args(args)
 
     ovs.daemon.daemonize_start()
@@ -47,6 +59,8 @@ def main():
     ovs.daemon.daemonize_complete()
 
     while True:
+        if not hung:
+            ovs.daemon.heartbeat()
         time.sleep(1)
 
 
@@ -0,0 +1,80 @@
+# Copyright (c) 2014 Nicira, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import sys
+
+import ovs.dpflows
+
+
+def decode_slow(line):
+    """Decodes 'line' with the generic parser that decode_flow() falls back
+    to for lines that its regular expression does not match."""
+    flow_re = ovs.dpflows._flow_re
+    ovs.dpflows._flow_re = re.compile(r'(?!)')
+    try:
+        return ovs.dpflows.decode_flow(line)
+    finally:
+        ovs.dpflows._flow_re = flow_re
+
+
+def format_flow(flow):
+    return ' '.join('%s=%r' % (name, value)
+                    for name, value in zip(flow._fields, flow)
+                    if value not in ('', 0))
+
+
+def do_decode():
+    """Decodes each line on stdin, printing whether the fast path decoded it
+    and the fields of the resulting Flow.  Fails if the generic parser
+    decodes the line differently."""
+    status = 0
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        flow = ovs.dpflows.decode_flow(line)
+        slow = decode_slow(line)
+        if flow is None:
+            print "not a flow"
+        else:
+            if ovs.dpflows._flow_re.match(line):
+                path = "fast"
+            else:
+                path = "slow"
+            print "%s: %s" % (path, format_flow(flow))
+        if flow != slow:
+            sys.stderr.write("generic parser differs: %s\n"
+                             % (slow and format_flow(slow)))
+            status = 1
+    sys.exit(status)
+
+
+def do_to_array():
+    """Converts the flows on stdin to an array and prints its records."""
+    array = ovs.dpflows.to_array(ovs.dpflows.decode_flows(sys.stdin.read()))
+    print "%d records" % len(array)
+    for record in array:
+        print ' '.join('%s=%r' % (name, record[name])
+                       for name in array.dtype.names)
+
+
+def main():
+    commands = {"decode": do_decode, "to-array": do_to_array}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.stderr.write("usage: %s decode|to-array < FLOWS\n" % sys.argv[0])
+        sys.exit(1)
+    commands[sys.argv[1]]()
+
+
+if __name__ == "__main__":
+    main()
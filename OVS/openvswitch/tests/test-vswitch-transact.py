@@ -0,0 +1,96 @@
+# Copyright (c) 2014 Nicira, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Applies ovs-vsctl arguments through the OVSDB transactions of
+# InterfaceReconfigureVswitch.py, and dumps the bridges, ports and
+# interfaces of a database in a form that does not depend on row UUIDs, so
+# that the result can be compared with that of ovs-vsctl.  Expects
+# InterfaceReconfigure.py, InterfaceReconfigureVswitch.py and the Open
+# vSwitch Python library to be in PYTHONPATH.
+
+import sys
+
+import ovs.db.idl
+import ovs.poller
+
+import InterfaceReconfigure
+import InterfaceReconfigureVswitch
+
+
+def do_transact(schema, socket, *argv):
+    InterfaceReconfigure.set_log_destination("stderr")
+    InterfaceReconfigureVswitch.OVSDB_SCHEMA = schema
+    InterfaceReconfigureVswitch.OVSDB_SOCKET = socket
+    # There is no ovs-vswitchd to wait for, as with "ovs-vsctl --no-wait".
+    InterfaceReconfigureVswitch.VswitchDB.cur_cfg = lambda self: sys.maxint
+
+    vsdb = InterfaceReconfigureVswitch.vswitch_db()
+    if not vsdb:
+        sys.stderr.write("could not connect to %s\n" % socket)
+        sys.exit(1)
+    try:
+        vsdb.transact(list(argv))
+    except InterfaceReconfigure.Error, e:
+        sys.stderr.write("%s\n" % e.msg)
+        sys.exit(1)
+
+
+def format_value(value):
+    if isinstance(value, ovs.db.idl.Row):
+        return value.name
+    elif isinstance(value, list):
+        return "[%s]" % ", ".join(sorted(format_value(v) for v in value))
+    elif isinstance(value, dict):
+        return "{%s}" % ", ".join(sorted("%s=%s" % (format_value(k),
+                                                    format_value(v))
+                                         for k, v in value.items()))
+    return str(value).lower()
+
+
+def do_dump(schema, socket):
+    helper = ovs.db.idl.SchemaHelper(location=schema)
+    for table in ["Bridge", "Port", "Interface"]:
+        helper.register_table(table)
+    idl = ovs.db.idl.Idl("unix:" + socket, helper)
+    while not idl.change_seqno:
+        idl.run()
+        poller = ovs.poller.Poller()
+        idl.wait(poller)
+        poller.block()
+
+    for name in ["Bridge", "Port", "Interface"]:
+        table = idl.tables[name]
+        for row in sorted(table.rows.values(), key=lambda row: row.name):
+            print "%s %s" % (name, row.name)
+            for column in sorted(table.columns):
+                value = getattr(row, column)
+                if column != "name" and value not in ([], {}, "", False):
+                    print "    %s=%s" % (column, format_value(value))
+    idl.close()
+
+
+def main():
+    commands = {"transact": (do_transact, 2),
+                "dump": (do_dump, 2)}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands \
+            or len(sys.argv) < commands[sys.argv[1]][1] + 2:
+        sys.stderr.write("usage: %s transact SCHEMA SOCKET ARG...\n"
+                         "       %s dump SCHEMA SOCKET\n"
+                         % (sys.argv[0], sys.argv[0]))
+        sys.exit(1)
+    commands[sys.argv[1]][0](*sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
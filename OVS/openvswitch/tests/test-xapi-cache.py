@@ -0,0 +1,216 @@
+# Copyright (c) 2014 Nicira, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Checks and benchmarks DatabaseCache lookups in InterfaceReconfigure.py
+# against a pool of generated PIFs, VLANs and networks served by
+# MockXenAPI.  Expects InterfaceReconfigure.py and MockXenAPI.py (as
+# XenAPI.py) to be in PYTHONPATH.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import XenAPI
+import InterfaceReconfigure
+from InterfaceReconfigure import DatabaseCache
+
+HOST_UUID = "852ee692-71b4-439e-abfb-0eba72dc85f0"
+OTHER_HOST_UUID = "44e6b66e-3074-4a3c-bbcd-756d845a3b56"
+
+
+def uuid(kind, i):
+    return "%08x-0000-0000-0000-%012x" % (kind, i)
+
+
+def pif(i, host, device, network, vlan="-1"):
+    return {"uuid": uuid(1, i), "host": XenAPI.ref({"uuid": host}),
+            "management": i == 0, "network": network, "device": device,
+            "bond_master_of": [], "bond_slave_of": "OpaqueRef:NULL",
+            "VLAN": vlan, "VLAN_master_of": "OpaqueRef:NULL",
+            "VLAN_slave_of": [], "tunnel_access_PIF_of": [],
+            "tunnel_transport_PIF_of": [], "ip_configuration_mode": "None",
+            "IP": "", "netmask": "", "gateway": "", "DNS": "",
+            "MAC": "00:16:3e:00:%02x:%02x" % (i / 256 % 256, i % 256),
+            "other_config": {}, "currently_attached": True}
+
+
+def network(i, bridge):
+    return {"uuid": uuid(2, i), "bridge": bridge, "MTU": "1500",
+            "PIFs": [], "other_config": {}}
+
+
+def make_session(n_devices, n_vlans):
+    """Returns a mock session with 'n_devices' physical PIFs on this host,
+    each carrying 'n_vlans' VLANs, plus the same on another host."""
+    session = XenAPI.xapi_local()
+    xenapi = session.xenapi
+    xenapi.host.records = [{"uuid": HOST_UUID}, {"uuid": OTHER_HOST_UUID}]
+    xenapi.pool = XenAPI.RefTable(xenapi.pool.records)
+
+    pifs = []
+    vlans = []
+    networks = []
+    for h, host in enumerate([HOST_UUID, OTHER_HOST_UUID]):
+        for d in range(n_devices):
+            device = "eth%d" % d
+            net = network(len(networks), "xenbr%d" % d)
+            if h == 0:
+                networks.append(net)
+            else:
+                net = networks[d]
+            phys = pif(len(pifs), host, device, XenAPI.ref(net))
+            pifs.append(phys)
+            net["PIFs"].append(XenAPI.ref(phys))
+
+            for v in range(n_vlans):
+                i = d * n_vlans + v
+                if h == 0:
+                    net = network(len(networks), "xapi%d" % i)
+                    networks.append(net)
+                else:
+                    net = networks[n_devices + i]
+                tagged = pif(len(pifs), host, device, XenAPI.ref(net),
+                             str(v + 1))
+                pifs.append(tagged)
+                net["PIFs"].append(XenAPI.ref(tagged))
+                vlan = {"uuid": uuid(3, len(vlans)),
+                        "tagged_PIF": XenAPI.ref(phys),
+                        "untagged_PIF": XenAPI.ref(tagged)}
+                vlans.append(vlan)
+                tagged["VLAN_master_of"] = XenAPI.ref(vlan)
+                phys["VLAN_slave_of"].append(XenAPI.ref(vlan))
+
+    xenapi.PIF.records = pifs
+    xenapi.VLAN.records = vlans
+    xenapi.network.records = networks
+    return session
+
+
+def load_caches(root, session):
+    """Returns a DatabaseCache loaded from 'session', another one parsed
+    from the XML cache file saved by the first one, and a third one loaded
+    from the snapshot of that file, checking that the last two match."""
+    XenAPI.xapi_local = lambda: session
+    from_xapi = DatabaseCache(session_ref="OpaqueRef:session")
+    from_xapi.save(os.path.join(root, "network.dbcache"))
+
+    # Without a snapshot, the XML is parsed and the snapshot written again.
+    snapshot = os.path.join(root, "network.dbcache.snapshot")
+    os.remove(snapshot)
+    from_xml = DatabaseCache(cache_file="/network.dbcache")
+    assert os.path.exists(snapshot)
+
+    # Make sure that the snapshot is used rather than the XML.
+    def parse_xml(self, data):
+        assert False, "snapshot not used"
+    parse = DatabaseCache._DatabaseCache__parse_xml
+    DatabaseCache._DatabaseCache__parse_xml = parse_xml
+    try:
+        from_snapshot = DatabaseCache(cache_file="/network.dbcache")
+    finally:
+        DatabaseCache._DatabaseCache__parse_xml = parse
+
+    assert from_xml._DatabaseCache__get_tables() \
+        == from_snapshot._DatabaseCache__get_tables()
+    return from_xapi, from_xml, from_snapshot
+
+
+def check(cache):
+    pifs = cache.get_all_pifs()
+    devices = set()
+    for ref, rec in pifs.items():
+        assert cache.get_pif_by_uuid(rec["uuid"]) == ref
+        devices.add(rec["device"])
+    for device in devices:
+        expected = [ref for ref, rec in pifs.items()
+                    if rec["device"] == device]
+        assert sorted(cache.get_pifs_by_device(device)) == sorted(expected)
+    assert cache.get_pifs_by_device("nonexistent") == []
+
+    try:
+        cache.get_pif_by_uuid("nonexistent")
+        assert False
+    except InterfaceReconfigure.Error:
+        pass
+
+    for ref, rec in pifs.items():
+        network = cache.get_network_record(rec["network"])
+        assert cache.get_networks_with_bridge(network["bridge"]) \
+            == [rec["network"]]
+        assert cache.get_pif_by_bridge(network["bridge"]) == ref
+    assert cache.get_networks_with_bridge("nonexistent") == []
+
+
+def benchmark(cache, n_lookups):
+    pifs = cache.get_all_pifs().values()
+    bridges = [cache.get_network_record(rec["network"])["bridge"]
+               for rec in pifs]
+
+    for name, func, keys in (
+            ("get_pif_by_uuid", cache.get_pif_by_uuid,
+             [rec["uuid"] for rec in pifs]),
+            ("get_pifs_by_device", cache.get_pifs_by_device,
+             [rec["device"] for rec in pifs]),
+            ("get_pif_by_bridge", cache.get_pif_by_bridge, bridges)):
+        start = time.time()
+        for i in range(n_lookups):
+            func(keys[i % len(keys)])
+        elapsed = time.time() - start
+        print "%-20s %d lookups in %.3f s (%.1f us/lookup)" % (
+            name, n_lookups, elapsed, elapsed * 1e6 / n_lookups)
+
+
+def usage():
+    sys.stderr.write("usage: %s check|benchmark N_DEVICES N_VLANS "
+                     "[N_LOOKUPS]\n" % sys.argv[0])
+    sys.exit(1)
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("check", "benchmark"):
+        usage()
+    n_devices = int(sys.argv[2])
+    n_vlans = int(sys.argv[3])
+    n_lookups = 100000
+    if len(sys.argv) > 4:
+        n_lookups = int(sys.argv[4])
+
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, "etc"))
+        f = open(os.path.join(root, "etc", "xensource-inventory"), "w")
+        f.write("INSTALLATION_UUID='%s'\n" % HOST_UUID)
+        f.close()
+        InterfaceReconfigure.set_root_prefix(root)
+        InterfaceReconfigure.set_log_destination("stderr")
+
+        start = time.time()
+        caches = load_caches(root, make_session(n_devices, n_vlans))
+        load_time = time.time() - start
+
+        for cache in caches:
+            if sys.argv[1] == "check":
+                check(cache)
+            else:
+                print "%d PIFs, loaded and saved in %.3f s" % (
+                    len(cache.get_all_pifs()), load_time)
+                benchmark(cache, n_lookups)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
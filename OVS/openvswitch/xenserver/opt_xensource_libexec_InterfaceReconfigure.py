@@ -13,9 +13,25 @@
 import sys
 import syslog
 import os
+import marshal
+from cStringIO import StringIO
 
+from xml.dom import Node
 from xml.dom.minidom import getDOMImplementation
-from xml.dom.minidom import parse as parseXML
+from xml.dom.minidom import parseString as parseXMLString
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    try:
+        import cElementTree as ElementTree
+    except ImportError:
+        ElementTree = None
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 
 the_root_prefix = ""
 def root_prefix():
@@ -354,6 +370,106 @@ _POOL_ATTRS = { 'other_config': (lambda x, p, t, v: _otherconfig_to_xml(x, p, v,
                                  lambda n: _otherconfig_from_xml(n, _POOL_OTHERCONFIG_ATTRS)),
               }
 
+# The tables of the database cache, each with its XML tag and attributes,
+# and the other-config attributes that are kept for its records.
+_CACHE_TABLES = [ ('pifs', _PIF_XML_TAG, _PIF_ATTRS, _PIF_OTHERCONFIG_ATTRS),
+                  ('bonds', _BOND_XML_TAG, _BOND_ATTRS, []),
+                  ('vlans', _VLAN_XML_TAG, _VLAN_ATTRS, []),
+                  ('tunnels', _TUNNEL_XML_TAG, _TUNNEL_ATTRS, []),
+                  ('networks', _NETWORK_XML_TAG, _NETWORK_ATTRS,
+                   _NETWORK_OTHERCONFIG_ATTRS),
+                  ('pools', _POOL_XML_TAG, _POOL_ATTRS, _POOL_OTHERCONFIG_ATTRS),
+                ]
+
+def _cache_record(rec, oc_attrs):
+    """Return 'rec' as it will read back from the XML cache."""
+    ret = {}
+    for (n,v) in rec.items():
+        if n == 'currently_attached':
+            v = False
+        elif n == 'other_config':
+            v = dict([(k, x.strip()) for (k,x) in v.items() if k in oc_attrs])
+        elif isinstance(v, basestring):
+            v = v.strip()
+        elif isinstance(v, list):
+            v = [x.strip() for x in v]
+        ret[n] = v
+    return ret
+
+class _ElementNode(object):
+    """Presents an ElementTree element through the part of the minidom
+    interface that the _*_from_xml() functions use.  Text is unicode, as
+    minidom would return it."""
+    TEXT_NODE = Node.TEXT_NODE
+    nodeType = Node.ELEMENT_NODE
+
+    def __init__(self, e):
+        self.nodeName = unicode(e.tag)
+        self.childNodes = []
+        if e.text:
+            self.childNodes.append(_TextNode(e.text))
+        for c in e:
+            self.childNodes.append(_ElementNode(c))
+            if c.tail:
+                self.childNodes.append(_TextNode(c.tail))
+
+class _TextNode(object):
+    TEXT_NODE = Node.TEXT_NODE
+    nodeType = Node.TEXT_NODE
+    nodeName = "#text"
+
+    def __init__(self, data):
+        self.data = unicode(data)
+
+#
+# Snapshots of the database cache.
+#
+# Parsing the XML cache dominates the start-up time of interface-reconfigure
+# on hosts with many PIFs and networks, and at boot it is run once per PIF.
+# Next to the cache we therefore keep its decoded tables in marshal format,
+# stamped with a format version and the SHA-1 of the XML they came from.
+# The XML is only parsed again when its digest changes.
+#
+# Each table is kept as a list of (ref, record) pairs in document order, so
+# that the dictionaries built from a snapshot iterate in the same order as
+# ones built from the XML.
+#
+
+_SNAPSHOT_SUFFIX = ".snapshot"
+_SNAPSHOT_MAGIC = "xenserver-network-configuration snapshot"
+_SNAPSHOT_VERSION = 1
+
+def _read_snapshot(cache_file, digest):
+    """Return the tables of the snapshot of 'cache_file' if there is one
+    for the XML with SHA-1 'digest', otherwise None."""
+    try:
+        f = open(cache_file + _SNAPSHOT_SUFFIX, "rb")
+        try:
+            (header, snapshot_digest, tables) = marshal.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if header != (_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, marshal.version) \
+           or snapshot_digest != digest:
+        return None
+    return tables
+
+def _write_snapshot(cache_file, digest, tables):
+    snapshot_file = cache_file + _SNAPSHOT_SUFFIX
+    temp_file = snapshot_file + ".%d" % os.getpid()
+    try:
+        f = open(temp_file, "wb")
+        try:
+            f.write(marshal.dumps(((_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                    marshal.version), digest, tables)))
+        finally:
+            f.close()
+        os.rename(temp_file, snapshot_file)
+    except (IOError, OSError, ValueError), e:
+        log("Failed to write snapshot of %s: %s" % (cache_file, e))
+
 #
 # Database Cache object
 #
@@ -476,9 +592,8 @@ class DatabaseCache(object):
                 h(xml, e, n, v)
             else:
                 raise Error("Unknown attribute %s" % n)
-    def __from_xml(self, e, attrs):
+    def __from_xml(self, ref, e, attrs):
         """Decode a database object from XML"""
-        ref = e.attributes['ref'].value
         rec = {}
         for n in e.childNodes:
             if n.nodeName in attrs:
@@ -486,6 +601,82 @@ class DatabaseCache(object):
                 rec[n.nodeName] = h(n)
         return (ref,rec)
 
+    def __build_indexes(self):
+        """Index PIFs by uuid and device, and networks by bridge, so that
+        lookups do not need to scan all records.  Each index maps a key
+        to the list of matching references."""
+        self.__pifs_by_uuid = {}
+        self.__pifs_by_device = {}
+        for (ref,rec) in self.__pifs.items():
+            self.__pifs_by_uuid.setdefault(rec['uuid'], []).append(ref)
+            self.__pifs_by_device.setdefault(rec['device'], []).append(ref)
+
+        self.__networks_by_bridge = {}
+        for (ref,rec) in self.__networks.items():
+            self.__networks_by_bridge.setdefault(rec['bridge'], []).append(ref)
+
+    def __get_tables(self):
+        return { 'pifs': self.__pifs, 'bonds': self.__bonds,
+                 'vlans': self.__vlans, 'tunnels': self.__tunnels,
+                 'networks': self.__networks, 'pools': self.__pools }
+
+    def __set_tables(self, tables):
+        self.__pifs = dict(tables['pifs'])
+        self.__bonds = dict(tables['bonds'])
+        self.__vlans = dict(tables['vlans'])
+        self.__tunnels = dict(tables['tunnels'])
+        self.__networks = dict(tables['networks'])
+        self.__pools = dict(tables['pools'])
+
+    def __parse_xml(self, data):
+        """Decode the XML cache in 'data' into tables of (ref, record)
+        pairs, streaming through it one record at a time if ElementTree is
+        available."""
+        tables = {}
+        tags = {}
+        for (name, tag, attrs, _) in _CACHE_TABLES:
+            tables[name] = []
+            tags[tag] = (name, attrs)
+
+        if ElementTree is None:
+            xml = parseXMLString(data)
+
+            assert(len(xml.childNodes) == 1)
+            toplevel = xml.childNodes[0]
+
+            assert(toplevel.nodeName == "xenserver-network-configuration")
+
+            for n in toplevel.childNodes:
+                if n.nodeName == "#text":
+                    pass
+                elif tags.has_key(n.nodeName):
+                    (name, attrs) = tags[n.nodeName]
+                    tables[name].append(self.__from_xml(
+                        n.attributes['ref'].value, n, attrs))
+                else:
+                    raise Error("Unknown XML element %s" % n.nodeName)
+            return tables
+
+        depth = 0
+        for (event, e) in ElementTree.iterparse(StringIO(data),
+                                                ('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    assert(e.tag == "xenserver-network-configuration")
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+            if not tags.has_key(e.tag):
+                raise Error("Unknown XML element %s" % e.tag)
+            (name, attrs) = tags[e.tag]
+            tables[name].append(self.__from_xml(unicode(e.get('ref')),
+                                                _ElementNode(e), attrs))
+            e.clear()
+        return tables
+
     def __init__(self, session_ref=None, cache_file=None):
         if session_ref and cache_file:
             raise Error("can't specify session reference and cache file")
@@ -519,45 +710,41 @@ class DatabaseCache(object):
         else:
             log("Loading xapi database cache from %s" % cache_file)
 
-            xml = parseXML(root_prefix() + cache_file)
+            cache_file = root_prefix() + cache_file
+            f = open(cache_file, "r")
+            data = f.read()
+            f.close()
 
-            self.__pifs = {}
-            self.__bonds = {}
-            self.__vlans = {}
-            self.__pools = {}
-            self.__tunnels = {}
-            self.__networks = {}
+            digest = sha1(data).hexdigest()
+            tables = _read_snapshot(cache_file, digest)
+            if tables is None:
+                tables = self.__parse_xml(data)
+                _write_snapshot(cache_file, digest, tables)
+            self.__set_tables(tables)
 
-            assert(len(xml.childNodes) == 1)
-            toplevel = xml.childNodes[0]
-
-            assert(toplevel.nodeName == "xenserver-network-configuration")
-
-            for n in toplevel.childNodes:
-                if n.nodeName == "#text":
-                    pass
-                elif n.nodeName == _PIF_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _PIF_ATTRS)
-                    self.__pifs[ref] = rec
-                elif n.nodeName == _BOND_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _BOND_ATTRS)
-                    self.__bonds[ref] = rec
-                elif n.nodeName == _VLAN_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _VLAN_ATTRS)
-                    self.__vlans[ref] = rec
-                elif n.nodeName == _TUNNEL_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _TUNNEL_ATTRS)
-                    self.__vlans[ref] = rec
-                elif n.nodeName == _NETWORK_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _NETWORK_ATTRS)
-                    self.__networks[ref] = rec
-                elif n.nodeName == _POOL_XML_TAG:
-                    (ref,rec) = self.__from_xml(n, _POOL_ATTRS)
-                    self.__pools[ref] = rec
-                else:
-                    raise Error("Unknown XML element %s" % n.nodeName)
+        self.__build_indexes()
 
     def save(self, cache_file):
+        # Leave the cache alone if it would read back the same.
+        tables = self.__get_tables()
+        for (name, _, _, oc_attrs) in _CACHE_TABLES:
+            tables[name] = [(ref, _cache_record(rec, oc_attrs))
+                            for (ref,rec) in tables[name].items()]
+        try:
+            f = open(cache_file, "r")
+            try:
+                digest = sha1(f.read()).hexdigest()
+            finally:
+                f.close()
+            cached = _read_snapshot(cache_file, digest)
+        except IOError:
+            cached = None
+        if cached is not None:
+            for (name, _, _, _) in _CACHE_TABLES:
+                if dict(cached[name]) != dict(tables[name]):
+                    break
+            else:
+                return
 
         xml = getDOMImplementation().createDocument(
             None, "xenserver-network-configuration", None)
@@ -575,16 +762,17 @@ class DatabaseCache(object):
         for (ref,rec) in self.__pools.items():
             self.__to_xml(xml, xml.documentElement, _POOL_XML_TAG, ref, rec, _POOL_ATTRS)
 
+        data = xml.toprettyxml()
         temp_file = cache_file + ".%d" % os.getpid()
         f = open(temp_file, 'w')
-        f.write(xml.toprettyxml())
+        f.write(data)
         f.close()
         os.rename(temp_file, cache_file)
 
+        _write_snapshot(cache_file, sha1(data).hexdigest(), tables)
+
     def get_pif_by_uuid(self, uuid):
-        pifs = map(lambda (ref,rec): ref,
-                  filter(lambda (ref,rec): uuid == rec['uuid'],
-                         self.__pifs.items()))
+        pifs = self.__pifs_by_uuid.get(uuid, [])
         if len(pifs) == 0:
             raise Error("Unknown PIF \"%s\"" % uuid)
         elif len(pifs) > 1:
@@ -593,14 +781,10 @@ class DatabaseCache(object):
         return pifs[0]
 
     def get_pifs_by_device(self, device):
-        return map(lambda (ref,rec): ref,
-                   filter(lambda (ref,rec): rec['device'] == device,
-                          self.__pifs.items()))
+        return list(self.__pifs_by_device.get(device, []))
 
     def get_networks_with_bridge(self, bridge):
-        return map(lambda (ref,rec): ref,
-                  filter(lambda (ref,rec): rec['bridge'] == bridge,
-                         self.__networks.items()))
+        return list(self.__networks_by_bridge.get(bridge, []))
 
     def get_network_by_bridge(self, bridge):
         #Assumes one network has bridge.
@@ -12,9 +12,14 @@
 # GNU Lesser General Public License for more details.
 #
 from InterfaceReconfigure import *
+import fcntl
 import os
 import re
+import socket
+import struct
 import subprocess
+import sys
+import time
 
 #
 # Bare Network Devices -- network devices without IP configuration
@@ -25,19 +30,61 @@ def netdev_down(netdev):
     if not netdev_exists(netdev):
         log("netdev: down: device %s does not exist, ignoring" % netdev)
         return
-    run_command(["/sbin/ifconfig", netdev, 'down'])
+    if root_prefix() or not netdev_set(netdev, False):
+        run_command(["/sbin/ifconfig", netdev, 'down'])
 
 def netdev_up(netdev, mtu=None):
     """Bring up a bare network device"""
     if not netdev_exists(netdev):
         raise Error("netdev: up: device %s does not exist" % netdev)
 
+    if root_prefix() or not netdev_set(netdev, True, mtu):
+        if mtu:
+            mtu = ["mtu", mtu]
+        else:
+            mtu = []
+
+        run_command(["/sbin/ifconfig", netdev, 'up'] + mtu)
+
+# netdev_up() and netdev_down() set the device flags directly rather than
+# spawning ifconfig for every device, except when testing with a root prefix,
+# where the utilities are fakes that log their arguments.
+#
+# From <linux/sockios.h> and <linux/if.h>.
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+SIOCSIFMTU = 0x8922
+IFF_UP = 0x1
+
+def netdev_set(netdev, up, mtu=None):
+    """Set 'netdev' up or down, and its MTU to 'mtu' if given, with the
+    same ioctls that ifconfig uses but without running it.  Returns False
+    if that failed, so that the caller can fall back to ifconfig."""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if mtu:
+                fcntl.ioctl(s, SIOCSIFMTU,
+                            struct.pack("16si20x", netdev, int(mtu)))
+            ifr = fcntl.ioctl(s, SIOCGIFFLAGS,
+                              struct.pack("16sH22x", netdev, 0))
+            flags = struct.unpack("16sH22x", ifr)[1]
+            if up:
+                flags |= IFF_UP
+            else:
+                flags &= ~IFF_UP
+            fcntl.ioctl(s, SIOCSIFFLAGS, struct.pack("16sH22x", netdev, flags))
+        finally:
+            s.close()
+    except (IOError, socket.error, ValueError), e:
+        log("netdev: could not set %s %s (%s)" % (netdev, up and "up" or "down", e))
+        return False
+
     if mtu:
-        mtu = ["mtu", mtu]
+        log("netdev: %s up mtu %s" % (netdev, mtu))
     else:
-        mtu = []
-
-    run_command(["/sbin/ifconfig", netdev, 'up'] + mtu)
+        log("netdev: %s %s" % (netdev, up and "up" or "down"))
+    return True
 
 # This is a list of drivers that do support VLAN tx or rx acceleration, but
 # to which the VLAN bug workaround should not be applied.  This could be
@@ -267,11 +314,567 @@ def datapath_deconfigure_bond(netdev):
 def datapath_deconfigure_ipdev(interface):
     return ['--', '--with-iface', '--if-exists', 'del-port', interface]
 
+#
+# Applying vsctl commands through the OVSDB IDL.
+#
+# Every ovs-vsctl run forks a process that connects to ovsdb-server, fetches
+# the database and waits for ovs-vswitchd to reconfigure.  When the Open
+# vSwitch Python library is installed, the commands passed to
+# datapath_modify_config() are instead applied as a single transaction over
+# a connection that is kept open for the rest of the run.  Only the commands
+# and options that this file generates are understood here; anything else
+# falls back to ovs-vsctl, as does testing with a root prefix.
+#
+
+OVSDB_SOCKET = "/var/run/openvswitch/db.sock"
+OVSDB_SCHEMA = "/usr/share/openvswitch/vswitch.ovsschema"
+OVSDB_TIMEOUT = 20
+OVS_PYTHON_DIR = "/usr/share/openvswitch/python"
+
+ovs = None
+_vswitch_db = None
+
+class VsctlUnsupported(Exception):
+    pass
+
+def vsctl_parse(argv):
+    """Split an ovs-vsctl argument list into (options, command, args)
+    tuples, dropping comments."""
+    commands = []
+    current = []
+    for arg in [a for a in argv if not a.startswith('#')] + ['--']:
+        if arg != '--':
+            current.append(arg)
+            continue
+        if not current:
+            continue
+
+        i = 0
+        while i < len(current) and current[i].startswith('--'):
+            i += 1
+        if i == len(current):
+            raise VsctlUnsupported("global options %s" % current)
+        commands.append((current[:i], current[i], current[i + 1:]))
+        current = []
+    return commands
+
+def vsctl_unquote(s):
+    """Parse an ovsdb string that may have been quoted by vsctl_escape()."""
+    if not s.startswith('"'):
+        return s
+    if len(s) < 2 or not s.endswith('"'):
+        raise Error("%s: unterminated quoted string" % s)
+    return s[1:-1].decode('string_escape')
+
+def vsctl_parse_column(arg):
+    """Parse COLUMN[:KEY][=VALUE] into a tuple, with None for the parts that
+    are missing."""
+    m = re.match(r'([^:=]+)(?::("(?:[^"\\]|\\.)*"|[^=]*))?(?:=(.*))?$', arg)
+    if not m:
+        raise Error("%s: argument does not end in \"=\" followed by a value"
+                    % arg)
+    column, key, value = m.groups()
+    if key is not None:
+        key = vsctl_unquote(key)
+    if value is not None:
+        value = vsctl_unquote(value)
+    return column, key, value
+
+class VsctlContext(object):
+    """Executes parsed ovs-vsctl commands within an IDL transaction."""
+
+    def __init__(self, idl, txn):
+        self.idl = idl
+        self.txn = txn
+
+        rows = idl.tables["Open_vSwitch"].rows.values()
+        if not rows:
+            raise Error("database has no Open_vSwitch record")
+        self.ovs = rows[0]
+
+        # Maps each command to its function, its options and the minimum and
+        # maximum number of arguments.
+        self.commands = {
+            'add-br':   (self.add_br, ['--may-exist'], 1, 3),
+            'del-br':   (self.del_br, ['--if-exists'], 1, 1),
+            'add-port': (self.add_port, ['--may-exist'], 2, 2),
+            'add-bond': (self.add_bond, ['--may-exist', '--fake-iface'],
+                         4, sys.maxint),
+            'del-port': (self.del_port, ['--if-exists', '--with-iface'], 1, 2),
+            'set':      (self.set, [], 3, sys.maxint),
+            'remove':   (self.remove, [], 4, sys.maxint),
+            'br-set-external-id': (self.br_set_external_id, [], 2, 3),
+            }
+
+    def run(self, options, command, args):
+        if command not in self.commands:
+            raise VsctlUnsupported("command %s" % command)
+        function, allowed, min_args, max_args = self.commands[command]
+        for option in options:
+            if option not in allowed:
+                raise VsctlUnsupported("option %s for %s" % (option, command))
+        if len(args) < min_args or len(args) > max_args:
+            raise Error("'%s' command takes %d to %d arguments, not %d"
+                        % (command, min_args, max_args, len(args)))
+        function(options, *args)
+
+
+    #
+    # Rows inserted within the transaction only have the columns that have
+    # been written, so every read goes through here.  The IDL asserts on any
+    # access to a row deleted earlier in the transaction, which can still be
+    # in a list read before it was deleted: such a row reads as empty.  (The
+    # IDL itself leaves deleted rows out of the references it returns.)
+    #
+
+    def read(self, row, column):
+        if row._changes is not None:
+            try:
+                return getattr(row, column)
+            except AttributeError:
+                pass
+        type_ = row._table.columns[column].type
+        if type_.is_map():
+            return {}
+        elif type_.is_scalar():
+            return type_.key.type.default
+        else:
+            return []
+
+    def insert(self, table, **columns):
+        row = self.txn.insert(self.idl.tables[table])
+        for column, value in columns.items():
+            setattr(row, column, value)
+        return row
+
+    def append(self, row, column, value):
+        row.verify(column)
+        setattr(row, column, self.read(row, column) + [value])
+
+    def discard(self, row, column, values):
+        row.verify(column)
+        setattr(row, column, [v for v in self.read(row, column)
+                              if v not in values])
+
+    #
+    # The bridge, port and interface views of ovs-vsctl.  A fake bridge is a
+    # port on its parent bridge with a VLAN tag, and it owns the ports on the
+    # parent that carry the same tag.
+    #
+
+    def bridges(self):
+        """Return a list of (name, row, parent, vlan) for every bridge."""
+        bridges = []
+        for br in self.read(self.ovs, 'bridges'):
+            bridges.append((self.read(br, 'name'), br, None, 0))
+            for port in self.read(br, 'ports'):
+                tag = self.read(port, 'tag')
+                if self.read(port, 'fake_bridge') and len(tag) == 1:
+                    bridges.append((self.read(port, 'name'), port, br, tag[0]))
+        return bridges
+
+    def find_bridge(self, name, must_exist):
+        for bridge in self.bridges():
+            if bridge[0] == name:
+                return bridge
+        if must_exist:
+            raise Error("no bridge named %s" % name)
+        return None
+
+    def ports(self):
+        """Return a list of (port, real bridge row, bridge name)."""
+        fake = {}
+        for name, row, parent, vlan in self.bridges():
+            if parent:
+                fake[(parent.uuid, vlan)] = name
+
+        ports = []
+        for br in self.read(self.ovs, 'bridges'):
+            br_name = self.read(br, 'name')
+            for port in self.read(br, 'ports'):
+                tag = self.read(port, 'tag')
+                if len(tag) == 1:
+                    name = fake.get((br.uuid, tag[0]), br_name)
+                else:
+                    name = br_name
+                ports.append((port, br, name))
+        return ports
+
+    def find_port(self, name, with_iface):
+        ports = self.ports()
+        for port in ports:
+            if self.read(port[0], 'name') == name:
+                return port
+        if with_iface:
+            for port in ports:
+                for iface in self.read(port[0], 'interfaces'):
+                    if self.read(iface, 'name') == name:
+                        return port
+        return None
+
+    def check_conflicts(self, name, msg):
+        if self.find_bridge(name, False):
+            raise Error("%s because a bridge named %s already exists"
+                        % (msg, name))
+        for port, br, br_name in self.ports():
+            if self.read(port, 'name') == name:
+                raise Error("%s because a port named %s already exists on "
+                            "bridge %s" % (msg, name, br_name))
+            for iface in self.read(port, 'interfaces'):
+                if self.read(iface, 'name') == name:
+                    raise Error("%s because an interface named %s already "
+                                "exists on bridge %s" % (msg, name, br_name))
+
+    def delete_port(self, port, br):
+        for iface in self.read(port, 'interfaces'):
+            iface.delete()
+        self.discard(br, 'ports', [port])
+        port.delete()
+
+    #
+    # Commands.
+    #
+
+    def add_br(self, options, name, parent_name=None, vlan=None):
+        if parent_name is not None:
+            try:
+                vlan = int(vlan)
+                if vlan < 0 or vlan > 4095:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise Error("vlan must be between 0 and 4095 (got %s)" % vlan)
+
+        if '--may-exist' in options:
+            bridge = self.find_bridge(name, False)
+            if bridge:
+                parent = bridge[2]
+                if parent_name is None and parent:
+                    raise Error("\"--may-exist add-br %s\" but %s is a VLAN "
+                                "bridge for VLAN %d" % (name, name, bridge[3]))
+                elif parent_name is not None and not parent:
+                    raise Error("\"--may-exist add-br %s %s %d\" but %s is "
+                                "not a VLAN bridge"
+                                % (name, parent_name, vlan, name))
+                elif parent_name is not None and \
+                        self.read(parent, 'name') != parent_name:
+                    raise Error("\"--may-exist add-br %s %s %d\" but %s has "
+                                "the wrong parent %s"
+                                % (name, parent_name, vlan, name,
+                                   self.read(parent, 'name')))
+                elif parent_name is not None and bridge[3] != vlan:
+                    raise Error("\"--may-exist add-br %s %s %d\" but %s is "
+                                "a VLAN bridge for the wrong VLAN %d"
+                                % (name, parent_name, vlan, name, bridge[3]))
+                return
+
+        self.check_conflicts(name, "cannot create a bridge named %s" % name)
+
+        iface = self.insert("Interface", name=name, type="internal")
+        if parent_name is None:
+            port = self.insert("Port", name=name, interfaces=[iface])
+            br = self.insert("Bridge", name=name, ports=[port])
+            self.append(self.ovs, 'bridges', br)
+        else:
+            parent = self.find_bridge(parent_name, True)
+            if parent[2]:
+                raise Error("cannot create bridge with fake bridge as parent")
+            port = self.insert("Port", name=name, interfaces=[iface],
+                               fake_bridge=True, tag=[vlan])
+            self.append(parent[1], 'ports', port)
+
+    def del_br(self, options, name):
+        bridge = self.find_bridge(name, '--if-exists' not in options)
+        if not bridge:
+            return
+
+        name, row, parent, vlan = bridge
+        if parent:
+            for port, br, br_name in self.ports():
+                if br_name == name:
+                    self.delete_port(port, br)
+        else:
+            for port in self.read(row, 'ports'):
+                self.delete_port(port, row)
+            self.discard(self.ovs, 'bridges', [row])
+            row.delete()
+
+    def add_port(self, options, br_name, name):
+        self.add_bond(options, br_name, name, name)
+
+    def add_bond(self, options, br_name, name, *iface_names):
+        if '--may-exist' in options:
+            port = self.find_port(name, False)
+            if port:
+                if port[2] != br_name:
+                    raise Error("\"--may-exist add-port %s %s\" but %s is "
+                                "actually attached to bridge %s"
+                                % (br_name, name, name, port[2]))
+                have = [self.read(i, 'name')
+                        for i in self.read(port[0], 'interfaces')]
+                if sorted(have) != sorted(iface_names):
+                    raise Error("\"--may-exist add-port %s %s\" but %s "
+                                "actually has interface(s) %s"
+                                % (br_name, name, name, ", ".join(have)))
+                return
+
+        self.check_conflicts(name, "cannot create a port named %s" % name)
+        for iface_name in iface_names:
+            if iface_name != name:
+                self.check_conflicts(iface_name, "cannot create an interface "
+                                     "named %s" % iface_name)
+
+        bridge = self.find_bridge(br_name, True)
+        ifaces = [self.insert("Interface", name=n) for n in iface_names]
+        port = self.insert("Port", name=name, interfaces=ifaces)
+        if '--fake-iface' in options:
+            port.bond_fake_iface = True
+        if bridge[2]:
+            port.tag = [bridge[3]]
+            self.append(bridge[2], 'ports', port)
+        else:
+            self.append(bridge[1], 'ports', port)
+
+    def del_port(self, options, *args):
+        if len(args) == 1:
+            br_name, name = None, args[0]
+        else:
+            br_name, name = args
+
+        port = self.find_port(name, '--with-iface' in options)
+        if not port:
+            if '--if-exists' not in options:
+                raise Error("no port named %s" % name)
+            return
+        if br_name is not None and port[2] != br_name:
+            raise Error("bridge %s does not have a port %s" % (br_name, name))
+        self.delete_port(port[0], port[1])
+
+    def find_record(self, table, name):
+        if table not in ('Bridge', 'Port', 'Interface'):
+            raise VsctlUnsupported("table %s" % table)
+        for row in self.idl.tables[table].rows.values():
+            if self.read(row, 'name') == name:
+                return row
+        raise Error("no row \"%s\" in table %s" % (name, table))
+
+    def find_column(self, row, name):
+        """Match 'name' against the columns of 'row' the way ovs-vsctl does:
+        case and '-' versus '_' do not matter, and a unique prefix will do."""
+        def normalize(s):
+            return s.lower().replace('-', '_')
+        columns = row._table.columns
+        matches = [c for c in columns if normalize(c) == normalize(name)]
+        if not matches:
+            matches = [c for c in columns
+                       if normalize(c).startswith(normalize(name))]
+        if len(matches) != 1:
+            raise Error("%s does not contain a column whose name matches "
+                        "\"%s\"" % (row._table.name, name))
+        return columns[matches[0]]
+
+    def atom(self, base, s):
+        if base.ref_table_name or base.type == ovs.db.types.UuidType:
+            raise VsctlUnsupported("uuid value %s" % s)
+        elif base.type == ovs.db.types.IntegerType:
+            try:
+                return int(s)
+            except ValueError:
+                raise Error("\"%s\" is not a valid integer" % s)
+        elif base.type == ovs.db.types.RealType:
+            try:
+                return float(s)
+            except ValueError:
+                raise Error("\"%s\" is not a valid real number" % s)
+        elif base.type == ovs.db.types.BooleanType:
+            if s not in ('true', 'false'):
+                raise Error("\"%s\" is not a valid boolean" % s)
+            return s == 'true'
+        else:
+            return s
+
+    def set(self, options, table, record, *settings):
+        row = self.find_record(table, record)
+        for setting in settings:
+            name, key, value = vsctl_parse_column(setting)
+            if value is None:
+                raise Error("%s: argument does not end in \"=\" followed by "
+                            "a value" % setting)
+            column = self.find_column(row, name)
+            type_ = column.type
+            if key is not None:
+                if not type_.is_map():
+                    raise Error("cannot specify key to set for non-map column "
+                                "%s" % column.name)
+                row.verify(column.name)
+                d = self.read(row, column.name)
+                d[self.atom(type_.key, key)] = self.atom(type_.value, value)
+                setattr(row, column.name, d)
+            elif type_.is_map() or value.startswith('['):
+                raise VsctlUnsupported("value %s for column %s"
+                                       % (value, column.name))
+            elif type_.is_scalar():
+                setattr(row, column.name, self.atom(type_.key, value))
+            else:
+                setattr(row, column.name, [self.atom(type_.key, value)])
+
+    def remove(self, options, table, record, name, *values):
+        row = self.find_record(table, record)
+        column = self.find_column(row, name)
+        type_ = column.type
+        row.verify(column.name)
+        if type_.is_map():
+            d = self.read(row, column.name)
+            for value in values:
+                value = value.split('=', 1)
+                key = self.atom(type_.key, vsctl_unquote(value[0]))
+                if len(value) == 2 and \
+                        d.get(key) != self.atom(type_.value,
+                                                vsctl_unquote(value[1])):
+                    continue
+                d.pop(key, None)
+            setattr(row, column.name, d)
+        elif not type_.is_scalar():
+            self.discard(row, column.name,
+                         [self.atom(type_.key, vsctl_unquote(v))
+                          for v in values])
+        else:
+            raise VsctlUnsupported("remove from column %s" % column.name)
+
+    def br_set_external_id(self, options, br_name, key, *value):
+        bridge = self.find_bridge(br_name, True)
+        row = bridge[1]
+        if bridge[2]:
+            # A fake bridge keeps its external IDs in its port, prefixed.
+            key = "fake-bridge-" + key
+        row.verify('external_ids')
+        external_ids = self.read(row, 'external_ids')
+        if value:
+            external_ids[key] = value[0]
+        else:
+            external_ids.pop(key, None)
+        row.external_ids = external_ids
+
+class VswitchDB(object):
+    """A connection to ovsdb-server for applying ovs-vsctl commands."""
+
+    def __init__(self):
+        deadline = time.time() + OVSDB_TIMEOUT
+        helper = ovs.db.idl.SchemaHelper(location=OVSDB_SCHEMA)
+        helper.register_columns("Open_vSwitch",
+                                ["bridges", "next_cfg", "cur_cfg"])
+        for table in ["Bridge", "Port", "Interface"]:
+            helper.register_table(table)
+        self.idl = ovs.db.idl.Idl("unix:" + OVSDB_SOCKET, helper)
+        self.wait_until(lambda: self.idl.change_seqno, deadline,
+                        "connecting to %s" % OVSDB_SOCKET)
+
+    def wait_until(self, done, deadline, what):
+        while True:
+            self.idl.run()
+            if done():
+                return
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise Error("timed out %s" % what)
+            poller = ovs.poller.Poller()
+            self.idl.wait(poller)
+            poller.timer_wait(int(timeout * 1000) + 1)
+            poller.block()
+
+    def cur_cfg(self):
+        for row in self.idl.tables["Open_vSwitch"].rows.values():
+            return row.cur_cfg
+        return 0
+
+    def transact(self, argv):
+        """Apply the ovs-vsctl arguments in 'argv' in one transaction and
+        wait for ovs-vswitchd to reconfigure, as ovs-vsctl would."""
+        start = time.time()
+        deadline = start + OVSDB_TIMEOUT
+        commands = vsctl_parse(argv)
+
+        while True:
+            seqno = self.idl.change_seqno
+            txn = ovs.db.idl.Transaction(self.idl)
+            txn.add_comment("interface-reconfigure")
+            try:
+                ctx = VsctlContext(self.idl, txn)
+                for options, command, args in commands:
+                    ctx.run(options, command, args)
+                ctx.ovs.increment("next_cfg")
+            except:
+                txn.abort()
+                raise
+            prepared = time.time()
+
+            status = txn.commit_block()
+            committed = time.time()
+            if status != ovs.db.idl.Transaction.TRY_AGAIN:
+                break
+            log("vswitch: transaction needs to be retried")
+            self.wait_until(lambda: self.idl.change_seqno != seqno, deadline,
+                            "waiting for database changes")
+
+        if status == ovs.db.idl.Transaction.SUCCESS:
+            next_cfg = txn.get_increment_new_value()
+            self.wait_until(lambda: self.cur_cfg() >= next_cfg, deadline,
+                            "waiting for ovs-vswitchd to reconfigure")
+        elif status != ovs.db.idl.Transaction.UNCHANGED:
+            raise Error("transaction error: %s" % txn.get_error())
+        reconfigured = time.time()
+
+        log("vswitch: %d commands prepared in %.3fs, committed in %.3fs, "
+            "applied by ovs-vswitchd in %.3fs"
+            % (len(commands), prepared - start, committed - prepared,
+               reconfigured - committed))
+
+def vswitch_db():
+    """Return the VswitchDB connection for this run, opening it on first
+    use, or None if ovs-vsctl has to be used instead."""
+    global ovs, _vswitch_db
+    if _vswitch_db is not None:
+        return _vswitch_db or None
+
+    _vswitch_db = False
+    if root_prefix() or not os.path.exists(OVSDB_SOCKET):
+        return None
+
+    if OVS_PYTHON_DIR not in sys.path:
+        sys.path.append(OVS_PYTHON_DIR)
+    try:
+        import ovs.db.idl
+        import ovs.db.types
+        import ovs.poller
+    except ImportError, e:
+        log("vswitch: Open vSwitch Python library not available (%s)" % e)
+        return None
+
+    start = time.time()
+    try:
+        _vswitch_db = VswitchDB()
+    except Error, e:
+        log("vswitch: %s" % e.msg)
+        return None
+    log("vswitch: connected to %s in %.3fs" % (OVSDB_SOCKET,
+                                               time.time() - start))
+    return _vswitch_db
+
 def datapath_modify_config(commands):
     #log("modifying configuration:")
     #for c in commands:
     #    log("  %s" % c)
-            
+
+    vsdb = vswitch_db()
+    if vsdb:
+        try:
+            vsdb.transact(commands)
+            return True
+        except VsctlUnsupported, e:
+            log("vswitch: unsupported %s, using ovs-vsctl" % e)
+        except Error, e:
+            log("vswitch: %s" % e.msg)
+            raise Error("Failed to modify vswitch configuration")
+
     rc = run_command(['/usr/bin/ovs-vsctl'] + ['--timeout=20']
                      + [c for c in commands if not c.startswith('#')])
     if not rc:       
@@ -11,6 +11,9 @@
 import json
 import errno
 import socket
+import select
+import time
+import collections
 
 class QMPError(Exception):
     pass
@@ -21,6 +24,9 @@ class QMPConnectError(QMPError):
 class QMPCapabilitiesError(QMPError):
     pass
 
+class QMPTimeoutError(QMPError):
+    pass
+
 class QEMUMonitorProtocol:
     def __init__(self, address, server=False):
         """
@@ -188,3 +194,347 @@ class QEMUMonitorProtocol:
 
     def settimeout(self, timeout):
         self.__sock.settimeout(timeout)
+
+
+class QMPDispatcher:
+    def __init__(self):
+        """
+        Create a QMPDispatcher, which multiplexes the sockets of any number of
+        QEMUMonitorAsync connections with poll(2).
+        """
+        self.__poll = select.poll()
+        self.__monitors = {}
+
+    def register(self, monitor, want_write=False):
+        events = select.POLLIN
+        if want_write:
+            events |= select.POLLOUT
+        self.__monitors[monitor.fileno()] = monitor
+        self.__poll.register(monitor.fileno(), events)
+
+    def unregister(self, monitor):
+        if self.__monitors.pop(monitor.fileno(), None) is not None:
+            self.__poll.unregister(monitor.fileno())
+
+    def monitors(self):
+        return self.__monitors.values()
+
+    def poll(self, timeout=None):
+        """
+        Wait for I/O on the registered monitors and process it, invoking the
+        callbacks of completed commands and subscribed events.
+
+        @param timeout: maximum time to wait in seconds, None to wait forever
+        @return number of monitors which had I/O
+        """
+        if timeout is not None:
+            timeout = max(0, int(timeout * 1000))
+        try:
+            ready = self.__poll.poll(timeout)
+        except select.error, err:
+            if err[0] == errno.EINTR:
+                return 0
+            raise
+        for fd, events in ready:
+            monitor = self.__monitors.get(fd)
+            if monitor is not None:
+                monitor.handle_io(events)
+        return len(ready)
+
+    def run_until(self, predicate, timeout=None):
+        """
+        Process I/O until predicate() returns True.
+
+        @param timeout: maximum time to wait in seconds, None to wait forever
+        @return the last value of predicate(), which is false if all
+                monitors have been closed
+        @raise QMPTimeoutError if the timeout expires
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not predicate():
+            if not self.__monitors:
+                return predicate()
+            remaining = None
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise QMPTimeoutError
+            self.poll(remaining)
+        return True
+
+    def wait(self, requests, timeout=None):
+        """
+        Process I/O until all requests are complete.
+
+        @param requests: list of QMPRequest objects
+        @return list of the QMP responses, None for requests whose monitor
+                has been closed
+        """
+        self.run_until(lambda: not [r for r in requests if not r.done],
+                       timeout)
+        return [r.response for r in requests]
+
+    def run(self):
+        """
+        Process I/O until all monitors are closed.
+        """
+        self.run_until(lambda: False)
+
+class QMPRequest:
+    def __init__(self, monitor, qmp_cmd, callback=None):
+        """
+        A QMP command sent by QEMUMonitorAsync.execute().  The command is
+        done once its response has been received, or its monitor has been
+        closed; response is None in the latter case.
+
+        @param callback: invoked with the request when it is done
+        """
+        self.monitor = monitor
+        self.cmd = qmp_cmd
+        self.callback = callback
+        self.response = None
+        self.done = False
+
+    def complete(self, response):
+        self.response = response
+        self.done = True
+        if self.callback is not None:
+            self.callback(self)
+
+    def wait(self, timeout=None):
+        """
+        Process I/O of the monitor's dispatcher until the request is done.
+
+        @return QMP response as a Python dict or None if the connection has
+                been closed
+        """
+        self.monitor.dispatcher.run_until(lambda: self.done, timeout)
+        return self.response
+
+    def result(self, timeout=None):
+        """
+        Like wait(), but return the value returned by the command.
+
+        @raise QMPError if the command failed or the connection was closed
+        """
+        resp = self.wait(timeout)
+        if resp is None:
+            raise QMPError('connection closed')
+        if resp.has_key('error'):
+            raise QMPError(resp['error']['desc'])
+        return resp['return']
+
+class QEMUMonitorAsync:
+    def __init__(self, address, dispatcher=None):
+        """
+        Create a non-blocking QMP connection.
+
+        Unlike QEMUMonitorProtocol, commands do not wait for their response:
+        execute() tags each command with an id and returns a QMPRequest,
+        which is completed when the response with the same id arrives.  Any
+        number of commands can be in flight on each monitor, and any number
+        of monitors can share a QMPDispatcher, which runs all of them from
+        a single thread.
+
+        Events are passed to the callbacks registered with subscribe(), or
+        queued for pull_event() and get_events() if no callback matches.
+
+        @param address: QEMU address, can be either a unix socket path (string)
+                        or a tuple in the form ( address, port ) for a TCP
+                        connection
+        @param dispatcher: QMPDispatcher to register with, a new one is
+                           created if None
+        """
+        if dispatcher is None:
+            dispatcher = QMPDispatcher()
+        self.dispatcher = dispatcher
+        self.address = address
+        self.greeting = None
+        self.closed = False
+        self.__events = collections.deque()
+        self.__subscribers = {}
+        self.__pending = {}
+        self.__next_id = 0
+        self.__rbuf = ''
+        self.__wbuf = ''
+        self.__sock = None
+
+    def connect(self, negotiate=True):
+        """
+        Connect to the QMP Monitor.  The connection itself is blocking, the
+        greeting and capabilities negotiation are not.
+
+        @return QMPRequest of the qmp_capabilities command if negotiate is
+                true, None otherwise
+        @raise socket.error on socket connection errors
+        """
+        if isinstance(self.address, tuple):
+            family = socket.AF_INET
+        else:
+            family = socket.AF_UNIX
+        self.__sock = socket.socket(family, socket.SOCK_STREAM)
+        self.__sock.connect(self.address)
+        self.__sock.setblocking(0)
+        self.dispatcher.register(self)
+        if negotiate:
+            return self.execute('qmp_capabilities')
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def execute(self, name, args=None, callback=None):
+        """
+        Send a QMP command to the QMP Monitor, without waiting for its
+        response.
+
+        @param name: command name (string)
+        @param args: command arguments (dict)
+        @param callback: invoked with the QMPRequest once it is done
+        @return QMPRequest
+        """
+        qmp_cmd = { 'execute': name }
+        if args:
+            qmp_cmd['arguments'] = args
+        return self.execute_obj(qmp_cmd, callback)
+
+    def execute_obj(self, qmp_cmd, callback=None):
+        """
+        Send a QMP command given as a Python dict, see execute().  Its id,
+        if any, is replaced by one identifying the request.
+        """
+        qmp_cmd = dict(qmp_cmd)
+        qmp_cmd['id'] = self.__next_id
+        request = QMPRequest(self, qmp_cmd, callback)
+        if self.closed:
+            request.complete(None)
+            return request
+        self.__pending[self.__next_id] = request
+        self.__next_id += 1
+        self.__send(json.dumps(qmp_cmd))
+        return request
+
+    def subscribe(self, callback, event=None):
+        """
+        Invoke callback(monitor, event) for each QMP event received.
+
+        @param event: only pass events of this name (string), or all events
+                      if None
+        """
+        self.__subscribers.setdefault(event, []).append(callback)
+
+    def unsubscribe(self, callback, event=None):
+        self.__subscribers[event].remove(callback)
+        if not self.__subscribers[event]:
+            del self.__subscribers[event]
+
+    def pull_event(self):
+        """
+        Get and delete the first queued QMP event, None if there is none.
+        """
+        if self.__events:
+            return self.__events.popleft()
+
+    def get_events(self):
+        """
+        Get a list of queued QMP events.
+        """
+        return list(self.__events)
+
+    def clear_events(self):
+        """
+        Clear current list of queued events.
+        """
+        self.__events.clear()
+
+    def __send(self, data):
+        want_write = bool(self.__wbuf)
+        self.__wbuf += data
+        if not want_write:
+            self.__flush()
+            if self.__wbuf and not self.closed:
+                self.dispatcher.register(self, want_write=True)
+
+    def __flush(self):
+        try:
+            while self.__wbuf:
+                sent = self.__sock.send(self.__wbuf)
+                self.__wbuf = self.__wbuf[sent:]
+        except socket.error, err:
+            if err[0] == errno.EAGAIN:
+                return
+            if err[0] == errno.EPIPE:
+                self.close()
+                return
+            raise
+
+    def handle_io(self, events):
+        """
+        Process I/O reported by the dispatcher.
+        """
+        if events & select.POLLOUT:
+            self.__flush()
+            if self.closed:
+                # The peer went away while we were writing; the socket is
+                # already closed, so there is nothing left to read.
+                return
+            if not self.__wbuf:
+                self.dispatcher.register(self)
+        if events & (select.POLLIN | select.POLLHUP | select.POLLERR):
+            self.__receive()
+
+    def __receive(self):
+        try:
+            data = self.__sock.recv(65536)
+        except socket.error, err:
+            if err[0] == errno.EAGAIN:
+                return
+            if err[0] != errno.ECONNRESET:
+                raise
+            data = ''
+        if not data:
+            self.close()
+            return
+
+        lines = (self.__rbuf + data).split('\n')
+        self.__rbuf = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.__dispatch(json.loads(line))
+
+    def __dispatch(self, resp):
+        if 'event' in resp:
+            callbacks = self.__subscribers.get(resp['event'], []) + \
+                        self.__subscribers.get(None, [])
+            if not callbacks:
+                self.__events.append(resp)
+            for callback in callbacks:
+                callback(self, resp)
+        elif self.greeting is None:
+            if not resp.has_key('QMP'):
+                self.close()
+                raise QMPConnectError
+            self.greeting = resp
+        elif self.__pending:
+            # errors for unparseable commands carry no id, they belong to
+            # the oldest command since QEMU answers commands in order
+            request = self.__pending.pop(resp.get('id', min(self.__pending)),
+                                         None)
+            if request is not None:
+                request.complete(resp)
+
+    def close(self):
+        """
+        Close the connection.  Pending requests are completed with a None
+        response.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.__sock is not None:
+            self.dispatcher.unregister(self)
+            self.__sock.close()
+        pending = self.__pending
+        self.__pending = {}
+        for id in sorted(pending):
+            pending[id].complete(None)
@@ -88,6 +88,14 @@ config-%.h: config-%.h-timestamp
 config-%.h-timestamp: config-%.mak
 	$(call quiet-command, sh $(SRC_PATH)/scripts/create_config < $< > $@, "  GEN   $(TARGET_DIR)config-$*.h")
 
+# Files generated behind a timestamp file are regenerated when they go
+# missing: $(call timestamp-missing,FILES) lists the timestamp files of
+# those of FILES which do not exist, to be made to depend on FORCE.
+timestamp-missing = $(addsuffix -timestamp,$(filter-out $(wildcard $(1)),$(1)))
+
+.PHONY: FORCE
+FORCE:
+
 .PHONY: clean-timestamp
 clean-timestamp:
 	rm -f *.timestamp
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # Pretty print 9p simpletrace log
-# Usage: ./analyse-9p-simpletrace <trace-events> <trace-pid>
+# Usage: ./analyse-9p-simpletrace [--jobs=N] <trace-events> <trace-pid>
 #
 # Author: Harsh Prateek Bora
 import os
@@ -78,9 +78,15 @@ symbol_9p = {
 }
 
 class VirtFSRequestTracker(simpletrace.Analyzer):
+        mergeable = True
+
         def begin(self):
                 print "Pretty printing 9p simpletrace log ..."
 
+        def merge(self, other):
+                # nothing to merge, all output is printed per record
+                pass
+
         def v9fs_rerror(self, tag, id, err):
                 print "RERROR (tag =", tag, ", id =", symbol_9p[id], ", err = \"", os.strerror(err), "\")"
 
@@ -0,0 +1,70 @@
+#
+# Helpers shared by the code generators (qapi, tracetool)
+#
+# This work is licensed under the terms of the GNU GPLv2.
+# See the COPYING.LIB file in the top-level directory.
+
+import os
+import errno
+import inspect
+import cPickle
+import hashlib
+
+def write_if_changed(path, data):
+    """Write data to the file path, unless it already holds exactly data.
+
+    Leaving an unchanged file alone keeps its timestamp, so make does not
+    rebuild everything depending on it.  The file is replaced atomically,
+    as several generators may run in parallel."""
+    try:
+        f = open(path, 'rb')
+        try:
+            if f.read() == data:
+                return
+        finally:
+            f.close()
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+def cache_key(data, *modules):
+    """Return a key for the result of processing data with the given
+    modules, which changes whenever data or the source of one of the
+    modules does."""
+    key = hashlib.sha1(data)
+    for module in modules:
+        f = open(inspect.getsourcefile(module))
+        try:
+            key.update(f.read())
+        finally:
+            f.close()
+    return key.hexdigest()
+
+def load_cache(path, key):
+    """Return the value saved by save_cache() with the same key, or None
+    if the cache file is missing, unreadable or was saved with another
+    key."""
+    try:
+        f = open(path, 'rb')
+        try:
+            cached_key, value = cPickle.load(f)
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+        return None
+    if cached_key != key:
+        return None
+    return value
+
+def save_cache(path, key, value):
+    """Pickle value to the cache file path, under key."""
+    write_if_changed(path, cPickle.dumps((key, value),
+                                         cPickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,61 @@
+#
+# QAPI schema parser benchmark
+#
+# This work is licensed under the terms of the GNU GPLv2.
+# See the COPYING.LIB file in the top-level directory.
+
+import getopt
+import sys
+import time
+from cStringIO import StringIO
+import qapi
+
+def generate_schema(count):
+    """Return a schema with count each of enums, structs, unions and commands,
+    plus one enum with count values."""
+    out = StringIO()
+    out.write("{ 'enum': 'LargeEnum',\n  'data': [ %s ] }\n\n" %
+              ",\n             ".join("'value%d'" % i for i in xrange(count)))
+    for i in xrange(count):
+        out.write("# Generated definitions %d\n\n" % i)
+        out.write("{ 'enum': 'Enum%d',\n"
+                  "  'data': [ 'value1', 'value2', 'value3', 'value4' ] }\n\n"
+                  % i)
+        out.write("{ 'type': 'Struct%d',\n"
+                  "  'data': { 'integer': 'int', '*string': 'str',\n"
+                  "            'enum': 'Enum%d', 'list': ['int'],\n"
+                  "            'nested': { 'flag': 'bool', 'quoted': 'it\\'s' } } }\n\n"
+                  % (i, i))
+        out.write("{ 'union': 'Union%d',\n"
+                  "  'data': { 'a': 'Struct%d', 'b': 'Enum%d' } }\n\n"
+                  % (i, i, i))
+        out.write("{ 'command': 'command-%d',\n"
+                  "  'data': { 'arg': 'Struct%d', '*opt': 'int' },\n"
+                  "  'returns': [ 'Struct%d' ] }\n\n"
+                  % (i, i, i))
+    return out.getvalue()
+
+def main(argv):
+    count = 1000
+    repeat = 3
+    opts, args = getopt.gnu_getopt(argv[1:], "n:r:", ["count=", "repeat="])
+    for o, a in opts:
+        if o in ("-n", "--count"):
+            count = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+
+    schema = generate_schema(count)
+    best = None
+    for i in xrange(repeat):
+        qapi.enum_types = []
+        start = time.time()
+        exprs = qapi.parse_schema(StringIO(schema))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print "%d expressions, %d bytes: %.3f s" % (len(exprs), len(schema), best)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -424,20 +424,13 @@ if not do_c and not do_h:
 c_file = output_dir + prefix + c_file
 h_file = output_dir + prefix + h_file
 
-def maybe_open(really, name, opt):
-    if really:
-        return open(name, opt)
-    else:
-        import StringIO
-        return StringIO.StringIO()
-
 try:
     os.makedirs(output_dir)
 except os.error, e:
     if e.errno != errno.EEXIST:
         raise
 
-exprs = parse_schema(sys.stdin)
+exprs = parse_schema_cached(sys.stdin, output_dir)
 commands = filter(lambda expr: expr.has_key('command'), exprs)
 commands = filter(lambda expr: not expr.has_key('gen'), commands)
 
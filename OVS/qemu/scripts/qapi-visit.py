@@ -272,13 +272,6 @@ except os.error, e:
     if e.errno != errno.EEXIST:
         raise
 
-def maybe_open(really, name, opt):
-    if really:
-        return open(name, opt)
-    else:
-        import StringIO
-        return StringIO.StringIO()
-
 fdef = maybe_open(do_c, c_file, 'w')
 fdecl = maybe_open(do_h, h_file, 'w')
 
@@ -327,7 +320,7 @@ fdecl.write(mcgen('''
 ''',
                   prefix=prefix, guard=guardname(h_file)))
 
-exprs = parse_schema(sys.stdin)
+exprs = parse_schema_cached(sys.stdin, output_dir)
 
 for expr in exprs:
     if expr.has_key('type'):
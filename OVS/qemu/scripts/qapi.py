@@ -9,99 +9,116 @@
 # This work is licensed under the terms of the GNU GPLv2.
 # See the COPYING.LIB file in the top-level directory.
 
+import re
+import os
+import sys
+import StringIO
 from ordereddict import OrderedDict
+from genutil import write_if_changed, cache_key, load_cache, save_cache
+
+# A token is punctuation or a quoted string, in which a backslash escapes
+# the next character.  Anything else between tokens is skipped.  A quote
+# that does not start a terminated string is matched on its own.
+token_re = re.compile(r"""([{}:,\[\]])|'([^'\\]*(?:\\.[^'\\]*)*)'|(')""", re.S)
+escape_re = re.compile(r"\\(.)", re.S)
 
 def tokenize(data):
-    while len(data):
-        ch = data[0]
-        data = data[1:]
-        if ch in ['{', '}', ':', ',', '[', ']']:
-            yield ch
-        elif ch in ' \n':
-            None
-        elif ch == "'":
-            string = ''
-            esc = False
-            while True:
-                if (data == ''):
-                    raise Exception("Mismatched quotes")
-                ch = data[0]
-                data = data[1:]
-                if esc:
-                    string += ch
-                    esc = False
-                elif ch == "\\":
-                    esc = True
-                elif ch == "'":
-                    break
-                else:
-                    string += ch
+    for match in token_re.finditer(data):
+        punct, string, quote = match.groups()
+        if punct is not None:
+            yield punct
+        elif quote is not None:
+            raise Exception("Mismatched quotes")
+        elif '\\' in string:
+            yield escape_re.sub(r'\1', string)
+        else:
             yield string
 
-def parse(tokens):
-    if tokens[0] == '{':
+def parse_value(tokens, pos):
+    """Parse the value starting at tokens[pos], returning it together with
+    the position of the token following it."""
+    token = tokens[pos]
+    if token == '{':
         ret = OrderedDict()
-        tokens = tokens[1:]
-        while tokens[0] != '}':
-            key = tokens[0]
-            tokens = tokens[1:]
-
-            tokens = tokens[1:] # :
-
-            value, tokens = parse(tokens)
-
-            if tokens[0] == ',':
-                tokens = tokens[1:]
-
+        pos += 1
+        while tokens[pos] != '}':
+            key = tokens[pos]
+            # skip the key and the ':'
+            value, pos = parse_value(tokens, pos + 2)
+            if tokens[pos] == ',':
+                pos += 1
             ret[key] = value
-        tokens = tokens[1:]
-        return ret, tokens
-    elif tokens[0] == '[':
+        return ret, pos + 1
+    elif token == '[':
         ret = []
-        tokens = tokens[1:]
-        while tokens[0] != ']':
-            value, tokens = parse(tokens)
-            if tokens[0] == ',':
-                tokens = tokens[1:]
+        pos += 1
+        while tokens[pos] != ']':
+            value, pos = parse_value(tokens, pos)
+            if tokens[pos] == ',':
+                pos += 1
             ret.append(value)
-        tokens = tokens[1:]
-        return ret, tokens
+        return ret, pos + 1
     else:
-        return tokens[0], tokens[1:]
+        return token, pos + 1
+
+def parse(tokens):
+    value, pos = parse_value(tokens, 0)
+    return value, tokens[pos:]
 
 def evaluate(string):
-    return parse(map(lambda x: x, tokenize(string)))[0]
+    return parse_value(list(tokenize(string)), 0)[0]
+
+def add_expr(exprs, expr):
+    expr_eval = evaluate(''.join(expr))
+    if expr_eval.has_key('enum'):
+        add_enum(expr_eval['enum'])
+    elif expr_eval.has_key('union'):
+        add_enum('%sKind' % expr_eval['union'])
+    exprs.append(expr_eval)
 
 def parse_schema(fp):
     exprs = []
-    expr = ''
-    expr_eval = None
+    expr = []
 
     for line in fp:
         if line.startswith('#') or line == '\n':
             continue
 
         if line.startswith(' '):
-            expr += line
+            expr.append(line)
         elif expr:
-            expr_eval = evaluate(expr)
-            if expr_eval.has_key('enum'):
-                add_enum(expr_eval['enum'])
-            elif expr_eval.has_key('union'):
-                add_enum('%sKind' % expr_eval['union'])
-            exprs.append(expr_eval)
-            expr = line
+            add_expr(exprs, expr)
+            expr = [line]
         else:
-            expr += line
+            expr.append(line)
 
     if expr:
-        expr_eval = evaluate(expr)
-        if expr_eval.has_key('enum'):
-            add_enum(expr_eval['enum'])
-        elif expr_eval.has_key('union'):
-            add_enum('%sKind' % expr_eval['union'])
-        exprs.append(expr_eval)
+        add_expr(exprs, expr)
+
+    return exprs
 
+schema_cache_name = '.qapi-schema.cache'
+
+def parse_schema_cached(fp, cache_dir=''):
+    """Parse a schema like parse_schema(), through a cache in cache_dir.
+
+    The generators run one after the other on the same schema, so the
+    parsed expressions and the enums they register are pickled together
+    with a hash of the schema and of this parser.  A generator finding a
+    matching cache loads it instead of parsing the schema again."""
+    data = fp.read()
+    key = cache_key(data, sys.modules[__name__])
+    cache_file = os.path.join(cache_dir, schema_cache_name)
+    cached = load_cache(cache_file, key)
+    if cached is not None:
+        exprs, enums = cached
+        for name in enums:
+            add_enum(name)
+        return exprs
+
+    first_enum = len(enum_types)
+    exprs = parse_schema(StringIO.StringIO(data))
+    save_cache(cache_file, key, (exprs, enum_types[first_enum:]))
     return exprs
 
 def parse_args(typeinfo):
@@ -234,6 +251,24 @@ def cgen(code, **kwds):
 def mcgen(code, **kwds):
     return cgen('\n'.join(code.split('\n')[1:-1]), **kwds)
 
+class OutputFile(StringIO.StringIO):
+    """A generated file, written out by close() only if its contents changed."""
+
+    def __init__(self, name):
+        StringIO.StringIO.__init__(self)
+        self.name = name
+
+    def close(self):
+        if not self.closed:
+            write_if_changed(self.name, self.getvalue())
+        StringIO.StringIO.close(self)
+
+def maybe_open(really, name, opt):
+    if really:
+        return OutputFile(name)
+    else:
+        return StringIO.StringIO()
+
 def basename(filename):
     return filename.split("/")[-1]
 
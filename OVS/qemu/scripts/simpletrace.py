@@ -12,6 +12,14 @@
 import struct
 import re
 import inspect
+import itertools
+import mmap
+import array
+import os
+import sys
+import time
+import multiprocessing
+from cStringIO import StringIO
 from tracetool import _read_events, Event
 from tracetool.backend.simple import is_string
 
@@ -22,6 +30,11 @@ dropped_event_id = 0xfffffffffffffffe
 log_header_fmt = '=QQQ'
 rec_header_fmt = '=QQII'
 
+index_magic = 0x78646e6972747473 # "sttrindx"
+index_version = 2
+index_header_fmt = '=QQQQQQQ'
+index_checkpoint_fmt = '=QQQQ'
+
 def read_header(fobj, hfmt):
     '''Read a trace record header'''
     hlen = struct.calcsize(hfmt)
@@ -58,9 +71,8 @@ def read_record(edict, fobj):
     rechdr = read_header(fobj, rec_header_fmt)
     return get_record(edict, rechdr, fobj) # return tuple of record elements
 
-def read_trace_file(edict, fobj):
-    """Deserialize trace records from a file, yielding record tuples (event_num, timestamp, arg1, ..., arg6)."""
-    header = read_header(fobj, log_header_fmt)
+def check_log_header(header):
+    """Raise ValueError unless header is the log header of a supported trace file."""
     if header is None or \
        header[0] != header_event_id or \
        header[1] != header_magic:
@@ -73,6 +85,10 @@ def read_trace_file(edict, fobj):
     if log_version == 0:
         raise ValueError('Older log format, not supported with this QEMU release!')
 
+def read_trace_file(edict, fobj):
+    """Deserialize trace records from a file, yielding record tuples (event_num, timestamp, arg1, ..., arg6)."""
+    check_log_header(read_header(fobj, log_header_fmt))
+
     while True:
         rec = read_record(edict, fobj)
         if rec is None:
@@ -80,6 +96,456 @@ def read_trace_file(edict, fobj):
 
         yield rec
 
+def follow_trace_file(edict, fobj, poll_interval=0.2, chunk_size=65536):
+    """Deserialize trace records from a file which is still being written.
+
+    Like read_trace_file(), but instead of stopping at the end of the file,
+    wait for more records to be appended.  None is yielded each time the end
+    of the file is reached, before sleeping for poll_interval seconds.  A
+    record which is only partially written is kept until the rest of it
+    arrives, so at most chunk_size bytes plus one record are buffered."""
+    fd = fobj.fileno()
+    hlen = struct.calcsize(log_header_fmt)
+    buf = ''
+    while len(buf) < hlen:
+        data = os.read(fd, hlen - len(buf))
+        if not data:
+            yield None
+            time.sleep(poll_interval)
+            continue
+        buf += data
+    check_log_header(struct.unpack(log_header_fmt, buf))
+
+    rec_header = struct.Struct(rec_header_fmt)
+    rhlen = rec_header.size
+    buf = ''
+    while True:
+        data = os.read(fd, chunk_size)
+        if not data:
+            yield None
+            time.sleep(poll_interval)
+            continue
+        buf += data
+
+        offset = 0
+        while offset + rhlen <= len(buf):
+            rechdr = rec_header.unpack_from(buf, offset)
+            length = rechdr[2]
+            if length < rhlen:
+                raise ValueError('Invalid record length %d at end of trace file' % length)
+            if offset + length > len(buf):
+                break
+            body = StringIO(buf[offset + rhlen:offset + length])
+            yield get_record(edict, rechdr, body)
+            offset += length
+        buf = buf[offset:]
+
+def build_edict(events):
+    """Map event IDs, as found in trace records, to Event objects."""
+    dropped_event = Event.build("Dropped_Event(uint64_t num_events_dropped)")
+    edict = {dropped_event_id: dropped_event}
+
+    enabled_events = [e for e in events if 'disable' not in e.properties]
+    for num, event in enumerate(enabled_events):
+        edict[num] = event
+    return edict
+
+class TraceIndex(object):
+    """A sparse index of a trace file.
+
+    The index holds a checkpoint for every 'interval' records: the offset and
+    number of the first record of that chunk of records, and the lowest and
+    highest timestamps found in the chunk.  Records are nearly, but not
+    strictly, in timestamp order, so keeping both bounds lets time range
+    lookups find every chunk that can hold matching records.
+
+    The index is stored next to the trace file (see TraceFile.time_index())
+    and extended when the trace file grows.  It records the device and inode
+    of the trace file, so that it is not used for another trace file."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        # list of (min timestamp, max timestamp, offset, record number)
+        self.checkpoints = []
+        # offset following the last indexed record, and number of records
+        self.end = 0
+        self.count = 0
+        # device and inode of the indexed trace file
+        self.dev = 0
+        self.ino = 0
+
+    def update(self, trace):
+        """Index the records of trace that were added since the last
+        update.  The last chunk is rescanned, as it may have been partial."""
+        st = trace.stat()
+        self.dev, self.ino = st.st_dev, st.st_ino
+        offset = struct.calcsize(log_header_fmt)
+        recno = 0
+        if self.checkpoints:
+            _, _, offset, recno = self.checkpoints.pop()
+        if offset >= trace.size():
+            return
+
+        chunk = None
+        for rec_offset, _, timestamp in trace.walk(offset):
+            if recno % self.interval == 0:
+                if chunk is not None:
+                    self.checkpoints.append(tuple(chunk))
+                chunk = [timestamp, timestamp, rec_offset, recno]
+            else:
+                chunk[0] = min(chunk[0], timestamp)
+                chunk[1] = max(chunk[1], timestamp)
+            recno += 1
+        if chunk is not None:
+            self.checkpoints.append(tuple(chunk))
+        self.count = recno
+        self.end = trace.walk_end
+
+    def matches(self, trace):
+        """Return whether the index describes trace, or the start of it if
+        trace has grown since.  The index must have been built for the same
+        file, and each checkpoint must still point to the header of a record
+        within the timestamp bounds of its chunk; a trace file which was
+        rewritten in place fails the latter check."""
+        st = trace.stat()
+        if (self.dev, self.ino) != (st.st_dev, st.st_ino) or \
+           self.end > trace.size():
+            return False
+        data = trace.map
+        hlen = trace.rec_header.size
+        for min_ts, max_ts, offset, _ in self.checkpoints:
+            if offset + hlen > self.end:
+                return False
+            event_id, timestamp, length, _ = \
+                trace.rec_header.unpack_from(data, offset)
+            if event_id not in trace.edict or length < hlen or \
+               offset + length > self.end or \
+               not min_ts <= timestamp <= max_ts:
+                return False
+        return True
+
+    def chunks(self, start=None, end=None):
+        """Yield (offset, record number) of the chunks which may hold
+        records with start <= timestamp < end."""
+        for min_ts, max_ts, offset, recno in self.checkpoints:
+            if start is not None and max_ts < start:
+                continue
+            if end is not None and min_ts >= end:
+                continue
+            yield offset, recno
+
+    def find(self, recno):
+        """Return (offset, record number) of the chunk holding a record."""
+        _, _, offset, first = self.checkpoints[recno // self.interval]
+        return offset, first
+
+    def save(self, filename):
+        tmp = '%s.%d' % (filename, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            f.write(struct.pack(index_header_fmt, index_magic, index_version,
+                                self.interval, self.end, self.count,
+                                self.dev, self.ino))
+            for checkpoint in self.checkpoints:
+                f.write(struct.pack(index_checkpoint_fmt, *checkpoint))
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+
+    @staticmethod
+    def load(filename):
+        """Load an index saved by save(), returning None if it is missing
+        or not valid."""
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        hlen = struct.calcsize(index_header_fmt)
+        clen = struct.calcsize(index_checkpoint_fmt)
+        if len(data) < hlen or (len(data) - hlen) % clen:
+            return None
+        magic, version, interval, end, count, dev, ino = \
+            struct.unpack_from(index_header_fmt, data, 0)
+        if magic != index_magic or version != index_version or interval == 0:
+            return None
+
+        index = TraceIndex(interval)
+        index.end = end
+        index.count = count
+        index.dev = dev
+        index.ino = ino
+        index.checkpoints = [struct.unpack_from(index_checkpoint_fmt, data, off)
+                             for off in xrange(hlen, len(data), clen)]
+        return index
+
+class TraceFile(object):
+    """A trace file mapped into memory.
+
+    The first access to the offsets, event_ids or end attributes makes a
+    single pass over the record headers to find the offset of each record.
+    Since every record header holds the record length, variable-length
+    string arguments need not be decoded to find the next record.  Records
+    can then be decoded one at a time, or all records of an event can be
+    extracted at once as a NumPy structured array with a field for the
+    timestamp and one for each integer argument.
+
+    Time ranges and record numbers can be looked up through a sparse
+    TraceIndex instead, without a pass over the whole file."""
+
+    rec_header = struct.Struct(rec_header_fmt)
+
+    def __init__(self, edict, log):
+        if isinstance(log, str):
+            log = open(log, 'rb')
+        self.edict = edict
+        self.fobj = log
+        self.filename = getattr(log, 'name', None)
+        self.map = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = struct.unpack_from(log_header_fmt, self.map, 0) \
+                 if len(self.map) >= struct.calcsize(log_header_fmt) else None
+        if header is None or \
+           header[0] != header_event_id or \
+           header[1] != header_magic:
+            raise ValueError('Not a valid trace file!')
+        if header[2] != 0 and \
+           header[2] != 2:
+            raise ValueError('Unknown version of tracelog format!')
+        if header[2] == 0:
+            raise ValueError('Older log format, not supported with this QEMU release!')
+
+        self._offsets = None
+        self._event_ids = None
+        self._end = None
+        self._time_index = None
+        self._decoders = {}
+        self.walk_end = None
+
+    def size(self):
+        return len(self.map)
+
+    def stat(self):
+        return os.fstat(self.fobj.fileno())
+
+    def walk(self, offset):
+        """Yield (offset, event ID, timestamp) of each complete record from
+        offset on, reading only record headers.  Afterwards, walk_end is
+        the offset following the last complete record."""
+        data = self.map
+        size = len(data)
+        hlen = self.rec_header.size
+        unpack_from = self.rec_header.unpack_from
+        while offset + hlen <= size:
+            event_id, timestamp, length, _ = unpack_from(data, offset)
+            if length < hlen or offset + length > size:
+                # truncated record at the end of the file
+                break
+            yield offset, event_id, timestamp
+            offset += length
+        self.walk_end = offset
+
+    def _index(self):
+        if self._offsets is not None:
+            return
+        # 'L' is 64 bits on the LP64 hosts QEMU traces are taken on
+        self._offsets = array.array('L')
+        self._event_ids = array.array('L')
+        offsets = self._offsets
+        event_ids = self._event_ids
+        for offset, event_id, _ in self.walk(struct.calcsize(log_header_fmt)):
+            offsets.append(offset)
+            event_ids.append(event_id)
+        self._end = self.walk_end
+
+    @property
+    def offsets(self):
+        self._index()
+        return self._offsets
+
+    @property
+    def event_ids(self):
+        self._index()
+        return self._event_ids
+
+    @property
+    def end(self):
+        self._index()
+        return self._end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _decoder(self, event_id):
+        """Return a function decoding the arguments of a record of the
+        given event into a tuple."""
+        decoder = self._decoders.get(event_id)
+        if decoder is not None:
+            return decoder
+
+        event = self.edict[event_id]
+        data = self.map
+        if not [1 for type, name in event.args if is_string(type)]:
+            args = struct.Struct('=%dQ' % len(event.args))
+            decoder = lambda offset: args.unpack_from(data, offset)
+        else:
+            def decoder(offset):
+                rec = ()
+                for type, name in event.args:
+                    if is_string(type):
+                        (length,) = struct.unpack_from('=L', data, offset)
+                        offset += 4
+                        rec = rec + (data[offset:offset + length],)
+                        offset += length
+                    else:
+                        rec = rec + struct.unpack_from('=Q', data, offset)
+                        offset += 8
+                return rec
+        self._decoders[event_id] = decoder
+        return decoder
+
+    def record(self, index):
+        """Decode a record into a tuple (event_num, timestamp, arg1, ..., arg6),
+        as read_record() does."""
+        return self.decode(self.offsets[index])
+
+    def records(self, start=0, stop=None):
+        """Yield decoded records from index start up to, but not including,
+        index stop."""
+        if stop is None or stop > len(self.offsets):
+            stop = len(self.offsets)
+        for i in xrange(start, stop):
+            yield self.record(i)
+
+    def decode(self, offset):
+        """Decode the record at offset, see record()."""
+        event_id, timestamp, _, _ = self.rec_header.unpack_from(self.map, offset)
+        return (event_id, timestamp) + \
+               self._decoder(event_id)(offset + self.rec_header.size)
+
+    def time_index(self, interval=4096, cache=True):
+        """Return the sparse TraceIndex of the file, with a checkpoint every
+        'interval' records.  Unless cache is False, the index is loaded from
+        and saved to a '.idx' file next to the trace, so that it is built
+        only once, and extended if the trace has grown since.  A cached index
+        which does not match the trace is rebuilt."""
+        index = self._time_index
+        idx_file = None
+        if cache and self.filename:
+            idx_file = self.filename + '.idx'
+        if index is None and idx_file:
+            index = TraceIndex.load(idx_file)
+            if index is not None and (index.interval != interval or
+                                      not index.matches(self)):
+                index = None
+        if index is None:
+            index = TraceIndex(interval)
+
+        old_end = index.end
+        if index.end < self.size():
+            index.update(self)
+        if idx_file and index.end != old_end:
+            try:
+                index.save(idx_file)
+            except EnvironmentError:
+                # read-only directory, keep the index in memory only
+                pass
+        self._time_index = index
+        return index
+
+    def records_between(self, start=None, end=None, event_ids=None):
+        """Yield decoded records with start <= timestamp < end, in file order.
+
+        If event_ids is given, only records of these events are yielded.
+        Only the chunks of the time index which overlap the time range are
+        visited, and only matching records are decoded."""
+        index = self.time_index()
+        if event_ids is not None:
+            event_ids = set(event_ids)
+        for chunk_offset, recno in index.chunks(start, end):
+            walk = self.walk(chunk_offset)
+            for i in xrange(index.interval):
+                try:
+                    offset, event_id, timestamp = walk.next()
+                except StopIteration:
+                    break
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp >= end:
+                    continue
+                if event_ids is not None and event_id not in event_ids:
+                    continue
+                yield self.decode(offset)
+
+    def records_from(self, recno, count=None):
+        """Yield decoded records starting with record number recno (counting
+        from 0), without indexing the records before it."""
+        index = self.time_index()
+        if recno >= index.count:
+            return
+        offset, first = index.find(recno)
+        walk = self.walk(offset)
+        for i in xrange(recno - first):
+            walk.next()
+        n = 0
+        for offset, _, _ in walk:
+            if count is not None and n >= count:
+                break
+            yield self.decode(offset)
+            n += 1
+
+    def event_array(self, event):
+        """Return the records of an event, given by name or ID, as a NumPy
+        structured array.  The array has a 'timestamp' field followed by one
+        field per integer argument; string arguments are left out.
+
+        This requires NumPy."""
+        import numpy
+
+        if isinstance(event, str):
+            event = [num for num, e in self.edict.items() if e.name == event][0]
+        args = self.edict[event].args
+        hlen = self.rec_header.size
+        names = ['timestamp'] + [name for type, name in args
+                                 if not is_string(type)]
+        dtype = numpy.dtype([(name, '=u8') for name in names])
+
+        offsets = numpy.frombuffer(self.offsets, dtype=numpy.uint64)
+        event_ids = numpy.frombuffer(self.event_ids, dtype=numpy.uint64)
+        offsets = offsets[event_ids == event].astype(numpy.intp)
+
+        if len(names) - 1 == len(args):
+            # fixed-size records: gather them all with a single index
+            # operation and reinterpret the bytes
+            reclen = hlen + 8 * len(args)
+            data = numpy.frombuffer(self.map, dtype=numpy.uint8)
+            raw = data[offsets[:, None] + numpy.arange(8, reclen)]
+            fields = raw.view('=u8')
+            result = numpy.empty(len(offsets), dtype=dtype)
+            result['timestamp'] = fields[:, 0]
+            for i, name in enumerate(names[1:]):
+                # skip the length and reserved fields of the header
+                result[name] = fields[:, i + 2]
+            return result
+
+        decoder = self._decoder(event)
+        result = numpy.empty(len(offsets), dtype=dtype)
+        for i, offset in enumerate(offsets):
+            rec = decoder(offset + hlen)
+            (timestamp,) = struct.unpack_from('=Q', self.map, offset + 8)
+            result[i] = (timestamp,) + tuple(v for (type, name), v
+                                             in zip(args, rec)
+                                             if not is_string(type))
+        return result
+
+    def close(self):
+        self.map.close()
+        self.fobj.close()
+
 class Analyzer(object):
     """A trace file analyzer which processes trace records.
 
@@ -88,7 +554,18 @@ class Analyzer(object):
     is invoked.
 
     If a method matching a trace event name exists, it is invoked to process
-    that trace record.  Otherwise the catchall() method is invoked."""
+    that trace record.  Otherwise the catchall() method is invoked.
+
+    Analyzers which set the mergeable attribute to True and implement merge()
+    can also be passed to process_parallel(), which splits the trace into
+    shards processed by copies of the analyzer in worker processes.  Each copy has begin_shard() invoked instead of
+    begin(), then processes the records of its shard, and is sent back.  The
+    original analyzer has begin() invoked, then merge() with each copy in
+    trace order, and finally end().  Anything a copy prints is written out
+    right after it is merged, so output stays in trace order.  Other analyzers
+    are run serially by process_parallel()."""
+
+    mergeable = False
 
     def begin(self):
         """Called at the start of the trace."""
@@ -102,84 +579,274 @@ class Analyzer(object):
         """Called at the end of the trace."""
         pass
 
-def process(events, log, analyzer):
-    """Invoke an analyzer on each event in a log."""
+    def begin_shard(self):
+        """Called in a worker process before processing a shard of the trace."""
+        pass
+
+    def flush(self):
+        """Called periodically while following a trace which is still being written."""
+        pass
+
+    def merge(self, other):
+        """Merge the results of another analyzer, which processed the shard
+        following the records seen so far.  Only called if mergeable is
+        True."""
+        pass
+
+def event_ids_by_name(edict, names):
+    """Return the IDs of the named events."""
+    return [num for num, event in edict.items() if event.name in names]
+
+def process(events, log, analyzer, start=None, end=None, event_names=None):
+    """Invoke an analyzer on each event in a log.
+
+    If start or end are given, only records with start <= timestamp < end
+    are processed.  If event_names is given, only records of these events
+    are processed.  Other records are skipped without being decoded."""
     if isinstance(events, str):
         events = _read_events(open(events, 'r'))
     if isinstance(log, str):
         log = open(log, 'rb')
 
-    enabled_events = []
-    dropped_event = Event.build("Dropped_Event(uint64_t num_events_dropped)")
-    edict = {dropped_event_id: dropped_event}
+    edict = build_edict(events)
 
-    for e in events:
-        if 'disable' not in e.properties:
-            enabled_events.append(e)
-    for num, event in enumerate(enabled_events):
-        edict[num] = event
+    event_ids = None
+    if event_names is not None:
+        event_ids = event_ids_by_name(edict, event_names)
+    filtered = start is not None or end is not None or event_ids is not None
 
-    def build_fn(analyzer, event):
-        if isinstance(event, str):
-            return analyzer.catchall
+    # Use a memory-mapped TraceFile for regular files, fall back to reading
+    # records one by one for pipes and other unmappable files
+    try:
+        trace = TraceFile(edict, log)
+        if filtered:
+            records = trace.records_between(start, end, event_ids)
+        else:
+            records = trace.records()
+    except (mmap.error, EnvironmentError, AttributeError, ValueError):
+        records = read_trace_file(edict, log)
+        if filtered:
+            records = (rec for rec in records
+                       if (start is None or rec[1] >= start) and
+                          (end is None or rec[1] < end) and
+                          (event_ids is None or rec[0] in event_ids))
+
+    analyzer.begin()
+    dispatch(edict, analyzer, records)
+    analyzer.end()
 
-        fn = getattr(analyzer, event.name, None)
-        if fn is None:
-            return analyzer.catchall
+def follow(events, log, analyzer, poll_interval=0.2, flush_interval=1.0,
+           stop=None):
+    """Invoke an analyzer on each event of a log which is still being written.
 
-        event_argcount = len(event.args)
-        fn_argcount = len(inspect.getargspec(fn)[0]) - 1
-        if fn_argcount == event_argcount + 1:
-            # Include timestamp as first argument
-            return lambda _, rec: fn(*rec[1:2 + event_argcount])
-        else:
-            # Just arguments, no timestamp
-            return lambda _, rec: fn(*rec[2:2 + event_argcount])
+    New records are passed to the analyzer as they are appended to the log,
+    and analyzer.flush() is invoked every flush_interval seconds.  Following
+    stops when the optional stop() callable returns True once the end of
+    the log has been reached, or on KeyboardInterrupt; analyzer.end() is
+    invoked then."""
+    if isinstance(events, str):
+        events = _read_events(open(events, 'r'))
+    if isinstance(log, str):
+        log = open(log, 'rb')
+
+    edict = build_edict(events)
+
+    def records():
+        next_flush = time.time() + flush_interval
+        for rec in follow_trace_file(edict, log, poll_interval):
+            if rec is not None:
+                yield rec
+            now = time.time()
+            if now >= next_flush:
+                analyzer.flush()
+                next_flush = now + flush_interval
+            if rec is None and stop is not None and stop():
+                return
 
     analyzer.begin()
+    try:
+        dispatch(edict, analyzer, records())
+    except KeyboardInterrupt:
+        pass
+    analyzer.flush()
+    analyzer.end()
+
+def is_mergeable(analyzer):
+    """Return True if an analyzer can be run by process_parallel()."""
+    return getattr(analyzer, 'mergeable', False)
+
+# state of worker processes of process_parallel()
+_shard_trace = None
+
+def _init_shard_worker(edict, filename):
+    global _shard_trace
+    _shard_trace = TraceFile(edict, filename)
+
+def _process_shard(args):
+    analyzer, offset, count = args
+    trace = _shard_trace
+    records = (trace.decode(rec_offset) for rec_offset, _, _
+               in itertools.islice(trace.walk(offset), count))
+
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        analyzer.begin_shard()
+        dispatch(trace.edict, analyzer, records)
+    finally:
+        sys.stdout = stdout
+    return analyzer, output.getvalue()
+
+def process_parallel(events, log, analyzer, jobs=None, shards_per_job=8):
+    """Invoke an analyzer on each event in a log, using several processes.
+
+    The trace is split into shards along the checkpoints of its time index,
+    and the shards are processed by copies of the analyzer in a pool of
+    'jobs' processes (by default, one per CPU).  The copies are then merged
+    into analyzer, see Analyzer.  Analyzers which are not mergeable are run
+    by process() instead."""
+    if isinstance(events, str):
+        events = _read_events(open(events, 'r'))
+    if not isinstance(log, str):
+        log = log.name
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or not is_mergeable(analyzer):
+        return process(events, log, analyzer)
+
+    edict = build_edict(events)
+    try:
+        index = TraceFile(edict, log).time_index()
+    except (mmap.error, EnvironmentError, ValueError):
+        return process(events, log, analyzer)
+
+    # split the checkpoints into shards of roughly equal number of records
+    checkpoints = index.checkpoints
+    per_shard = max(1, len(checkpoints) // (jobs * shards_per_job))
+    shards = []
+    for i in xrange(0, len(checkpoints), per_shard):
+        first = checkpoints[i][3]
+        if i + per_shard < len(checkpoints):
+            count = checkpoints[i + per_shard][3] - first
+        else:
+            count = index.count - first
+        shards.append((analyzer, checkpoints[i][2], count))
+
+    pool = multiprocessing.Pool(jobs, _init_shard_worker, (edict, log))
+    try:
+        analyzer.begin()
+        for shard, output in pool.imap(_process_shard, shards):
+            analyzer.merge(shard)
+            sys.stdout.write(output)
+        analyzer.end()
+    finally:
+        pool.terminate()
+
+def build_fn(analyzer, event):
+    if isinstance(event, str):
+        return analyzer.catchall
+
+    fn = getattr(analyzer, event.name, None)
+    if fn is None:
+        return analyzer.catchall
+
+    event_argcount = len(event.args)
+    fn_argcount = len(inspect.getargspec(fn)[0]) - 1
+    if fn_argcount == event_argcount + 1:
+        # Include timestamp as first argument
+        return lambda _, rec: fn(*rec[1:2 + event_argcount])
+    else:
+        # Just arguments, no timestamp
+        return lambda _, rec: fn(*rec[2:2 + event_argcount])
+
+def dispatch(edict, analyzer, records):
+    """Pass each record to the matching method of an analyzer."""
     fn_cache = {}
-    for rec in read_trace_file(edict, log):
+    for rec in records:
         event_num = rec[0]
         event = edict[event_num]
         if event_num not in fn_cache:
             fn_cache[event_num] = build_fn(analyzer, event)
         fn_cache[event_num](event, rec)
-    analyzer.end()
 
 def run(analyzer):
     """Execute an analyzer on a trace file given on the command-line.
 
     This function is useful as a driver for simple analysis scripts.  More
     advanced scripts will want to call process() instead."""
-    import sys
+    args = sys.argv[1:]
+    jobs = 1
+    follow_log = False
+    while args and args[0].startswith('--'):
+        arg = args.pop(0)
+        if arg.startswith('--jobs='):
+            jobs = int(arg[len('--jobs='):])
+        elif arg == '--follow':
+            follow_log = True
+        else:
+            args = []
+            break
 
-    if len(sys.argv) != 3:
-        sys.stderr.write('usage: %s <trace-events> <trace-file>\n' % sys.argv[0])
+    if len(args) != 2:
+        sys.stderr.write('usage: %s [--jobs=N | --follow] <trace-events> <trace-file>\n' % sys.argv[0])
         sys.exit(1)
 
-    events = _read_events(open(sys.argv[1], 'r'))
-    process(events, sys.argv[2], analyzer)
+    events = _read_events(open(args[0], 'r'))
+    if follow_log:
+        follow(events, args[1], analyzer)
+    elif jobs > 1:
+        process_parallel(events, args[1], analyzer, jobs)
+    else:
+        process(events, args[1], analyzer)
 
-if __name__ == '__main__':
-    class Formatter(Analyzer):
-        def __init__(self):
-            self.last_timestamp = None
+class Formatter(Analyzer):
+    """Print each record with the time elapsed since the previous one."""
 
-        def catchall(self, event, rec):
-            i = 1
-            timestamp = rec[1]
-            if self.last_timestamp is None:
-                self.last_timestamp = timestamp
-            delta_ns = timestamp - self.last_timestamp
-            self.last_timestamp = timestamp
+    mergeable = True
+
+    def __init__(self):
+        self.last_timestamp = None
+        # in a shard, the first record is printed by merge(), once the
+        # timestamp of the record preceding it is known
+        self.in_shard = False
+        self.first = None
 
-            fields = [event.name, '%0.3f' % (delta_ns / 1000.0)]
-            for type, name in event.args:
-                if is_string(type):
-                    fields.append('%s=%s' % (name, rec[i + 1]))
-                else:
-                    fields.append('%s=0x%x' % (name, rec[i + 1]))
-                i += 1
-            print ' '.join(fields)
+    def begin_shard(self):
+        self.in_shard = True
 
+    def flush(self):
+        sys.stdout.flush()
+
+    def format(self, event, rec, delta_ns):
+        i = 1
+        fields = [event.name, '%0.3f' % (delta_ns / 1000.0)]
+        for type, name in event.args:
+            if is_string(type):
+                fields.append('%s=%s' % (name, rec[i + 1]))
+            else:
+                fields.append('%s=0x%x' % (name, rec[i + 1]))
+            i += 1
+        return ' '.join(fields)
+
+    def catchall(self, event, rec):
+        timestamp = rec[1]
+        if self.last_timestamp is None:
+            self.last_timestamp = timestamp
+            if self.in_shard:
+                self.first = (event, rec)
+                return
+        delta_ns = timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+        print self.format(event, rec, delta_ns)
+
+    def merge(self, other):
+        if other.first is not None:
+            event, rec = other.first
+            if self.last_timestamp is None:
+                self.last_timestamp = rec[1]
+            print self.format(event, rec, rec[1] - self.last_timestamp)
+        if other.last_timestamp is not None:
+            self.last_timestamp = other.last_timestamp
+
+if __name__ == '__main__':
     run(Formatter())
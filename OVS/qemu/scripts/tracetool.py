@@ -33,6 +33,7 @@ def error_opt(msg = None):
                                for n,d in tracetool.format.get_list() ])
     error_write("""\
 Usage: %(script)s --format=<format> --backend=<backend> [<options>]
+       %(script)s --output=<format>:<file> ... --backend=<backend> [<options>]
 
 Backends:
 %(backends)s
@@ -44,6 +45,11 @@ Options:
     --help                   This help message.
     --list-backends          Print list of available backends.
     --check-backend          Check if the given backend is valid.
+    --output <format>:<file> Write the given format to a file instead of
+                             standard output; can be repeated to generate
+                             several formats from a single parse.  Files
+                             are only rewritten if their contents change.
+    --cache <file>           Cache parsed events in the given file.
     --binary <path>          Full path to QEMU binary.
     --target-type <type>     QEMU emulator target type ('system' or 'user').
     --target-arch <arch>     QEMU emulator target arch.
@@ -67,6 +73,7 @@ def main(args):
 
     long_opts  = [ "backend=", "format=", "help", "list-backends", "check-backend" ]
     long_opts += [ "binary=", "target-type=", "target-arch=", "probe-prefix=" ]
+    long_opts += [ "output=", "cache=" ]
 
     try:
         opts, args = getopt.getopt(args[1:], "", long_opts)
@@ -80,6 +87,8 @@ def main(args):
     target_type = None
     target_arch = None
     probe_prefix = None
+    outputs = []
+    cache = None
     for opt, arg in opts:
         if opt == "--help":
             error_opt()
@@ -105,6 +114,13 @@ def main(args):
         elif opt == '--probe-prefix':
             probe_prefix = arg
 
+        elif opt == "--output":
+            if ":" not in arg:
+                error_opt("invalid output, expected <format>:<file>: %s" % arg)
+            outputs.append(tuple(arg.split(":", 1)))
+        elif opt == "--cache":
+            cache = arg
+
         else:
             error_opt("unhandled option: %s" % opt)
 
@@ -117,7 +133,11 @@ def main(args):
         else:
             sys.exit(1)
 
-    if arg_format == "stap":
+    if arg_format and outputs:
+        error_opt("--format and --output are mutually exclusive")
+
+    formats = [ arg_format ] + [ f for f,_ in outputs ]
+    if "stap" in formats:
         if binary is None:
             error_opt("--binary is required for SystemTAP tapset generator")
         if probe_prefix is None and target_type is None:
@@ -129,8 +149,14 @@ def main(args):
             probe_prefix = ".".join([ "qemu", target_type, target_arch ])
 
     try:
-        tracetool.generate(sys.stdin, arg_format, arg_backend,
-                           binary = binary, probe_prefix = probe_prefix)
+        if outputs:
+            tracetool.generate_outputs(sys.stdin, outputs, arg_backend,
+                                       binary = binary,
+                                       probe_prefix = probe_prefix,
+                                       cache = cache)
+        else:
+            tracetool.generate(sys.stdin, arg_format, arg_backend,
+                               binary = binary, probe_prefix = probe_prefix)
     except tracetool.TracetoolError, e:
         error_opt(str(e))
 
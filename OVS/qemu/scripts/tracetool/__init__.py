@@ -15,7 +15,9 @@ __email__      = "stefanha@linux.vnet.ibm.com"
 
 import re
 import sys
+import StringIO
 
+from genutil import write_if_changed, cache_key, load_cache, save_cache
 import tracetool.format
 import tracetool.backend
 
@@ -183,6 +185,27 @@ def _read_events(fobj):
         res.append(Event.build(line))
     return res
 
+def read_events_cached(fevents, cache_file):
+    """Read events like _read_events(), through a cache.
+
+    The parsed events are pickled to cache_file together with a hash of the
+    event description and of this module, and loaded from there as long as
+    both are unchanged.
+
+    Parameters
+    ----------
+    fevents : file
+        Event description file.
+    cache_file : str
+        Path of the cache file.
+    """
+    data = fevents.read()
+    key = cache_key(data, sys.modules[__name__])
+    events = load_cache(cache_file, key)
+    if events is None:
+        events = _read_events(StringIO.StringIO(data))
+        save_cache(cache_file, key, events)
+    return events
 
 class TracetoolError (Exception):
     """Exception for calls to generate."""
@@ -215,26 +238,8 @@ def try_import(mod_name, attr_name = None, attr_default = None):
         return False, None
 
 
-def generate(fevents, format, backend,
-             binary = None, probe_prefix = None):
-    """Generate the output for the given (format, backend) pair.
-
-    Parameters
-    ----------
-    fevents : file
-        Event description file.
-    format : str
-        Output format name.
-    backend : str
-        Output backend name.
-    binary : str or None
-        See tracetool.backend.dtrace.BINARY.
-    probe_prefix : str or None
-        See tracetool.backend.dtrace.PROBEPREFIX.
-    """
-    # fix strange python error (UnboundLocalError tracetool)
-    import tracetool
-
+def _check_format(format, backend):
+    """Check a (format, backend) pair, returning their module names."""
     format = str(format)
     if len(format) is 0:
         raise TracetoolError("format not set")
@@ -253,12 +258,18 @@ def generate(fevents, format, backend,
         raise TracetoolError("backend '%s' not compatible with format '%s'" %
                              (backend, format))
 
+    return mformat, mbackend
+
+def _generate(events, format, backend, binary, probe_prefix):
+    # fix strange python error (UnboundLocalError tracetool)
+    import tracetool
+
+    mformat, _ = _check_format(format, backend)
+
     import tracetool.backend.dtrace
     tracetool.backend.dtrace.BINARY = binary
     tracetool.backend.dtrace.PROBEPREFIX = probe_prefix
 
-    events = _read_events(fevents)
-
     if backend == "nop":
         ( e.properies.add("disable") for e in events )
 
@@ -272,3 +283,65 @@ def generate(fevents, format, backend,
                                  for e in events
                                  if "disable" not in e.properties ])
     tracetool.format.generate_end(mformat, events)
+
+
+def generate(fevents, format, backend,
+             binary = None, probe_prefix = None):
+    """Generate the output for the given (format, backend) pair.
+
+    Parameters
+    ----------
+    fevents : file
+        Event description file.
+    format : str
+        Output format name.
+    backend : str
+        Output backend name.
+    binary : str or None
+        See tracetool.backend.dtrace.BINARY.
+    probe_prefix : str or None
+        See tracetool.backend.dtrace.PROBEPREFIX.
+    """
+    _check_format(format, backend)
+    events = _read_events(fevents)
+    _generate(events, format, backend, binary, probe_prefix)
+
+
+def generate_outputs(fevents, outputs, backend,
+                     binary = None, probe_prefix = None, cache = None):
+    """Generate several formats for a backend from a single parse.
+
+    Each output is generated in memory, and written to its file only if its
+    contents changed (see write_if_changed).
+
+    Parameters
+    ----------
+    fevents : file
+        Event description file.
+    outputs : list of (str, str)
+        Pairs of output format name and output file path.
+    backend : str
+        Output backend name.
+    binary : str or None
+        See tracetool.backend.dtrace.BINARY.
+    probe_prefix : str or None
+        See tracetool.backend.dtrace.PROBEPREFIX.
+    cache : str or None
+        Path of a parsed events cache file (see read_events_cached).
+    """
+    for format, _ in outputs:
+        _check_format(format, backend)
+
+    if cache is None:
+        events = _read_events(fevents)
+    else:
+        events = read_events_cached(fevents, cache)
+
+    for format, path in outputs:
+        stdout = sys.stdout
+        sys.stdout = output = StringIO.StringIO()
+        try:
+            _generate(events, format, backend, binary, probe_prefix)
+        finally:
+            sys.stdout = stdout
+        write_if_changed(path, output.getvalue())
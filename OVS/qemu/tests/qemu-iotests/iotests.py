@@ -20,12 +20,13 @@ import os
 import re
 import subprocess
 import string
+import hashlib
 import unittest
 import sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'QMP'))
 import qmp
 
 __all__ = ['imgfmt', 'imgproto', 'test_dir' 'qemu_img', 'qemu_io',
-           'VM', 'QMPTestCase', 'notrun', 'main']
+           'cached_image', 'VM', 'QMPTestCase', 'notrun', 'main']
 
 # This will not work if arguments or path contain spaces but is necessary if we
 # want to support the override options that ./check supports.
@@ -36,11 +37,71 @@ qemu_args = os.environ.get('QEMU', 'qemu').strip().split(' ')
 imgfmt = os.environ.get('IMGFMT', 'raw')
 imgproto = os.environ.get('IMGPROTO', 'file')
 test_dir = os.environ.get('TEST_DIR', '/var/tmp')
+image_cache_dir = os.environ.get('IMAGE_CACHE_DIR')
+
+def copy_image(src, dst):
+    '''Copy an image file, keeping it sparse'''
+    subprocess.check_call(['cp', '--sparse=always', src, dst])
+
+def cached_image(path, recipe, create):
+    '''Create an image by calling create(path), or copy it from the image cache
+
+    recipe must describe the contents of the image completely, since images
+    are stored in the cache under a hash of it.  The cache is only used if
+    IMAGE_CACHE_DIR is set, which the parallel test runner does.  create()
+    returns an exit code, and the image is only cached if it is zero.'''
+    if not image_cache_dir:
+        return create(path)
+
+    key = hashlib.sha1(repr(recipe)).hexdigest()
+    cached = os.path.join(image_cache_dir, key)
+    if not os.path.exists(cached):
+        tmp = '%s.%d' % (cached, os.getpid())
+        ret = create(tmp)
+        if ret != 0:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return ret
+        os.rename(tmp, cached)
+    copy_image(cached, path)
+    return 0
+
+def qemu_img_binary():
+    '''Return a tuple identifying the qemu-img binary'''
+    prog = qemu_img_args[0]
+    for d in [''] + os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(d, prog)
+        if (d or os.sep in prog) and os.access(path, os.X_OK):
+            st = os.stat(path)
+            return (os.path.realpath(path), st.st_size, st.st_mtime)
+    return (prog,)
+
+create_opts_with_arg = ['-f', '-o', '-b', '-F']
 
 def qemu_img(*args):
-    '''Run qemu-img and return the exit code'''
+    '''Run qemu-img and return the exit code
+
+    Images created without a backing file are taken from the image cache if
+    one is in use, see cached_image().'''
     devnull = open('/dev/null', 'r+')
-    return subprocess.call(qemu_img_args + list(args), stdin=devnull, stdout=devnull)
+    run = lambda args: subprocess.call(qemu_img_args + list(args), stdin=devnull, stdout=devnull)
+
+    if not image_cache_dir or not args or args[0] != 'create' or \
+       '-b' in args or [a for a in args if 'backing_file' in a]:
+        return run(args)
+
+    # find the file name, the first argument which is not an option
+    i = 1
+    while i < len(args) and args[i].startswith('-'):
+        if args[i] in create_opts_with_arg:
+            i += 1
+        i += 1
+    if i >= len(args):
+        return run(args)
+
+    recipe = ('qemu-img', qemu_img_binary(), args[:i], args[i + 1:])
+    return cached_image(args[i], recipe,
+                        lambda path: run(args[:i] + (path,) + args[i + 1:]))
 
 def qemu_img_verbose(*args):
     '''Run qemu-img without suppressing its output and return the exit code'''
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+#
+# Scan the metadata of many qcow2 and QED images
+#
+# Copyright (C) 2013 IBM Corp.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+#
+# Each image is mapped into memory, and its L1, L2 and refcount tables are
+# decoded as NumPy arrays.  From these, allocation, fragmentation and leak
+# statistics are computed without a Python loop over table entries.  Images
+# are scanned in parallel by a pool of worker processes.
+#
+# Table entries are read as signed 64-bit integers, so that bit operations
+# with Python integers stay in integer arithmetic.
+
+import sys
+import mmap
+import json
+import struct
+import optparse
+import multiprocessing
+import numpy as np
+
+import qed
+from qcow2 import QcowHeader
+
+QCOW2_MAGIC = 0x514649fb
+QED_MAGIC = 0x00444551
+
+QCOW_OFLAG_COMPRESSED = 1 << 62
+QCOW_OFLAG_ZERO = 1
+L1E_OFFSET_MASK = 0x00fffffffffffe00
+L2E_OFFSET_MASK = 0x00fffffffffffe00
+
+QED_ZERO_CLUSTER = 1
+
+snapshot_header_fmt = '>QIHHIIQII'
+
+class ImageError(Exception):
+    pass
+
+def table(mm, offset, count, dtype):
+    '''Return count entries of a table at offset, as a NumPy array'''
+    if offset + count * np.dtype(dtype).itemsize > len(mm):
+        raise ImageError('table at %#x extends beyond the end of the file' % offset)
+    return np.frombuffer(mm, dtype=dtype, count=count, offset=offset)
+
+def tables(mm, offsets, count, dtype):
+    '''Concatenate the tables at the given offsets'''
+    if not len(offsets):
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate([table(mm, int(o), count, dtype) for o in offsets])
+
+def fragments(host_clusters):
+    '''Number of contiguous runs in a sequence of host cluster indices'''
+    if not len(host_clusters):
+        return 0
+    return 1 + int(np.count_nonzero(np.diff(host_clusters) != 1))
+
+def data_stats(stats, host_clusters, virtual_clusters):
+    stats['virtual_clusters'] = virtual_clusters
+    stats['allocated_clusters'] = len(host_clusters)
+    stats['allocation'] = virtual_clusters and \
+                          float(len(host_clusters)) / virtual_clusters
+    stats['fragments'] = fragments(host_clusters)
+    stats['fragmentation'] = len(host_clusters) > 1 and \
+        float(stats['fragments'] - 1) / (len(host_clusters) - 1) or 0.0
+
+def scan_qcow2(f, mm):
+    h = QcowHeader(f)
+    if h.refcount_order != 4:
+        raise ImageError('unsupported refcount order %d' % h.refcount_order)
+    cluster_bits = h.cluster_bits
+    cluster_size = h.cluster_size
+    l2_entries = cluster_size / 8
+    file_clusters = (len(mm) + cluster_size - 1) >> cluster_bits
+
+    # Cluster indices referenced by the image metadata and data; the
+    # expected refcount of each cluster is its number of occurrences
+    refs = [np.array([0], dtype=np.int64)]
+
+    def add_range(offset, size):
+        first = offset >> cluster_bits
+        last = (offset + size - 1) >> cluster_bits
+        refs.append(np.arange(first, last + 1, dtype=np.int64))
+
+    def scan_l1(l1_offset, l1_size):
+        add_range(l1_offset, l1_size * 8)
+        l1 = table(mm, l1_offset, l1_size, '>i8') & L1E_OFFSET_MASK
+        l2_offsets = l1[l1 != 0]
+        refs.append((l2_offsets >> cluster_bits).astype(np.int64))
+        l2 = tables(mm, l2_offsets, l2_entries, '>i8')
+
+        compressed = (l2 & QCOW_OFLAG_COMPRESSED) != 0
+        normal = l2 & L2E_OFFSET_MASK
+        normal = normal[(normal != 0) & ~compressed]
+        refs.append((normal >> cluster_bits).astype(np.int64))
+
+        # compressed clusters: host offset and number of 512 byte sectors
+        csize_shift = 62 - (cluster_bits - 8)
+        c = l2[compressed]
+        c_offset = c & ((1 << csize_shift) - 1)
+        c_sectors = ((c >> csize_shift) & ((1 << (cluster_bits - 8)) - 1)) + 1
+        c_first = c_offset >> cluster_bits
+        c_last = ((c_offset & ~511) + c_sectors * 512 - 1) >> cluster_bits
+        for n in np.unique(c_last - c_first):
+            sel = (c_last - c_first) == n
+            for i in xrange(int(n) + 1):
+                refs.append((c_first[sel] + i).astype(np.int64))
+        return l2, normal, compressed
+
+    # active L1 table
+    l2, normal, compressed = scan_l1(h.l1_table_offset, h.l1_size)
+    virtual_clusters = (h.size + cluster_size - 1) >> cluster_bits
+    stats = {}
+    data_stats(stats, (normal >> cluster_bits).astype(np.int64),
+               virtual_clusters)
+    stats['compressed_clusters'] = int(np.count_nonzero(compressed))
+    stats['zero_clusters'] = int(np.count_nonzero(
+        (l2 & QCOW_OFLAG_ZERO) != 0)) if h.version >= 3 else 0
+
+    # snapshot table and snapshot L1 tables
+    offset = h.snapshot_offset
+    for i in xrange(h.nb_snapshots):
+        (l1_offset, l1_size, id_len, name_len, _, _, _, _,
+         extra_len) = struct.unpack_from(snapshot_header_fmt, mm, offset)
+        offset += struct.calcsize(snapshot_header_fmt) + extra_len + \
+                  id_len + name_len
+        offset = (offset + 7) & ~7
+        scan_l1(l1_offset, l1_size)
+    if h.nb_snapshots:
+        add_range(h.snapshot_offset, offset - h.snapshot_offset)
+
+    # refcount table and blocks
+    rt_entries = h.refcount_table_clusters * cluster_size / 8
+    add_range(h.refcount_table_offset, rt_entries * 8)
+    rt = table(mm, h.refcount_table_offset, rt_entries, '>i8')
+    block_entries = cluster_size / 2
+    blocks = np.flatnonzero(rt)
+    refcounts = np.zeros(len(blocks) and (blocks[-1] + 1) * block_entries,
+                         dtype=np.int64)
+    for i in blocks:
+        block = int(rt[i])
+        refs.append(np.array([block >> cluster_bits], dtype=np.int64))
+        refcounts[i * block_entries:(i + 1) * block_entries] = \
+            table(mm, block, block_entries, '>u2')
+
+    refs = np.concatenate(refs)
+    n = max(file_clusters, len(refcounts), int(refs.max()) + 1)
+    expected = np.bincount(refs, minlength=n)
+    refcounts = np.concatenate([refcounts,
+                                np.zeros(n - len(refcounts), dtype=np.int64)])
+
+    stats['format'] = 'qcow2'
+    stats['cluster_size'] = cluster_size
+    stats['file_clusters'] = file_clusters
+    stats['snapshots'] = h.nb_snapshots
+    stats['leaked_clusters'] = int(np.count_nonzero((refcounts > 0) &
+                                                    (expected == 0)))
+    stats['refcount_errors'] = int(np.count_nonzero(refcounts < expected))
+    stats['beyond_eof'] = int(np.count_nonzero(expected[file_clusters:]))
+    return stats
+
+def scan_qed(f, mm):
+    header = qed.unpack_header(mm[:qed.header_size])
+    cluster_size = header['cluster_size']
+    cluster_bits = cluster_size.bit_length() - 1
+    table_size = header['table_size'] * cluster_size
+    table_entries = table_size / qed.table_elem_size
+    file_clusters = (len(mm) + cluster_size - 1) >> cluster_bits
+
+    l1 = table(mm, header['l1_table_offset'], table_entries, '<i8')
+    l2_offsets = l1[l1 != 0]
+    l2 = tables(mm, l2_offsets, table_entries, '<i8')
+    data = l2[l2 > QED_ZERO_CLUSTER]
+
+    def table_clusters(offsets):
+        first = (offsets >> cluster_bits).astype(np.int64)
+        return (first[:, None] + np.arange(header['table_size'])).ravel()
+
+    refs = np.concatenate([
+        np.arange(header['header_size'], dtype=np.int64),
+        table_clusters(np.array([header['l1_table_offset']], dtype=np.int64)),
+        table_clusters(l2_offsets),
+        (data >> cluster_bits).astype(np.int64)])
+    n = max(file_clusters, int(refs.max()) + 1)
+    counts = np.bincount(refs, minlength=n)
+
+    stats = {}
+    virtual_clusters = (header['image_size'] + cluster_size - 1) >> cluster_bits
+    data_stats(stats, (data >> cluster_bits).astype(np.int64), virtual_clusters)
+    stats['format'] = 'qed'
+    stats['cluster_size'] = cluster_size
+    stats['file_clusters'] = file_clusters
+    stats['zero_clusters'] = int(np.count_nonzero(l2 == QED_ZERO_CLUSTER))
+    stats['need_check'] = bool(header['features'] & qed.QED_F_NEED_CHECK)
+    # QED has no refcounts: clusters not referenced by any table are leaked,
+    # clusters referenced more than once are errors
+    stats['leaked_clusters'] = int(np.count_nonzero(counts[:file_clusters] == 0))
+    stats['refcount_errors'] = int(np.count_nonzero(counts > 1))
+    stats['beyond_eof'] = int(np.count_nonzero(counts[file_clusters:]))
+    return stats
+
+def scan_image(filename):
+    '''Return a dict of statistics about an image'''
+    stats = {'filename': filename}
+    try:
+        f = open(filename, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                magic = struct.unpack_from('>I', mm, 0)[0]
+                if magic == QCOW2_MAGIC:
+                    stats.update(scan_qcow2(f, mm))
+                elif struct.unpack_from('<I', mm, 0)[0] == QED_MAGIC:
+                    stats.update(scan_qed(f, mm))
+                else:
+                    raise ImageError('not a qcow2 or QED image')
+            finally:
+                mm.close()
+        finally:
+            f.close()
+    except (ImageError, EnvironmentError, mmap.error, struct.error), e:
+        stats['error'] = str(e)
+    return stats
+
+def print_stats(stats):
+    if 'error' in stats:
+        print '%s: error: %s' % (stats['filename'], stats['error'])
+        return
+    print '%s: %s, %.1f%% allocated, %d fragments (%.1f%%), ' \
+          '%d leaked clusters, %d refcount errors' % \
+          (stats['filename'], stats['format'], stats['allocation'] * 100,
+           stats['fragments'], stats['fragmentation'] * 100,
+           stats['leaked_clusters'], stats['refcount_errors'])
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] <image>...')
+    parser.add_option('-j', '--jobs', type='int', default=None,
+                      help='number of worker processes (default: one per CPU)')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print one JSON object per image')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('no images given')
+
+    if options.jobs == 1:
+        results = map(scan_image, args)
+    else:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.imap_unordered(scan_image, args, chunksize=16)
+
+    failed = False
+    for stats in results:
+        if options.json:
+            print json.dumps(stats, sort_keys=True)
+        else:
+            print_stats(stats)
+        failed = failed or 'error' in stats or stats['refcount_errors'] > 0
+    sys.exit(failed and 1 or 0)
+
+if __name__ == '__main__':
+    main()